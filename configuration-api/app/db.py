@@ -3,7 +3,10 @@ from typing import Optional
 import redis
 from flask import g, Flask
 
+from .metrics import migrate_metrics
+
 db_pool: Optional[redis.ConnectionPool] = None
+db_migrated = False
 
 
 def get_db() -> redis.Redis:
@@ -12,8 +15,12 @@ def get_db() -> redis.Redis:
 
     :return: instance of Redis
     """
+    global db_migrated
     if "db" not in g:
         g.db = redis.Redis(connection_pool=db_pool)
+        if not db_migrated:
+            migrate_metrics(g.db)
+            db_migrated = True
     return g.db
 
 
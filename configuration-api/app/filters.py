@@ -0,0 +1,341 @@
+import re
+from functools import lru_cache
+from typing import Dict, Iterator, List, NamedTuple, Optional, Set, Tuple, Union
+
+
+class Condition(NamedTuple):
+    """
+    Comparison of MO property with a value, e.g. eq(fvTenant.name, "common").
+    """
+
+    operator: str
+    prop: str
+    value: str
+
+
+class Group(NamedTuple):
+    """
+    Logical operation on nested filters, e.g. and(eq(...), ne(...)).
+    """
+
+    operator: str
+    children: Tuple["Node", ...]
+
+
+Node = Union[Condition, Group]
+
+
+class QueryFilterError(TypeError):
+    """
+    Invalid query filter, with position where the problem has been found.
+    """
+
+    def __init__(self, reason: str, position: int):
+        super().__init__(f"invalid query filter: {reason} at position {position}")
+        self.reason = reason
+        self.position = position
+
+
+class Token(NamedTuple):
+    kind: str
+    value: str
+    position: int
+
+
+COMPARISON_OPERATORS = {"eq", "ne", "lt", "le", "gt", "ge", "wcard"}
+GROUP_OPERATORS = {"and", "or"}
+
+_whitespace_pattern = re.compile(r"\s*")
+_token_pattern = re.compile(
+    r"(?P<name>[a-zA-Z0-9_]+(?:\.[a-zA-Z0-9_]+)*)"
+    r'|(?P<string>"(?:[^"\\]|\\.)*")'
+    r"|(?P<punct>[(),])"
+)
+
+
+def _tokenize(query: str) -> Iterator[Token]:
+    """
+    Split query filter into tokens in a single pass.
+
+    :param query: query filter
+    :return: tokens, finished with "end" token
+    :raises QueryFilterError: when there is unexpected character
+    """
+    offset = 0
+    while True:
+        offset = _whitespace_pattern.match(query, offset).end()  # type: ignore
+        if offset == len(query):
+            yield Token("end", "", offset)
+            return
+        match = _token_pattern.match(query, offset)
+        if not match:
+            raise QueryFilterError("unexpected character", offset)
+        kind = match.lastgroup or "punct"
+        yield Token(kind if kind != "punct" else match.group(), match.group(), offset)
+        offset = match.end()
+
+
+def _unquote(value: str) -> str:
+    # Only quotes are escaped, other backslashes are part of the value (e.g. "\d")
+    return value[1:-1].replace('\\"', '"')
+
+
+def _parse(query: str) -> Node:
+    """
+    Parse query filter iteratively, so nesting depth is not limited by the stack.
+
+    :param query: query filter
+    :return: root node
+    :raises QueryFilterError: when the filter is invalid
+    """
+    tokens = _tokenize(query)
+
+    def expect(kind: str, description: str) -> Token:
+        token = next(tokens)
+        if token.kind != kind:
+            raise QueryFilterError(f"expected {description}", token.position)
+        return token
+
+    # Groups that are not closed yet, with their children parsed so far
+    stack: List[Tuple[str, List[Node]]] = []
+    while True:
+        token = expect("name", "operator")
+        operator = token.value
+        if operator in GROUP_OPERATORS:
+            expect("(", "(")
+            stack.append((operator, []))
+            continue
+        if operator not in COMPARISON_OPERATORS:
+            raise QueryFilterError(f"unknown operator {operator}", token.position)
+        expect("(", "(")
+        prop = expect("name", "property name").value
+        expect(",", ",")
+        value = _unquote(expect("string", "quoted value").value)
+        expect(")", ")")
+        node: Node = Condition(operator, prop, value)
+
+        # Close all groups finished after this node
+        while stack:
+            stack[-1][1].append(node)
+            token = next(tokens)
+            if token.kind == ",":
+                break
+            if token.kind != ")":
+                raise QueryFilterError("expected , or )", token.position)
+            operator, children = stack.pop()
+            node = Group(operator, tuple(children))
+        else:
+            expect("end", "end of query filter")
+            return node
+
+
+@lru_cache(maxsize=4096)
+def parse_query_filter(query: str) -> Optional[Node]:
+    """
+    Parse query filter into a tree.
+    Results are cached, as the same filters are validated and used repeatedly.
+
+    :param query: query filter
+    :return: root node, or None for empty filter
+    :raises QueryFilterError: when the filter is invalid
+    """
+    if query == "":
+        return None
+    return _parse(query)
+
+
+def _format_condition(node: Condition) -> str:
+    value = node.value.replace('"', '\\"')
+    return f'{node.operator}({node.prop},"{value}")'
+
+
+def format_query_filter(node: Optional[Node]) -> str:
+    """
+    Serialize query filter tree back to the APIC syntax.
+
+    :param node: root node, or None for empty filter
+    :return: query filter
+    """
+    if node is None:
+        return ""
+
+    # Iterate in post-order, as nesting may be deep
+    results: List[str] = []
+    stack: List[Tuple[Node, bool]] = [(node, False)]
+    while stack:
+        current, visited = stack.pop()
+        if isinstance(current, Condition):
+            results.append(_format_condition(current))
+        elif not visited:
+            stack.append((current, True))
+            stack.extend((child, False) for child in reversed(current.children))
+        else:
+            start = len(results) - len(current.children)
+            children = ",".join(results[start:])
+            del results[start:]
+            results.append(f"{current.operator}({children})")
+    return results[0]
+
+
+class Normalized(NamedTuple):
+    """
+    Normalized node with its canonical form, and normalized children of groups,
+    so every node is formatted only once.
+    """
+
+    node: Node
+    text: str
+    children: Tuple["Normalized", ...] = ()
+
+
+# Constants appearing while folding, i.e. always matching or never matching filter
+TRUE = Normalized(Group("and", ()), "and()")
+FALSE = Normalized(Group("or", ()), "or()")
+
+
+# Values compared the same way regardless of the property type: numbers,
+# and plain names (enum values, object names)
+_number_pattern = re.compile(r"-?[0-9]+(?:\.[0-9]+)?")
+_name_pattern = re.compile(r"[a-zA-Z_][a-zA-Z0-9_-]*")
+
+
+def _distinct(value: str, other: str) -> bool:
+    """
+    Check the values are plainly different, however the APIC types the property.
+    Numeric properties are compared as numbers, so "1" equals "1.0", and values
+    that may be normalized (addresses, timestamps) are never considered distinct.
+
+    :param value: value
+    :param other: other value
+    :return: True when no property can be equal to both values
+    """
+    if _number_pattern.fullmatch(value) and _number_pattern.fullmatch(other):
+        return float(value) != float(other)
+    if _name_pattern.fullmatch(value) and _name_pattern.fullmatch(other):
+        return value.lower() != other.lower()
+    return False
+
+
+def _any_distinct(values: Set[str], others: Set[str]) -> bool:
+    return any(_distinct(x, y) for x in values for y in others)
+
+
+def _fold_equality(operator: str, children: List[Normalized]) -> List[Normalized]:
+    """
+    Fold eq/ne conditions on the same property.
+    Each property has a single value, so i.e. and(eq(p,"1"),ne(p,"2")) is eq(p,"1").
+    Conditions are folded only when their values are the same, or plainly distinct.
+
+    :param operator: "and" or "or"
+    :param children: normalized, unique children
+    :return: folded children, or [FALSE]/[TRUE] when the group is constant
+    """
+    equal: Dict[str, Set[str]] = {}
+    not_equal: Dict[str, Set[str]] = {}
+    for child in children:
+        node = child.node
+        if isinstance(node, Condition) and node.operator == "eq":
+            equal.setdefault(node.prop, set()).add(node.value)
+        elif isinstance(node, Condition) and node.operator == "ne":
+            not_equal.setdefault(node.prop, set()).add(node.value)
+
+    result = []
+    for child in children:
+        node = child.node
+        if not isinstance(node, Condition) or node.operator not in ("eq", "ne"):
+            result.append(child)
+            continue
+        values = equal.get(node.prop, set())
+        other_values = not_equal.get(node.prop, set())
+        if operator == "and":
+            # Property can't be equal to two values, or equal and not equal to one
+            if values & other_values or _any_distinct(values, values):
+                return [FALSE]
+            # Not equal condition is implied by equal one
+            if node.operator == "ne" and _any_distinct({node.value}, values):
+                continue
+        else:
+            # Property is always either equal or not equal to the value,
+            # and is always not equal to one of two different values
+            if values & other_values or _any_distinct(other_values, other_values):
+                return [TRUE]
+            # Equal condition is implied by not equal one
+            if node.operator == "eq" and _any_distinct({node.value}, other_values):
+                continue
+        result.append(child)
+    return result
+
+
+def _normalize(node: Node) -> Normalized:
+    """
+    Normalize query filter tree bottom-up.
+
+    :param node: root node
+    :return: normalized node, TRUE or FALSE when it's constant
+    """
+    # Iterate in post-order, as nesting may be deep
+    results: List[Normalized] = []
+    stack: List[Tuple[Node, bool]] = [(node, False)]
+    while stack:
+        current, visited = stack.pop()
+        if isinstance(current, Condition):
+            results.append(Normalized(current, _format_condition(current)))
+            continue
+        if not visited:
+            stack.append((current, True))
+            stack.extend((child, False) for child in reversed(current.children))
+            continue
+
+        operator = current.operator
+        absorbing, neutral = (FALSE, TRUE) if operator == "and" else (TRUE, FALSE)
+        start = len(results) - len(current.children)
+        nested = results[start:]
+        del results[start:]
+
+        # Flatten nested groups with the same operator, and drop neutral constants,
+        # reusing canonical forms of the children for deduplication and sorting
+        unique: Dict[str, Normalized] = {}
+        for child in nested:
+            if isinstance(child.node, Group) and child.node.operator == operator:
+                unique.update((x.text, x) for x in child.children)
+            elif child != neutral:
+                unique[child.text] = child
+
+        if absorbing in unique.values():
+            children = [absorbing]
+        else:
+            children = _fold_equality(operator, [unique[x] for x in sorted(unique)])
+        if len(children) == 1:
+            results.append(children[0])
+            continue
+        results.append(
+            Normalized(
+                Group(operator, tuple(x.node for x in children)),
+                f"{operator}({','.join(x.text for x in children)})",
+                tuple(children),
+            )
+        )
+    return results[0]
+
+
+@lru_cache(maxsize=4096)
+def normalize_query_filter(query: str) -> str:
+    """
+    Build canonical, minimized form of the query filter:
+    nested groups are flattened, conditions are deduplicated and sorted,
+    and constant parts are folded.
+
+    :param query: query filter
+    :return: normalized query filter
+    :raises QueryFilterError: when the filter is invalid
+    """
+    node = parse_query_filter(query)
+    if node is None:
+        return ""
+    normalized = _normalize(node)
+    if normalized == TRUE:
+        return ""
+    if normalized == FALSE:
+        # Filter never matches, but there is no such constant in APIC syntax
+        return format_query_filter(node)
+    return normalized.text
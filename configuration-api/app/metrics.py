@@ -1,47 +1,40 @@
-from typing import List
+from typing import Any, List, Optional, cast
 from json import loads, dumps
 from re import match
 
 import redis
 
+from .filters import normalize_query_filter, parse_query_filter
 
-def _validate_next_segment(query: str, offset: int) -> int:
-    """
-    Validate next query segment.
+REQUIRED_METRIC_KEYS = {"name", "className", "attributes", "queryFilter", "interval"}
+OPTIONAL_METRIC_KEYS = {
+    "mode",
+    "converter",
+    "includeHealth",
+    "fabrics",
+    "dnLabels",
+    "aggregation",
+}
 
-    :param query: query filter
-    :param offset: index to start
-    :return: index when ended successfully
-    """
-    part = query[offset:]
+# Converters of attribute values, besides the map of enum values to numbers
+CONVERTERS = {"float", "int", "bool"}
 
-    # Detect regular function
-    match_regular = match(
-        r"^\s*((eq|le|lt|ge|gt|ne|wcard)\s*\(\s*[a-zA-Z0-9_]+(\.[a-zA-Z0-9_]+)*\s*,\s*\"([^\"]|\\\")*\"\s*\))\s*",  # noqa
-        part,
-    )
-    if match_regular:
-        return offset + len(match_regular.group(0))
-
-    # Detect conditional function
-    match_condition = match(r"\s*((and|or)\s*\()", part)
-    if match_condition:
-        # Check first argument
-        offset += len(match_condition.group(0))
-        offset = _validate_next_segment(query, offset)
-
-        # Iterate over nested arguments 2...n
-        while True:
-            part = query[offset:]
-            end_match = match(r"\s*\)\s*", part)
-            if end_match:
-                return offset + len(end_match.group(0))
-            comma_match = match(r"\s*,", part)
-            if not comma_match:
-                break
-            offset += len(comma_match.group(0))
-            offset = _validate_next_segment(query, offset)
-    raise TypeError("invalid query filter")
+# Labels, that the Data Poller may extract from DNs
+DN_LABELS = {"pod", "node", "tenant", "ap", "epg", "bd", "vrf", "l3out", "interface"}
+
+# Functions aggregating series grouped by the DN labels
+AGGREGATION_FUNCTIONS = {"sum", "avg", "min", "max", "count"}
+
+# Metrics are stored by name in a hash, and indexed in order of addition
+METRICS_KEY = "metric-configs"
+METRICS_INDEX_KEY = "metric-names"
+
+# Metrics list used by previous versions, migrated on first use
+LEGACY_METRICS_KEY = "metrics"
+
+# Configuration version, incremented and published on every change
+METRICS_VERSION_KEY = "metrics-version"
+METRICS_CHANNEL = "metrics-changed"
 
 
 def validate_query_filter(query: str) -> None:
@@ -49,12 +42,68 @@ def validate_query_filter(query: str) -> None:
     Validate query filter.
 
     :param query: query filter
-    :raises: TypeError
+    :raises QueryFilterError: when the filter is invalid
+    """
+    parse_query_filter(query)
+
+
+def validate_converter(converter: Any) -> None:
     """
-    if query == "":
+    Validate converter of attribute values.
+
+    :param converter: converter name, or map of enum values to numbers
+    :raises TypeError: when the converter is invalid
+    """
+    if isinstance(converter, str) and converter in CONVERTERS:
         return
-    if _validate_next_segment(query, 0) != len(query):
-        raise TypeError("invalid query filter")
+    if (
+        isinstance(converter, dict)
+        and len(converter) > 0
+        and all(
+            isinstance(x, (int, float)) and not isinstance(x, bool)
+            for x in converter.values()
+        )
+    ):
+        return
+    raise TypeError(
+        "metric converter should be float, int, bool or map of values to numbers"
+    )
+
+
+def validate_dn_labels(dn_labels: Any, key: str) -> None:
+    """
+    Validate list of labels extracted from DNs.
+
+    :param dn_labels: list of label names
+    :param key: name of the validated key, for the error message
+    :raises TypeError: when the list is invalid
+    """
+    if (
+        not isinstance(dn_labels, list)
+        or any(not isinstance(x, str) or x not in DN_LABELS for x in dn_labels)
+        or len(set(dn_labels)) != len(dn_labels)
+    ):
+        raise TypeError(
+            f"metric {key} should be a list of: {', '.join(sorted(DN_LABELS))}"
+        )
+
+
+def validate_aggregation(aggregation: Any) -> None:
+    """
+    Validate aggregation of series.
+
+    :param aggregation: aggregation function, and DN labels to group by
+    :raises TypeError: when the aggregation is invalid
+    """
+    if (
+        not isinstance(aggregation, dict)
+        or not {"function"} <= set(aggregation.keys()) <= {"function", "by"}
+        or aggregation["function"] not in AGGREGATION_FUNCTIONS
+    ):
+        raise TypeError(
+            "metric aggregation should have function: sum, avg, min, max or count"
+        )
+    validate_dn_labels(aggregation.get("by", []), "aggregation.by")
 
 
 def validate_metric(metric: dict) -> None:
@@ -66,13 +115,8 @@ def validate_metric(metric: dict) -> None:
     """
     if not isinstance(metric, dict):
         raise TypeError("metric should be a dictionary")
-    if set(metric.keys()) != {
-        "name",
-        "className",
-        "attributes",
-        "queryFilter",
-        "interval",
-    }:
+    keys = set(metric.keys())
+    if not REQUIRED_METRIC_KEYS <= keys <= REQUIRED_METRIC_KEYS | OPTIONAL_METRIC_KEYS:
         raise TypeError("invalid metric shape")
 
     name = metric.get("name")
@@ -80,6 +124,7 @@ def validate_metric(metric: dict) -> None:
     attributes = metric.get("attributes")
     query_filter = metric.get("queryFilter")
     interval = metric.get("interval")
+    mode = metric.get("mode", "poll")
     if not isinstance(name, str) or not match(r"^[a-zA-Z0-9][a-zA-Z0-9_]*$", name):
         raise TypeError(
             "name can contain should start with letter or digit and may contain _"
@@ -96,6 +141,22 @@ def validate_metric(metric: dict) -> None:
         raise TypeError("metric should have a query filter")
     if not isinstance(interval, int) or interval < 500:
         raise TypeError("metric should have interval >= 500")
+    if mode not in ("poll", "subscribe"):
+        raise TypeError("metric mode should be either poll or subscribe")
+    fabrics = metric.get("fabrics", [])
+    if not isinstance(fabrics, list) or any(
+        not isinstance(x, str) or not match(r"^[a-zA-Z0-9_]+$", x) for x in fabrics
+    ):
+        raise TypeError("metric fabrics should be a list of fabric names")
+    validate_dn_labels(metric.get("dnLabels", []), "dnLabels")
+    if "aggregation" in metric:
+        validate_aggregation(metric["aggregation"])
+    if not isinstance(metric.get("includeHealth", False), bool):
+        raise TypeError("metric includeHealth should be a boolean")
+    if metric.get("includeHealth") and mode == "subscribe":
+        # Subscription events carry only the object, without its health
+        raise TypeError("metric includeHealth is not supported in subscribe mode")
+    validate_converter(metric.get("converter", "float"))
     validate_query_filter(query_filter)
 
 
@@ -104,21 +165,60 @@ def get_metrics(db: redis.Redis) -> List[dict]:
     Get monitored items from Redis.
 
     :param db: Redis instance
-    :return: list of metrics from database
+    :return: list of metrics from database, in order of addition
     """
-    return loads(db.get("metrics") or "[]")
+    pipe = db.pipeline()
+    pipe.zrange(METRICS_INDEX_KEY, 0, -1)
+    pipe.hgetall(METRICS_KEY)
+    names, configs = pipe.execute()
+    return [loads(configs[name]) for name in names if name in configs]
+
 
+def _next_position(pipe: redis.client.Pipeline) -> float:
+    """
+    Get index position for the next added metric.
 
-def set_metrics(db: redis.Redis, metrics: List[dict]) -> List[dict]:
+    :param pipe: Redis pipeline, in immediate mode
+    :return: score after the last metric
     """
-    Replace monitored items list in Redis.
+    last = cast(list, pipe.zrange(METRICS_INDEX_KEY, -1, -1, withscores=True))
+    return last[0][1] + 1 if last else 0
+
+
+def notify_metrics_changed(db: redis.Redis, version: int) -> None:
+    """
+    Notify subscribers about the new configuration version.
 
     :param db: Redis instance
-    :param metrics: New list of metrics
-    :return: list of metrics from database
+    :param version: configuration version
     """
-    db.set("metrics", dumps(metrics))
-    return metrics
+    db.publish(METRICS_CHANNEL, str(version))
+
+
+def migrate_metrics(db: redis.Redis) -> None:
+    """
+    Move metrics from the legacy single-key list
+    to the per-metric storage, if it has not been done yet.
+
+    :param db: Redis instance
+    """
+
+    def migrate(pipe: redis.client.Pipeline) -> None:
+        legacy = cast(Optional[bytes], pipe.get(LEGACY_METRICS_KEY))
+        if legacy is None:
+            return
+        metrics = loads(legacy)
+        position = _next_position(pipe)
+        pipe.multi()
+        for index, metric in enumerate(metrics):
+            pipe.hsetnx(METRICS_KEY, metric["name"], dumps(metric))
+            pipe.zadd(METRICS_INDEX_KEY, {metric["name"]: position + index}, nx=True)
+        pipe.delete(LEGACY_METRICS_KEY)
+        pipe.incr(METRICS_VERSION_KEY)
+
+    results = db.transaction(migrate, LEGACY_METRICS_KEY, METRICS_INDEX_KEY)
+    if results:
+        notify_metrics_changed(db, results[-1])
 
 
 def delete_metric(db: redis.Redis, name: str) -> List[dict]:
@@ -129,9 +229,19 @@ def delete_metric(db: redis.Redis, name: str) -> List[dict]:
     :param name: Name of metric to delete
     :return: list of metrics from database
     """
-    metrics = [x for x in get_metrics(db) if x["name"] != name]
-    set_metrics(db, metrics)
-    return metrics
+
+    def delete(pipe: redis.client.Pipeline) -> None:
+        if not pipe.hexists(METRICS_KEY, name):
+            return
+        pipe.multi()
+        pipe.hdel(METRICS_KEY, name)
+        pipe.zrem(METRICS_INDEX_KEY, name)
+        pipe.incr(METRICS_VERSION_KEY)
+
+    results = db.transaction(delete, METRICS_KEY)
+    if results:
+        notify_metrics_changed(db, results[-1])
+    return get_metrics(db)
 
 
 def add_metric(db: redis.Redis, metric: dict) -> List[dict]:
@@ -143,8 +253,23 @@ def add_metric(db: redis.Redis, metric: dict) -> List[dict]:
     :return: list of metrics from database
     """
     validate_metric(metric)
-    metrics = get_metrics(db)
-    if any(x for x in metrics if x["name"] == metric["name"]):
-        raise TypeError("metric with that name already exists")
-    set_metrics(db, metrics + [metric])
-    return metrics + [metric]
+    name = metric["name"]
+
+    # Store canonical filter, to send it to APIC and detect metrics sharing it
+    metric = metric | {
+        "optimizedQueryFilter": normalize_query_filter(metric["queryFilter"])
+    }
+
+    def add(pipe: redis.client.Pipeline) -> None:
+        # Names are unique, other metrics may be added at the same time
+        if pipe.hexists(METRICS_KEY, name):
+            raise TypeError("metric with that name already exists")
+        position = _next_position(pipe)
+        pipe.multi()
+        pipe.hset(METRICS_KEY, name, dumps(metric))
+        pipe.zadd(METRICS_INDEX_KEY, {name: position})
+        pipe.incr(METRICS_VERSION_KEY)
+
+    results = db.transaction(add, METRICS_KEY, METRICS_INDEX_KEY)
+    notify_metrics_changed(db, results[-1])
+    return get_metrics(db)
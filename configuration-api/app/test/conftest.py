@@ -1,6 +1,18 @@
+from json import dumps
+from typing import List
+from unittest.mock import patch
+
 import pytest
 
 from .. import create_app
+from ..metrics import METRICS_INDEX_KEY, METRICS_KEY
+from .fake_redis import FakeRedis
+
+
+def store_metrics(db: FakeRedis, metrics: List[dict]) -> None:
+    for index, metric in enumerate(metrics):
+        db.hset(METRICS_KEY, metric["name"], dumps(metric))
+        db.zadd(METRICS_INDEX_KEY, {metric["name"]: index})
 
 
 @pytest.fixture()
@@ -31,3 +43,9 @@ def metrics():
             "interval": 4321,
         },
     ]
+
+
+@pytest.fixture()
+def db():
+    with patch("redis.Redis", return_value=FakeRedis()) as mock_redis:
+        yield mock_redis.return_value
@@ -0,0 +1,52 @@
+import pytest
+
+from ..filters import Condition, Group, normalize_query_filter, parse_query_filter
+
+
+def test_parse_query_filter_tree():
+    assert parse_query_filter("") is None
+    assert parse_query_filter('or(eq(a.b,"1"),and(ne(a.c, "\\"2")))') == Group(
+        "or",
+        (
+            Condition("eq", "a.b", "1"),
+            Group("and", (Condition("ne", "a.c", '"2'),)),
+        ),
+    )
+
+
+def test_parse_query_filter_cached():
+    query = 'and(eq(a.b, "1"), eq(a.c, "2"))'
+    assert parse_query_filter(query) is parse_query_filter(query)
+
+
+@pytest.mark.parametrize(
+    "query_filter,expected",
+    [
+        ("", ""),
+        ('and(and(eq(a.b,"1")))', 'eq(a.b,"1")'),
+        ('or(eq(a.c,"2"), eq(a.b,"1"), eq(a.c,"2"))', 'or(eq(a.b,"1"),eq(a.c,"2"))'),
+        ('or(or(eq(a.c,"2")), or(eq(a.b,"1")))', 'or(eq(a.b,"1"),eq(a.c,"2"))'),
+        ('and(eq(a.b,"1"),ne(a.b,"2"),gt(a.x,"3"))', 'and(eq(a.b,"1"),gt(a.x,"3"))'),
+        ('or(eq(a.b,"1"),ne(a.b,"2"))', 'ne(a.b,"2")'),
+        ('or(eq(a.b,"1"),ne(a.b,"1"))', ""),
+        ('and(gt(a.x,"1"),or(ne(a.b,"1"),ne(a.b,"2")))', 'gt(a.x,"1")'),
+        ('or(and(eq(a.b,"1"),eq(a.b,"2")),eq(a.c,"x\\"y"))', 'eq(a.c,"x\\"y")'),
+        # Backslashes other than of escaped quotes are kept, as APIC sees them
+        ('wcard(l1PhysIf.id,"eth1/\\d+")', 'wcard(l1PhysIf.id,"eth1/\\d+")'),
+        ('or(eq(a.b,"x\\\\"),eq(a.b,"x\\\\"))', 'eq(a.b,"x\\\\")'),
+        ('eq(a.b,"\\\\\\"\\n")', 'eq(a.b,"\\\\\\"\\n")'),
+        ('and(eq(a.b,"1"),eq(a.b,"2"))', 'and(eq(a.b,"1"),eq(a.b,"2"))'),
+        ('or(and(eq(a.b,"up"),eq(a.b,"down")),eq(a.c,"1"))', 'eq(a.c,"1")'),
+        # Values that may be equal under the property type are not folded
+        ('and(eq(a.b,"1"),ne(a.b,"1.0"))', 'and(eq(a.b,"1"),ne(a.b,"1.0"))'),
+        ('or(ne(a.b,"1"),ne(a.b,"1.0"))', 'or(ne(a.b,"1"),ne(a.b,"1.0"))'),
+        ('and(eq(a.b,"1"),eq(a.b,"up"))', 'and(eq(a.b,"1"),eq(a.b,"up"))'),
+        (
+            'and(eq(a.m,"00:AA"),ne(a.m,"00:aa"))',
+            'and(eq(a.m,"00:AA"),ne(a.m,"00:aa"))',
+        ),
+    ],
+)
+def test_normalize_query_filter(query_filter: str, expected: str):
+    assert normalize_query_filter(query_filter) == expected
+    assert normalize_query_filter(expected) == expected
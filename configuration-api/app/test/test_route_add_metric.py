@@ -1,46 +1,79 @@
-from typing import List, Optional
+from typing import Any, List, Optional
 from unittest.mock import patch, MagicMock
-from json import dumps
 
 from flask.testing import FlaskClient
 import pytest
 
+from .conftest import store_metrics
+from .fake_redis import FakeRedis
 
-@patch(
-    "redis.Redis",
-    **{
-        "return_value.get.side_effect": Exception(),
-    }
-)
-def test_route_add_metric_redis_get_error(
-    mock_redis: MagicMock, client: FlaskClient, metrics: List[dict]
+
+@patch.object(FakeRedis, "hexists", side_effect=Exception())
+def test_route_add_metric_redis_read_error(
+    mock_hexists: MagicMock, db: FakeRedis, client: FlaskClient, metrics: List[dict]
 ):
     response = client.post("/metrics", json=metrics[0])
     assert response.status_code == 500
 
 
-@patch(
-    "redis.Redis",
-    **{
-        "return_value.set.side_effect": Exception(),
-    }
-)
-def test_route_add_metric_redis_set_error(
-    mock_redis: MagicMock, client: FlaskClient, metrics: List[dict]
+def test_route_add_metric_redis_write_error(
+    db: FakeRedis, client: FlaskClient, metrics: List[dict]
 ):
-    mock_redis.return_value.get.return_value = dumps([metrics[0]])
-    response = client.post("/metrics", json=metrics[1])
+    store_metrics(db, [metrics[0]])
+    with patch.object(FakeRedis, "hset", side_effect=Exception()):
+        response = client.post("/metrics", json=metrics[1])
     assert response.status_code == 500
 
 
-@patch("redis.Redis")
+def test_route_add_metric(db: FakeRedis, client: FlaskClient, metrics: List[dict]):
+    store_metrics(db, [metrics[0]])
+    response = client.post("/metrics", json=metrics[1])
+    expected = [
+        metrics[0],
+        metrics[1]
+        | {"optimizedQueryFilter": 'eq(metric_class_name_2.attribute6,"10")'},
+    ]
+    assert response.status_code == 200
+    assert response.json == expected
+    assert client.get("/metrics").json == expected
+
+
+def test_route_add_metric_optimized_query_filter(
+    db: FakeRedis, client: FlaskClient, metrics: List[dict]
+):
+    query_filter = 'and(and(eq(a.b, "1")), ne(a.b, "2"), eq(a.b, "1"))'
+    response = client.post("/metrics", json=metrics[1] | {"queryFilter": query_filter})
+    assert response.json[0]["queryFilter"] == query_filter
+    assert response.json[0]["optimizedQueryFilter"] == 'eq(a.b,"1")'
+
+
+def test_route_add_metric_deeply_nested_query_filter(
+    db: FakeRedis, client: FlaskClient, metrics: List[dict]
+):
+    query_filter = "and(or(" * 750 + 'eq(a.b,"1"),ne(a.c,"2")' + "))" * 750
+    response = client.post("/metrics", json=metrics[1] | {"queryFilter": query_filter})
+    assert response.status_code == 200
+    assert response.json[0]["optimizedQueryFilter"] == 'or(eq(a.b,"1"),ne(a.c,"2"))'
+
+
 def test_route_add_metric_duplicate(
-    mock_redis: MagicMock, client: FlaskClient, metrics: List[dict]
+    db: FakeRedis, client: FlaskClient, metrics: List[dict]
 ):
-    mock_redis.return_value.get.return_value = dumps(metrics)
+    store_metrics(db, metrics)
     response = client.post("/metrics", json=metrics[0])
     assert response.status_code == 400
     assert response.json["error"] == "metric with that name already exists"
+    assert db.published == []
+
+
+def test_route_add_metric_publishes_version(
+    db: FakeRedis, client: FlaskClient, metrics: List[dict]
+):
+    db.set("metrics-version", 6)
+    store_metrics(db, [metrics[0]])
+    response = client.post("/metrics", json=metrics[1])
+    assert response.status_code == 200
+    assert db.published == [("metrics-changed", "7")]
 
 
 @pytest.mark.parametrize(
@@ -54,11 +87,10 @@ def test_route_add_metric_duplicate(
         None,
     ],
 )
-@patch("redis.Redis")
 def test_route_add_metric_invalid_name(
-    mock_redis: MagicMock, client: FlaskClient, metrics: List[dict], name: Optional[str]
+    db: FakeRedis, client: FlaskClient, metrics: List[dict], name: Optional[str]
 ):
-    mock_redis.return_value.get.return_value = dumps([metrics[0]])
+    store_metrics(db, [metrics[0]])
     response = client.post("/metrics", json=metrics[1] | {"name": name})
     assert response.status_code == 400
     assert (
@@ -76,14 +108,13 @@ def test_route_add_metric_invalid_name(
         None,
     ],
 )
-@patch("redis.Redis")
 def test_route_add_metric_invalid_class_name(
-    mock_redis: MagicMock,
+    db: FakeRedis,
     client: FlaskClient,
     metrics: List[dict],
     class_name: Optional[str],
 ):
-    mock_redis.return_value.get.return_value = dumps([metrics[0]])
+    store_metrics(db, [metrics[0]])
     response = client.post("/metrics", json=metrics[1] | {"className": class_name})
     assert response.status_code == 400
     assert response.json["error"] == "metric should have class name"
@@ -99,24 +130,22 @@ def test_route_add_metric_invalid_class_name(
         None,
     ],
 )
-@patch("redis.Redis")
 def test_route_add_metric_invalid_attributes(
-    mock_redis: MagicMock,
+    db: FakeRedis,
     client: FlaskClient,
     metrics: List[dict],
     attributes: Optional[str],
 ):
-    mock_redis.return_value.get.return_value = dumps([metrics[0]])
+    store_metrics(db, [metrics[0]])
     response = client.post("/metrics", json=metrics[1] | {"attributes": attributes})
     assert response.status_code == 400
     assert response.json["error"] == "metric should have string attributes"
 
 
-@patch("redis.Redis")
 def test_route_add_metric_empty_attributes(
-    mock_redis: MagicMock, client: FlaskClient, metrics: List[dict]
+    db: FakeRedis, client: FlaskClient, metrics: List[dict]
 ):
-    mock_redis.return_value.get.return_value = dumps([metrics[0]])
+    store_metrics(db, [metrics[0]])
     response = client.post("/metrics", json=metrics[1] | {"attributes": []})
     assert response.status_code == 400
     assert (
@@ -125,40 +154,43 @@ def test_route_add_metric_empty_attributes(
 
 
 @pytest.mark.parametrize("query_filter", [[""], None, {}, 123])
-@patch("redis.Redis")
 def test_route_add_metric_invalid_query_filter_type(
-    mock_redis: MagicMock,
+    db: FakeRedis,
     client: FlaskClient,
     metrics: List[dict],
     query_filter: Optional[str],
 ):
-    mock_redis.return_value.get.return_value = dumps([metrics[0]])
+    store_metrics(db, [metrics[0]])
     response = client.post("/metrics", json=metrics[1] | {"queryFilter": query_filter})
     assert response.status_code == 400
     assert response.json["error"] == "metric should have a query filter"
 
 
 @pytest.mark.parametrize(
-    "query_filter",
+    "query_filter,error",
     [
-        "abc.def",
-        'eq("12", 12)',
-        'ew("12", 12)',
-        'and("10")',
-        'and(ew(15, "15"))',
+        ("abc.def", "unknown operator abc.def at position 0"),
+        ('eq("12", 12)', "expected property name at position 3"),
+        ('ew("12", 12)', "unknown operator ew at position 0"),
+        ('and("10")', "expected operator at position 4"),
+        ('and(ew(15, "15"))', "unknown operator ew at position 4"),
+        ('and(eq(a.b, "1")', "expected , or ) at position 16"),
+        ('eq(a.b, "1") x', "expected end of query filter at position 13"),
+        ('eq(a.b, "1"]', "unexpected character at position 11"),
+        ("  ", "expected operator at position 2"),
     ],
 )
-@patch("redis.Redis")
 def test_route_add_metric_invalid_query_filter(
-    mock_redis: MagicMock,
+    db: FakeRedis,
     client: FlaskClient,
     metrics: List[dict],
     query_filter: Optional[str],
+    error: str,
 ):
-    mock_redis.return_value.get.return_value = dumps([metrics[0]])
+    store_metrics(db, [metrics[0]])
     response = client.post("/metrics", json=metrics[1] | {"queryFilter": query_filter})
     assert response.status_code == 400
-    assert response.json["error"] == "invalid query filter"
+    assert response.json["error"] == f"invalid query filter: {error}"
 
 
 @pytest.mark.parametrize(
@@ -175,15 +207,181 @@ def test_route_add_metric_invalid_query_filter(
         'and(wcard(abc.def, "12"), eq(abc.xyz, "15"))',
         'or(wcard(abc.def, "12"), eq(abc.xyz, "15"))',
         'or(wcard(abc.def,"12"),eq(abc.xyz,"15"),ne(abc.ncd,"15"))',
+        ' and( eq(abc.def, "a \\" b") ) ',
+        "and(" * 5000 + 'eq(abc.def, "1")' + ")" * 5000,
     ],
 )
-@patch("redis.Redis")
 def test_route_add_metric_valid_query_filter(
-    mock_redis: MagicMock,
+    db: FakeRedis,
     client: FlaskClient,
     metrics: List[dict],
     query_filter: Optional[str],
 ):
-    mock_redis.return_value.get.return_value = dumps([metrics[0]])
+    store_metrics(db, [metrics[0]])
     response = client.post("/metrics", json=metrics[1] | {"queryFilter": query_filter})
     assert response.status_code == 200
+
+
+@pytest.mark.parametrize("mode", ["poll", "subscribe"])
+def test_route_add_metric_valid_mode(
+    db: FakeRedis, client: FlaskClient, metrics: List[dict], mode: str
+):
+    store_metrics(db, [metrics[0]])
+    response = client.post("/metrics", json=metrics[1] | {"mode": mode})
+    assert response.status_code == 200
+
+
+@pytest.mark.parametrize("mode", ["push", "", None, 1])
+def test_route_add_metric_invalid_mode(
+    db: FakeRedis, client: FlaskClient, metrics: List[dict], mode: str
+):
+    store_metrics(db, [metrics[0]])
+    response = client.post("/metrics", json=metrics[1] | {"mode": mode})
+    assert response.status_code == 400
+    assert response.json["error"] == "metric mode should be either poll or subscribe"
+
+
+@pytest.mark.parametrize("mode", ["poll", "subscribe"])
+def test_route_add_metric_include_health_mode(
+    db: FakeRedis, client: FlaskClient, metrics: List[dict], mode: str
+):
+    store_metrics(db, [metrics[0]])
+    response = client.post(
+        "/metrics", json=metrics[1] | {"mode": mode, "includeHealth": True}
+    )
+    if mode == "poll":
+        assert response.status_code == 200
+    else:
+        assert response.status_code == 400
+        assert (
+            response.json["error"]
+            == "metric includeHealth is not supported in subscribe mode"
+        )
+
+
+def test_route_add_metric_unknown_key(
+    db: FakeRedis, client: FlaskClient, metrics: List[dict]
+):
+    store_metrics(db, [metrics[0]])
+    response = client.post("/metrics", json=metrics[1] | {"unknown": 1})
+    assert response.status_code == 400
+    assert response.json["error"] == "invalid metric shape"
+
+
+@pytest.mark.parametrize(
+    "converter", ["float", "int", "bool", {"up": 1, "down": 0, "unknown": -1.5}]
+)
+def test_route_add_metric_valid_converter(
+    db: FakeRedis, client: FlaskClient, metrics: List[dict], converter: Any
+):
+    response = client.post("/metrics", json=metrics[1] | {"converter": converter})
+    assert response.status_code == 200
+    assert response.json[0]["converter"] == converter
+
+
+@pytest.mark.parametrize(
+    "converter", ["str", "", None, 1, {}, {"up": "1"}, {"up": True}]
+)
+def test_route_add_metric_invalid_converter(
+    db: FakeRedis, client: FlaskClient, metrics: List[dict], converter: Any
+):
+    response = client.post("/metrics", json=metrics[1] | {"converter": converter})
+    assert response.status_code == 400
+    assert response.json["error"] == (
+        "metric converter should be float, int, bool or map of values to numbers"
+    )
+
+
+@pytest.mark.parametrize("include_health", [True, False])
+def test_route_add_metric_valid_include_health(
+    db: FakeRedis, client: FlaskClient, metrics: List[dict], include_health: bool
+):
+    response = client.post(
+        "/metrics", json=metrics[1] | {"includeHealth": include_health}
+    )
+    assert response.status_code == 200
+    assert response.json[0]["includeHealth"] == include_health
+
+
+@pytest.mark.parametrize("include_health", ["yes", None, 1])
+def test_route_add_metric_invalid_include_health(
+    db: FakeRedis, client: FlaskClient, metrics: List[dict], include_health: Any
+):
+    response = client.post(
+        "/metrics", json=metrics[1] | {"includeHealth": include_health}
+    )
+    assert response.status_code == 400
+    assert response.json["error"] == "metric includeHealth should be a boolean"
+
+
+@pytest.mark.parametrize("fabrics", [[], ["dc1"], ["dc1", "dc_2"]])
+def test_route_add_metric_valid_fabrics(
+    db: FakeRedis, client: FlaskClient, metrics: List[dict], fabrics: List[str]
+):
+    response = client.post("/metrics", json=metrics[1] | {"fabrics": fabrics})
+    assert response.status_code == 200
+    assert response.json[0]["fabrics"] == fabrics
+
+
+@pytest.mark.parametrize("fabrics", ["dc1", None, [""], ["dc-1"], [1]])
+def test_route_add_metric_invalid_fabrics(
+    db: FakeRedis, client: FlaskClient, metrics: List[dict], fabrics: Any
+):
+    response = client.post("/metrics", json=metrics[1] | {"fabrics": fabrics})
+    assert response.status_code == 400
+    assert response.json["error"] == "metric fabrics should be a list of fabric names"
+
+
+@pytest.mark.parametrize("dn_labels", [[], ["node"], ["pod", "node", "interface"]])
+def test_route_add_metric_valid_dn_labels(
+    db: FakeRedis, client: FlaskClient, metrics: List[dict], dn_labels: List[str]
+):
+    response = client.post("/metrics", json=metrics[1] | {"dnLabels": dn_labels})
+    assert response.status_code == 200
+    assert response.json[0]["dnLabels"] == dn_labels
+
+
+@pytest.mark.parametrize("dn_labels", ["node", None, ["dn"], ["node", "node"], [[]]])
+def test_route_add_metric_invalid_dn_labels(
+    db: FakeRedis, client: FlaskClient, metrics: List[dict], dn_labels: Any
+):
+    response = client.post("/metrics", json=metrics[1] | {"dnLabels": dn_labels})
+    assert response.status_code == 400
+    assert response.json["error"] == (
+        "metric dnLabels should be a list of: "
+        "ap, bd, epg, interface, l3out, node, pod, tenant, vrf"
+    )
+
+
+@pytest.mark.parametrize(
+    "aggregation",
+    [{"function": "sum"}, {"function": "avg", "by": ["pod", "node"]}],
+)
+def test_route_add_metric_valid_aggregation(
+    db: FakeRedis, client: FlaskClient, metrics: List[dict], aggregation: dict
+):
+    response = client.post("/metrics", json=metrics[1] | {"aggregation": aggregation})
+    assert response.status_code == 200
+    assert response.json[0]["aggregation"] == aggregation
+
+
+@pytest.mark.parametrize(
+    "aggregation, error",
+    [
+        ("sum", "metric aggregation should have function"),
+        ({"function": "median"}, "metric aggregation should have function"),
+        ({"by": ["node"]}, "metric aggregation should have function"),
+        ({"function": "sum", "limit": 1}, "metric aggregation should have function"),
+        ({"function": "sum", "by": ["dn"]}, "metric aggregation.by should be a list"),
+    ],
+)
+def test_route_add_metric_invalid_aggregation(
+    db: FakeRedis,
+    client: FlaskClient,
+    metrics: List[dict],
+    aggregation: Any,
+    error: str,
+):
+    response = client.post("/metrics", json=metrics[1] | {"aggregation": aggregation})
+    assert response.status_code == 400
+    assert response.json["error"].startswith(error)
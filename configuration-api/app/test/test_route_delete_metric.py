@@ -1,52 +1,42 @@
 from typing import List
 from unittest.mock import patch, MagicMock
-from json import dumps
 
 from flask.testing import FlaskClient
 
+from .conftest import store_metrics
+from .fake_redis import FakeRedis
 
-@patch(
-    "redis.Redis",
-    **{
-        "return_value.get.side_effect": Exception(),
-    },
-)
-def test_route_delete_metric_redis_get_error(
-    mock_redis: MagicMock, client: FlaskClient, metrics: List[dict]
+
+@patch.object(FakeRedis, "hexists", side_effect=Exception())
+def test_route_delete_metric_redis_read_error(
+    mock_hexists: MagicMock, db: FakeRedis, client: FlaskClient, metrics: List[dict]
 ):
     response = client.delete(f"/metrics/{metrics[0]['name']}")
     assert response.status_code == 500
 
 
-@patch(
-    "redis.Redis",
-    **{
-        "return_value.set.side_effect": Exception(),
-    },
-)
-def test_route_delete_metric_redis_set_error(
-    mock_redis: MagicMock, client: FlaskClient, metrics: List[dict]
+@patch.object(FakeRedis, "hdel", side_effect=Exception())
+def test_route_delete_metric_redis_write_error(
+    mock_hdel: MagicMock, db: FakeRedis, client: FlaskClient, metrics: List[dict]
 ):
-    mock_redis.return_value.get.return_value = dumps(metrics)
+    store_metrics(db, metrics)
     response = client.delete(f"/metrics/{metrics[0]['name']}")
     assert response.status_code == 500
 
 
-@patch("redis.Redis")
 def test_route_delete_metric_unknown(
-    mock_redis: MagicMock, client: FlaskClient, metrics: List[dict]
+    db: FakeRedis, client: FlaskClient, metrics: List[dict]
 ):
-    mock_redis.return_value.get.return_value = dumps([metrics[0]])
+    store_metrics(db, [metrics[0]])
     response = client.delete(f"/metrics/{metrics[1]['name']}")
     assert response.status_code == 200
     assert response.json == [metrics[0]]
+    assert db.published == []
 
 
-@patch("redis.Redis")
-def test_route_delete_metric(
-    mock_redis: MagicMock, client: FlaskClient, metrics: List[dict]
-):
-    mock_redis.return_value.get.return_value = dumps(metrics)
+def test_route_delete_metric(db: FakeRedis, client: FlaskClient, metrics: List[dict]):
+    store_metrics(db, metrics)
     response = client.delete(f"/metrics/{metrics[0]['name']}")
     assert response.status_code == 200
     assert response.json == [metrics[1]]
+    assert db.published == [("metrics-changed", "1")]
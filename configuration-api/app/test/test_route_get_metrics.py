@@ -4,38 +4,43 @@ from json import dumps
 
 from flask.testing import FlaskClient
 
+from ..metrics import migrate_metrics
+from .conftest import store_metrics
+from .fake_redis import FakeRedis
 
-@patch("redis.Redis")
-def test_route_get_metrics_none(mock_redis: MagicMock, client: FlaskClient):
-    mock_redis.return_value.get.return_value = None
-    response = client.get("/metrics")
-    assert response.status_code == 200
-    assert response.json == []
 
-
-@patch("redis.Redis")
-def test_route_get_metrics_empty(mock_redis: MagicMock, client: FlaskClient):
-    mock_redis.return_value.get.return_value = "[]"
+def test_route_get_metrics_empty(db: FakeRedis, client: FlaskClient):
     response = client.get("/metrics")
     assert response.status_code == 200
     assert response.json == []
 
 
-@patch("redis.Redis")
 def test_route_get_metrics_multiple(
-    mock_redis: MagicMock, client: FlaskClient, metrics: List[dict]
+    db: FakeRedis, client: FlaskClient, metrics: List[dict]
 ):
-    mock_redis.return_value.get.return_value = dumps(metrics)
+    store_metrics(db, metrics)
     response = client.get("/metrics")
     assert response.status_code == 200
     assert response.json == metrics
 
 
-@patch(
-    "redis.Redis",
-    **{
-        "return_value.get.side_effect": Exception(),
-    }
-)
-def test_route_get_metrics_get_error(mock_redis: MagicMock, client: FlaskClient):
+@patch.object(FakeRedis, "hgetall", side_effect=Exception())
+def test_route_get_metrics_get_error(
+    mock_hgetall: MagicMock, db: FakeRedis, client: FlaskClient
+):
     assert client.get("/metrics").status_code == 500
+
+
+def test_route_get_metrics_migrates_legacy_list(
+    db: FakeRedis, client: FlaskClient, metrics: List[dict]
+):
+    db.set("metrics", dumps(metrics))
+    with patch("app.db.db_migrated", False):
+        response = client.get("/metrics")
+    assert response.json == metrics
+    assert db.get("metrics") is None
+    assert db.published == [("metrics-changed", "1")]
+
+    # Migration is not repeated
+    migrate_metrics(db)
+    assert db.published == [("metrics-changed", "1")]
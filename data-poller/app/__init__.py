@@ -1,9 +1,12 @@
 import os
 from threading import Thread
 
-from flask import Flask
+from flask import Flask, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 
 from .db import get_db, init_app as init_db
+from .instrumentation import registry
+from .store import store
 
 
 def create_app(config=None, process_func=None):
@@ -45,4 +48,24 @@ def create_app(config=None, process_func=None):
         get_db().ping()
         return "", 204
 
+    @app.route("/meta/metrics")
+    def route_meta_metrics():
+        """
+        Endpoint for Prometheus to scrape metrics of the poller itself.
+
+        :return: 200 with metrics in Prometheus text format
+        """
+        return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+
+    if app.config.get("PROMETHEUS_MODE") == "pull":
+
+        @app.route("/metrics")
+        def route_metrics():
+            """
+            Endpoint for Prometheus to scrape the latest values of all metrics.
+
+            :return: 200 with metrics in Prometheus text format
+            """
+            return Response(store.render(), mimetype=CONTENT_TYPE_LATEST)
+
     return app
@@ -1,35 +1,236 @@
-from typing import Optional, List
+import codecs
+import json
+import time
+from threading import Lock
+from typing import Dict, Iterable, Iterator, List, Tuple
 from urllib.parse import quote
 
 import requests
-from acitoolkit import Session  # type: ignore
 
-aci_session: Optional[Session] = None
+from .instrumentation import apic_objects, apic_request_seconds, count_bytes
+from .session import ApicSession
 
+# Sessions by fabric name, every fabric logs in under its own lock,
+# so unreachable fabric doesn't block the others
+aci_sessions: Dict[str, ApicSession] = {}
+aci_session_locks: Dict[str, Lock] = {}
+aci_sessions_lock = Lock()
 
-def get_aci_session(config: dict) -> Session:
-    global aci_session
-    if aci_session is None:
-        aci_session = Session(config["url"], config["username"], config["password"])
-        aci_session.login(timeout=2)
-    return aci_session
+# Failed logins in a row and the time when login may be retried, by fabric name
+aci_login_failures: Dict[str, Tuple[int, float]] = {}
 
+# Delay after failed login (in seconds), doubled after every next failure
+LOGIN_BACKOFF = 2
+LOGIN_MAX_BACKOFF = 60
 
-def aci_get(session: Session, url: str):
-    return session.get(url, timeout=5)
+json_decoder = json.JSONDecoder()
 
 
-def aci_query(session: Session, class_name: str, query: str) -> List[dict]:
-    # Build URL
-    query_target_part = f"query-target-filter={quote(query)}&" if query else ""
-    url = f"/api/node/class/{quote(class_name)}.json?{query_target_part}rsp-subtree-include=health"  # noqa
+def get_aci_session(config: dict) -> ApicSession:
+    """
+    Get session to the fabric, logging in when it's used for the first time.
+    After failed login, the fabric is not retried until the backoff expires.
 
-    # Call APIC
-    response: requests.Response = aci_get(session, url)
+    :param config: fabric name, APIC URLs, credentials and connection pool size
+    :return: session shared by all users of the fabric
+    :raises ConnectionError: when login failed recently
+    """
+    name = config["name"]
+    session = aci_sessions.get(name)
+    if session is not None:
+        return session
+    with aci_sessions_lock:
+        lock = aci_session_locks.setdefault(name, Lock())
 
-    # Raise exception when there was some problem
-    if response.status_code != 200:
-        raise Exception(f'error while querying "{class_name}": {response.text}')
+    with lock:
+        session = aci_sessions.get(name)
+        if session is not None:
+            return session
+        failures, retry_at = aci_login_failures.get(name, (0, 0.0))
+        if time.time() < retry_at:
+            raise ConnectionError(
+                f"login failed {failures} times, retrying in "
+                f"{retry_at - time.time():.1f}s"
+            )
+        session = ApicSession(config["urls"], config["username"], config["password"])
+        try:
+            session.login(timeout=2)
+        except Exception:
+            backoff = min(LOGIN_BACKOFF * 2**failures, LOGIN_MAX_BACKOFF)
+            aci_login_failures[name] = (failures + 1, time.time() + backoff)
+            raise
+        aci_login_failures.pop(name, None)
+        aci_sessions[name] = session
+    return session
 
-    # Return data otherwise
-    return response.json()["imdata"]
+
+def aci_get(session: ApicSession, url: str, stream: bool = False):
+    return session.get(url, timeout=5, stream=stream)
+
+
+class ImdataParser:
+    """
+    Incremental parser of APIC JSON response,
+    returning MOs from the "imdata" list as soon as they are received.
+    """
+
+    def __init__(self) -> None:
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        self._in_list = False
+        self._done = False
+
+    def feed(self, chunk: bytes, final: bool = False) -> List[dict]:
+        """
+        Parse next chunk of the response body.
+
+        :param chunk: response body chunk
+        :param final: is it the last chunk
+        :return: MOs completed in this chunk
+        """
+        buffer = self._buffer + self._decoder.decode(chunk, final=final)
+        position = 0
+        items: List[dict] = []
+
+        # Look for the beginning of the list
+        if not self._in_list:
+            start = buffer.find('"imdata"')
+            bracket = buffer.find("[", start) if start != -1 else -1
+            if bracket == -1:
+                if final:
+                    raise ValueError("missing imdata in APIC response")
+                self._buffer = buffer
+                return items
+            self._in_list = True
+            position = bracket + 1
+
+        # Parse all complete MOs in the buffer
+        while not self._done:
+            while position < len(buffer) and buffer[position] in " \t\r\n,":
+                position += 1
+            if position >= len(buffer):
+                break
+            if buffer[position] == "]":
+                self._done = True
+                break
+            try:
+                item, position = json_decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if final:
+                    raise
+                break
+            items.append(item)
+
+        if final and not self._done:
+            raise ValueError("unexpected end of APIC response")
+        self._buffer = "" if self._done else buffer[position:]
+        return items
+
+
+def iter_imdata(chunks: Iterable[bytes]) -> Iterator[dict]:
+    """
+    Parse APIC JSON response incrementally,
+    yielding MOs from the "imdata" list as soon as they are received.
+
+    :param chunks: response body chunks
+    :return: generator of MOs
+    """
+    parser = ImdataParser()
+    for chunk in chunks:
+        yield from parser.feed(chunk)
+    yield from parser.feed(b"", final=True)
+
+
+def build_query_url(
+    class_name: str,
+    query: str,
+    page: int = 0,
+    page_size: int = 0,
+    include_health: bool = False,
+) -> str:
+    """
+    Build URL of the APIC class query.
+
+    :param class_name: class name
+    :param query: query filter
+    :param page: page number
+    :param page_size: number of MOs on the page, 0 to disable paging
+    :param include_health: include the health subtree of every MO
+    :return: URL path
+    """
+    parts = []
+    if query:
+        parts.append(f"query-target-filter={quote(query)}")
+    if include_health:
+        parts.append("rsp-subtree-include=health")
+    if page_size:
+        parts.append(
+            f"order-by={quote(class_name)}.dn&page={page}&page-size={page_size}"
+        )
+    return f"/api/node/class/{quote(class_name)}.json?{'&'.join(parts)}".rstrip("?")
+
+
+def get_attributes(mo: dict) -> dict:
+    """
+    Get attributes of the MO, along with attributes of its health,
+    prefixed with "healthInst.", when the health subtree is included.
+
+    :param mo: MO with attributes and children
+    :return: attributes
+    """
+    attributes: dict = mo["attributes"]
+    for child in mo.get("children", ()):
+        health = child.get("healthInst")
+        if health is not None:
+            return attributes | {
+                f"healthInst.{key}": value
+                for key, value in health["attributes"].items()
+            }
+    return attributes
+
+
+def aci_query(
+    session: ApicSession,
+    class_name: str,
+    query: str,
+    page_size: int = 0,
+    include_health: bool = False,
+) -> Iterator[dict]:
+    """
+    Query all MOs of the class matching the filter.
+    Results are streamed, and loaded in pages when page size is set,
+    so the memory usage doesn't depend on number of MOs.
+
+    :param session: APIC session
+    :param class_name: class name
+    :param query: query filter
+    :param page_size: number of MOs loaded in a single request, 0 to disable paging
+    :param include_health: include the health subtree of every MO
+    :return: generator of MOs
+    """
+    page = 0
+    while True:
+        # Call APIC
+        url = build_query_url(class_name, query, page, page_size, include_health)
+        started_at = time.perf_counter()
+        response: requests.Response = aci_get(session, url, stream=True)
+        apic_request_seconds.labels(class_name).observe(
+            time.perf_counter() - started_at
+        )
+        with response:
+            # Raise exception when there was some problem
+            if response.status_code != 200:
+                raise Exception(f'error while querying "{class_name}": {response.text}')
+
+            # Return data otherwise
+            count = 0
+            chunks = count_bytes(response.iter_content(chunk_size=65536), class_name)
+            for item in iter_imdata(chunks):
+                count += 1
+                yield item
+            apic_objects.labels(class_name).inc(count)
+
+        # Stop after the last page
+        if not page_size or count < page_size:
+            return
+        page += 1
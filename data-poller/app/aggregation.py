@@ -0,0 +1,57 @@
+from typing import Dict, Iterable, List
+
+# Functions aggregating values of series with the same labels
+AGGREGATION_FUNCTIONS = ("sum", "avg", "min", "max", "count")
+
+
+class Aggregator:
+    """
+    Aggregates samples of a metric over the whole poll cycle,
+    grouped by all their labels except the DN.
+
+    Only the running value and count are kept for every group,
+    so memory doesn't depend on the number of MOs.
+    """
+
+    def __init__(self, function: str):
+        if function not in AGGREGATION_FUNCTIONS:
+            raise ValueError(f"unknown aggregation function: {function}")
+        self.function = function
+        self._groups: Dict[tuple, List[float]] = {}
+
+    def add(self, samples: Iterable[tuple]) -> None:
+        """
+        Aggregate samples in a single pass.
+
+        :param samples: samples with DN, label values and value
+        """
+        groups = self._groups
+        function = self.function
+        for sample in samples:
+            key = sample[1:-1]
+            value = sample[-1]
+            group = groups.get(key)
+            if group is None:
+                groups[key] = [value, 1]
+            elif function == "min":
+                group[0] = min(group[0], value)
+                group[1] += 1
+            elif function == "max":
+                group[0] = max(group[0], value)
+                group[1] += 1
+            else:
+                group[0] += value
+                group[1] += 1
+
+    def samples(self) -> List[tuple]:
+        """
+        Get aggregated samples, and start over.
+
+        :return: samples with label values and aggregated value
+        """
+        groups, self._groups = self._groups, {}
+        if self.function == "avg":
+            return [(*key, value / count) for key, (value, count) in groups.items()]
+        if self.function == "count":
+            return [(*key, float(count)) for key, (_, count) in groups.items()]
+        return [(*key, value) for key, (value, _) in groups.items()]
@@ -0,0 +1,115 @@
+import hashlib
+import logging
+import time
+from threading import Event, Thread
+from typing import Dict, Hashable, Optional, Tuple
+
+import redis
+
+from .instrumentation import observe_redis
+
+logger = logging.getLogger("gunicorn.error")
+
+# Replicas of the poller, scored by time of their last heartbeat
+REPLICAS_KEY = "poller-replicas"
+
+
+def _weight(replica_id: str, key: Hashable) -> int:
+    digest = hashlib.blake2b(f"{replica_id}|{key}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+class Cluster:
+    """
+    Replicas of the poller, that split metrics between each other.
+
+    Every replica registers in Redis with periodic heartbeats,
+    and replicas that stopped sending them are removed after the timeout.
+    Metrics are assigned with rendezvous hashing of their query key,
+    so metrics sharing the APIC query stay together, and only metrics
+    of the replica that joined or left are moved.
+    State of the metrics is kept in Redis, so other replica continues it.
+    """
+
+    def __init__(
+        self, db: redis.Redis, replica_id: str, interval: float = 5, timeout: float = 15
+    ):
+        self.db = db
+        self.replica_id = replica_id
+        self.interval = interval
+        self.timeout = timeout
+        self.replicas: Tuple[str, ...] = (replica_id,)
+        self._owners: Dict[Hashable, str] = {}
+        self._stopped = Event()
+
+    def start(self) -> None:
+        """
+        Register the replica, and keep sending heartbeats in the background.
+        """
+        self.heartbeat()
+        Thread(target=self._run, daemon=True).start()
+
+    def stop(self) -> None:
+        """
+        Unregister the replica, so others take its metrics over immediately.
+        """
+        self._stopped.set()
+        try:
+            self.db.zrem(REPLICAS_KEY, self.replica_id)
+        except Exception as e:
+            logger.error(f"error unregistering poller replica: {e}")
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            try:
+                self.heartbeat()
+            except Exception as e:
+                logger.error(f"error sending poller heartbeat: {e}")
+
+    @observe_redis
+    def heartbeat(self) -> None:
+        """
+        Mark the replica as alive, drop the dead ones, and load current replicas.
+        """
+        now = int(time.time() * 1000)
+        pipe = self.db.pipeline()
+        pipe.zadd(REPLICAS_KEY, {self.replica_id: now})
+        pipe.zremrangebyscore(REPLICAS_KEY, "-inf", now - self.timeout * 1000)
+        pipe.zrange(REPLICAS_KEY, 0, -1)
+        replicas = tuple(sorted(x.decode("utf-8") for x in pipe.execute()[-1]))
+        if replicas != self.replicas:
+            logger.info(f"poller replicas changed: {', '.join(replicas)}")
+            self._owners = {}
+            self.replicas = replicas
+
+    def owner(self, key: Hashable) -> str:
+        """
+        Get replica responsible for the key.
+
+        :param key: query key of the metric
+        :return: replica ID
+        """
+        owners = self._owners
+        owner: Optional[str] = owners.get(key)
+        if owner is None:
+            owner = max(self.replicas, key=lambda x: _weight(x, key))
+            owners[key] = owner
+        return owner
+
+    def owns(self, key: Hashable) -> bool:
+        """
+        Check if this replica is responsible for the key.
+
+        :param key: query key of the metric
+        :return: True when it should process it
+        """
+        return self.owner(key) == self.replica_id
+
+    def is_leader(self) -> bool:
+        """
+        Check if this replica should run the cluster-wide tasks,
+        like deleting data of obsolete metrics.
+
+        :return: True for a single replica
+        """
+        return self.replicas[0] == self.replica_id
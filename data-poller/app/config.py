@@ -1,4 +1,7 @@
 from os import environ
+from re import match
+from socket import gethostname
+from typing import Dict, Tuple
 
 # Redis connection URL, where metrics configuration is stored
 DB_REDIS_URL = environ.get("DB_REDIS_URL") or ""
@@ -6,18 +9,128 @@ DB_REDIS_URL = environ.get("DB_REDIS_URL") or ""
 # Configure logging level
 LOG_LEVEL = environ.get("LOG_LEVEL") or "INFO"
 
+# Configure how Prometheus receives metrics:
+# "push" sends them to the Push Gateway, "pull" exposes them on /metrics endpoint
+PROMETHEUS_MODE = environ.get("PROMETHEUS_MODE") or "push"
+
 # Configure Prometheus Push Gateway
 PROMETHEUS_PUSHGATEWAY_URL = environ.get("PROMETHEUS_PUSHGATEWAY_URL") or ""
 
-# Configure ACI
+# Maximum number of series sent to the Push Gateway in a single request
+PROMETHEUS_PUSH_CHUNK_SIZE = int(environ.get("PROMETHEUS_PUSH_CHUNK_SIZE") or 10000)
+
+# Configure where series are sent in "push" mode: "pushgateway",
+# "remote_write" (Prometheus remote-write endpoint) or "file" (local file)
+POLLER_SINK = environ.get("POLLER_SINK") or "pushgateway"
+PROMETHEUS_REMOTE_WRITE_URL = environ.get("PROMETHEUS_REMOTE_WRITE_URL") or ""
+POLLER_SINK_FILE = environ.get("POLLER_SINK_FILE") or ""
+POLLER_SINK_FILE_FORMAT = environ.get("POLLER_SINK_FILE_FORMAT") or "ndjson"
+
+# Chunks are written to the sink in the background: maximum number of queued
+# chunks (polling waits when it's full, 0 writes them synchronously),
+# number of writer threads, and maximum number of chunks written at once
+POLLER_SINK_QUEUE_SIZE = int(environ.get("POLLER_SINK_QUEUE_SIZE") or 1000)
+POLLER_SINK_WORKERS = int(environ.get("POLLER_SINK_WORKERS") or 4)
+POLLER_SINK_BATCH_SIZE = int(environ.get("POLLER_SINK_BATCH_SIZE") or 10)
+
+# After the poller or APIC was unavailable, intervals missed by metrics of
+# statistics classes (e.g. eqptIngrBytes5min) are filled from their history
+# classes (e.g. eqptIngrBytesHist5min), up to the max age (in seconds).
+# Only sinks keeping timestamps support it, 0 disables it
+POLLER_BACKFILL_MAX_AGE = float(environ.get("POLLER_BACKFILL_MAX_AGE") or 3600)
+
+# Configure polling engine: "threaded" or "asyncio"
+POLLER_ENGINE = environ.get("POLLER_ENGINE") or "threaded"
+
+# Configure scheduler: number of worker threads, and what to do when
+# processing a metric takes longer than its interval ("skip" or "queue")
+POLLER_WORKERS = int(environ.get("POLLER_WORKERS") or 16)
+POLLER_OVERLAP_POLICY = environ.get("POLLER_OVERLAP_POLICY") or "skip"
+
+# Configuration changes are published by the Configuration API,
+# but it is also checked periodically (in seconds), in case any is missed
+POLLER_CONFIG_REFRESH = float(environ.get("POLLER_CONFIG_REFRESH") or 30)
+
+# Interval of looking for data of deleted metrics (in seconds),
+# besides the configuration changes
+POLLER_SWEEP_INTERVAL = float(environ.get("POLLER_SWEEP_INTERVAL") or 60)
+
+# Groups of series, that haven't changed since the last push, are not pushed again
+# until they are older than the max staleness (in seconds), 0 pushes them always
+POLLER_MAX_STALENESS = float(environ.get("POLLER_MAX_STALENESS") or 300)
+
+# Replicas of the poller split metrics between each other: each one registers
+# with a unique ID, and sends heartbeats in the interval (in seconds).
+# Replica without a heartbeat for 3 intervals is considered dead
+POLLER_REPLICA_ID = environ.get("POLLER_REPLICA_ID") or gethostname()
+POLLER_HEARTBEAT_INTERVAL = float(environ.get("POLLER_HEARTBEAT_INTERVAL") or 5)
+
+# Configure asyncio engine: number of metric groups processed concurrently
+POLLER_ASYNC_TASKS = int(environ.get("POLLER_ASYNC_TASKS") or 256)
+
+# Configure ACI, URL may contain comma-separated list of APIC cluster members
 ACI_URL = environ.get("ACI_URL") or ""
 ACI_USERNAME = environ.get("ACI_USERNAME") or ""
 ACI_PASSWORD = environ.get("ACI_PASSWORD") or ""
 
+# Configure multiple fabrics polled at once: comma-separated names, each with
+# ACI_<NAME>_URL, ACI_<NAME>_USERNAME and ACI_<NAME>_PASSWORD variables.
+# Without it, the variables above configure a single "default" fabric
+ACI_FABRIC_NAMES = [
+    x.strip() for x in (environ.get("ACI_FABRICS") or "").split(",") if x.strip()
+]
+ACI_FABRICS: Dict[str, Tuple[str, str, str]] = (
+    {
+        name: (
+            environ.get(f"ACI_{name.upper()}_URL") or "",
+            environ.get(f"ACI_{name.upper()}_USERNAME") or "",
+            environ.get(f"ACI_{name.upper()}_PASSWORD") or "",
+        )
+        for name in ACI_FABRIC_NAMES
+    }
+    if ACI_FABRIC_NAMES
+    else {"default": (ACI_URL, ACI_USERNAME, ACI_PASSWORD)}
+)
+
+# Maximum number of concurrent connections to a single host (asyncio engine),
+# and timeout of connecting and reading single response (in seconds)
+ACI_MAX_CONNECTIONS_PER_HOST = int(environ.get("ACI_MAX_CONNECTIONS_PER_HOST") or 8)
+ACI_REQUEST_TIMEOUT = float(environ.get("ACI_REQUEST_TIMEOUT") or 5)
+
+# Number of MOs loaded from APIC in a single request, 0 disables paging
+ACI_PAGE_SIZE = int(environ.get("ACI_PAGE_SIZE") or 5000)
+
 # Validate
 if not DB_REDIS_URL:
     raise EnvironmentError("Missing DB_REDIS_URL environment variable")
-if not ACI_URL or not ACI_USERNAME or not ACI_PASSWORD:
-    raise EnvironmentError("Missing ACI_* environment variables")
-if not PROMETHEUS_PUSHGATEWAY_URL:
-    raise EnvironmentError("Missing PROMETHEUS_PUSHGATEWAY_URL environment variable")
+for fabric, (url, username, password) in ACI_FABRICS.items():
+    if not match(r"^[a-zA-Z0-9_]+$", fabric):
+        raise EnvironmentError(f"Invalid fabric name '{fabric}' in ACI_FABRICS")
+    if not url or not username or not password:
+        suffix = "" if fabric == "default" else f" of '{fabric}' fabric"
+        raise EnvironmentError(f"Missing ACI_* environment variables{suffix}")
+if POLLER_ENGINE not in ("threaded", "asyncio"):
+    raise EnvironmentError("POLLER_ENGINE should be either 'threaded' or 'asyncio'")
+if POLLER_OVERLAP_POLICY not in ("skip", "queue"):
+    raise EnvironmentError("POLLER_OVERLAP_POLICY should be either 'skip' or 'queue'")
+if PROMETHEUS_MODE not in ("push", "pull"):
+    raise EnvironmentError("PROMETHEUS_MODE should be either 'push' or 'pull'")
+if POLLER_SINK not in ("pushgateway", "remote_write", "file"):
+    raise EnvironmentError(
+        "POLLER_SINK should be either 'pushgateway', 'remote_write' or 'file'"
+    )
+if POLLER_SINK_FILE_FORMAT not in ("ndjson", "openmetrics"):
+    raise EnvironmentError(
+        "POLLER_SINK_FILE_FORMAT should be either 'ndjson' or 'openmetrics'"
+    )
+if PROMETHEUS_MODE == "push":
+    if POLLER_SINK == "pushgateway" and not PROMETHEUS_PUSHGATEWAY_URL:
+        raise EnvironmentError(
+            "Missing PROMETHEUS_PUSHGATEWAY_URL environment variable"
+        )
+    if POLLER_SINK == "remote_write" and not PROMETHEUS_REMOTE_WRITE_URL:
+        raise EnvironmentError(
+            "Missing PROMETHEUS_REMOTE_WRITE_URL environment variable"
+        )
+    if POLLER_SINK == "file" and not POLLER_SINK_FILE:
+        raise EnvironmentError("Missing POLLER_SINK_FILE environment variable")
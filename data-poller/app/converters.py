@@ -0,0 +1,64 @@
+from functools import lru_cache
+from json import dumps, loads
+from typing import Callable, Optional, Union
+
+# Converter of the attribute value from APIC (always string) to the gauge value
+Converter = Callable[[str], float]
+
+# Converter declared in the metric: "float", "int", "bool", or map of enum values
+ConverterSpec = Union[None, str, dict]
+
+_true_values = {"true", "yes", "on", "up", "enabled", "1"}
+_false_values = {"false", "no", "off", "down", "disabled", "0"}
+
+
+def _convert_int(value: str) -> float:
+    if value[:2].lower() == "0x":
+        return int(value, 16)
+    return int(value)
+
+
+def _convert_bool(value: str) -> float:
+    normalized = value.strip().lower()
+    if normalized in _true_values:
+        return 1
+    if normalized in _false_values:
+        return 0
+    raise ValueError(f"invalid boolean value: {value}")
+
+
+def _build_enum_converter(mapping: dict) -> Converter:
+    values = {str(key): float(value) for key, value in mapping.items()}
+
+    def convert(value: str) -> float:
+        try:
+            return values[value]
+        except KeyError:
+            raise ValueError(f"unknown enum value: {value}")
+
+    return convert
+
+
+@lru_cache(maxsize=1024)
+def _compile(spec: str) -> Converter:
+    parsed = loads(spec)
+    if parsed is None or parsed == "float":
+        return float
+    if parsed == "int":
+        return _convert_int
+    if parsed == "bool":
+        return _convert_bool
+    if isinstance(parsed, dict) and parsed:
+        return _build_enum_converter(parsed)
+    raise ValueError(f"unknown converter: {spec}")
+
+
+def get_converter(spec: Optional[ConverterSpec]) -> Converter:
+    """
+    Get compiled converter of attribute values.
+    Converters are compiled once, and reused as long as the declaration is the same.
+
+    :param spec: converter declared in the metric, None for float
+    :return: function converting value, raising ValueError when it's invalid
+    """
+    return _compile(dumps(spec, sort_keys=True))
@@ -0,0 +1,105 @@
+from functools import lru_cache
+from typing import Dict, List, Tuple
+
+# Labels extracted from the DN, by prefix of the relative name (RN)
+RN_LABELS = {
+    "pod": "pod",
+    "node": "node",
+    "paths": "node",
+    "protpaths": "node",
+    "tn": "tenant",
+    "ap": "ap",
+    "epg": "epg",
+    "BD": "bd",
+    "ctx": "vrf",
+    "out": "l3out",
+    "phys": "interface",
+    "aggr": "interface",
+    "pathep": "interface",
+}
+
+# Labels that may be extracted from DNs
+DN_LABELS = tuple(sorted(set(RN_LABELS.values())))
+
+
+def split_dn(dn: str) -> List[str]:
+    """
+    Split DN into relative names, keeping slashes inside brackets,
+    e.g. "topology/pod-1/node-101/sys/phys-[eth1/2]".
+
+    :param dn: DN
+    :return: relative names
+    """
+    rns = []
+    start = 0
+    depth = 0
+    for index, char in enumerate(dn):
+        if char == "[":
+            depth += 1
+        elif char == "]":
+            depth = max(depth - 1, 0)
+        elif char == "/" and depth == 0:
+            rns.append(dn[start:index])
+            start = index + 1
+    rns.append(dn[start:])
+    return rns
+
+
+def parse_dn(dn: str) -> Dict[str, str]:
+    """
+    Extract labels from DN, the deepest RN wins when the label repeats.
+
+    :param dn: DN
+    :return: label values by label name
+    """
+    labels = {}
+    for rn in split_dn(dn):
+        prefix, separator, value = rn.partition("-")
+        label = RN_LABELS.get(prefix)
+        if label is not None and separator:
+            if value.startswith("[") and value.endswith("]"):
+                value = value[1:-1]
+            labels[label] = value
+    return labels
+
+
+class DnParser:
+    """
+    Extracts selected labels from DNs of a single class.
+
+    The same MOs are returned in every poll cycle, so results are memoized
+    per DN, and the labels cost only a dictionary lookup after the first cycle.
+    """
+
+    def __init__(self, labels: Tuple[str, ...], max_size: int = 200000):
+        self.labels = labels
+        self.max_size = max_size
+        self._cache: Dict[str, Tuple[str, ...]] = {}
+
+    def __call__(self, dn: str) -> Tuple[str, ...]:
+        """
+        Get values of the selected labels.
+
+        :param dn: DN
+        :return: label values, empty when the DN doesn't contain them
+        """
+        values = self._cache.get(dn)
+        if values is None:
+            parsed = parse_dn(dn)
+            values = tuple(parsed.get(label, "") for label in self.labels)
+            if len(self._cache) >= self.max_size:
+                self._cache.clear()
+            self._cache[dn] = values
+        return values
+
+
+@lru_cache(maxsize=1024)
+def get_dn_parser(class_name: str, labels: Tuple[str, ...]) -> DnParser:
+    """
+    Get parser of DNs of the class, shared by metrics of the class.
+
+    :param class_name: class name
+    :param labels: names of labels to extract
+    :return: parser
+    """
+    return DnParser(labels)
@@ -0,0 +1,222 @@
+import re
+from functools import lru_cache
+from typing import Callable, Iterator, List, Optional, Set, Tuple, Union
+
+# Filter node: ("and"|"or", [nodes]) or (operator, property, value)
+Node = Union[Tuple[str, list], Tuple[str, str, str]]
+
+_token_pattern = re.compile(
+    r"\s*(?:(?P<name>[a-zA-Z_][a-zA-Z0-9_]*(?:\.[a-zA-Z0-9_]+)*)"
+    r'|(?P<string>"(?:[^"\\]|\\.)*")|(?P<punct>[(),]))'
+)
+
+_comparisons = {"eq", "ne", "lt", "le", "gt", "ge", "wcard"}
+
+# Operators that can be evaluated locally: APIC compares strings and enums as they
+# are, and numeric properties by their values, so numbers are compared as numbers
+_local_operators = {"and", "or", "eq", "ne"}
+
+_number_pattern = re.compile(
+    r"[-+]?(?:[0-9]+(?:\.[0-9]*)?|\.[0-9]+)(?:[eE][-+]?[0-9]+)?"
+)
+
+
+def _tokenize(query: str) -> List[str]:
+    tokens = []
+    offset = 0
+    while offset < len(query):
+        match = _token_pattern.match(query, offset)
+        if not match:
+            if query[offset:].strip() == "":
+                break
+            raise ValueError(f"invalid query filter at {offset}")
+        tokens.append(match.group(match.lastgroup or 0))
+        offset = match.end()
+    return tokens
+
+
+# Local predicates nest a call per level, so deeper filters are left to APIC
+MAX_LOCAL_DEPTH = 32
+
+
+@lru_cache(maxsize=1024)
+def parse_filter(query: str) -> Optional[Node]:
+    """
+    Parse APIC query filter iteratively, so nesting depth is not limited
+    by the stack.
+
+    :param query: query filter
+    :return: root node, or None when filter is empty
+    :raises ValueError: when the filter is invalid
+    """
+    tokens = _tokenize(query)
+    if not tokens:
+        return None
+    position = 0
+
+    def take() -> str:
+        nonlocal position
+        if position >= len(tokens):
+            raise ValueError("unexpected end of query filter")
+        position += 1
+        return tokens[position - 1]
+
+    def expect(token: str) -> None:
+        if take() != token:
+            raise ValueError(f"expected {token} in query filter")
+
+    # Groups that are not closed yet, with their children parsed so far
+    stack: List[Tuple[str, list]] = []
+    while True:
+        operator = take()
+        expect("(")
+        if operator in ("and", "or"):
+            stack.append((operator, []))
+            continue
+        if operator not in _comparisons:
+            raise ValueError(f"unknown operator in query filter: {operator}")
+        prop = take()
+        expect(",")
+        value = take()
+        expect(")")
+        if not value.startswith('"'):
+            raise ValueError("expected string value in query filter")
+        node: Node = (operator, prop, value[1:-1].replace('\\"', '"'))
+
+        # Close all groups finished after this node
+        while stack:
+            stack[-1][1].append(node)
+            token = take()
+            if token == ",":
+                break
+            if token != ")":
+                raise ValueError("expected , or ) in query filter")
+            node = stack.pop()
+        else:
+            if position != len(tokens):
+                raise ValueError("unexpected data at the end of query filter")
+            return node
+
+
+def _conditions(node: Node) -> Iterator[Tuple[str, str, int]]:
+    """
+    Iterate conditions of the filter, without recursion.
+
+    :param node: root node
+    :return: operator, property and nesting depth of every condition
+    """
+    stack = [(node, 0)]
+    while stack:
+        current, depth = stack.pop()
+        if current[0] in ("and", "or"):
+            stack.extend((child, depth + 1) for child in current[1])  # type: ignore
+        else:
+            yield current[0], current[1], depth  # type: ignore
+
+
+@lru_cache(maxsize=1024)
+def is_local_filter(class_name: str, query: str) -> bool:
+    """
+    Check if the filter may be evaluated locally on MOs of the class.
+
+    :param class_name: queried class name
+    :param query: query filter
+    :return: True when it's possible
+    """
+    try:
+        node = parse_filter(query)
+    except ValueError:
+        return False
+    if node is None:
+        return True
+    return all(
+        operator in _local_operators
+        and prop.startswith(f"{class_name}.")
+        and "." not in prop[len(class_name) + 1 :]
+        and depth <= MAX_LOCAL_DEPTH
+        for operator, prop, depth in _conditions(node)
+    )
+
+
+@lru_cache(maxsize=1024)
+def get_filter_attributes(query: str) -> Set[str]:
+    """
+    Get names of attributes compared by the filter, without the class name.
+
+    :param query: valid query filter
+    :return: attribute names
+    """
+    node = parse_filter(query)
+    if node is None:
+        return set()
+    return {prop.split(".", 1)[-1] for _, prop, _ in _conditions(node)}
+
+
+def _compile_condition(node: Node) -> Callable[[dict], bool]:
+    operator, prop, value = node  # type: ignore
+    attribute = prop.split(".", 1)[1]
+    equals = _equals(value)
+    if operator == "eq":
+        return lambda data: equals(data.get(attribute))
+    return lambda data: not equals(data.get(attribute))
+
+
+def _compile_group(
+    operator: str, children: List[Callable[[dict], bool]]
+) -> Callable[[dict], bool]:
+    if operator == "and":
+        return lambda data: all(child(data) for child in children)
+    return lambda data: any(child(data) for child in children)
+
+
+def _compile(node: Node) -> Callable[[dict], bool]:
+    # Iterate in post-order, as nesting may be deep
+    results: List[Callable[[dict], bool]] = []
+    stack: List[Tuple[Node, bool]] = [(node, False)]
+    while stack:
+        current, visited = stack.pop()
+        if current[0] not in ("and", "or"):
+            results.append(_compile_condition(current))
+        elif not visited:
+            stack.append((current, True))
+            stack.extend((x, False) for x in reversed(current[1]))  # type: ignore
+        else:
+            start = len(results) - len(current[1])
+            children = results[start:]
+            del results[start:]
+            results.append(_compile_group(current[0], children))
+    return results[0]
+
+
+def _equals(value: str) -> Callable[[Optional[str]], bool]:
+    """
+    Build a check of attribute values equal to the filter value,
+    e.g. "0.000000" of numeric property is equal to "0".
+
+    :param value: filter value
+    :return: function returning True when the attribute value is equal
+    """
+    if not _number_pattern.fullmatch(value):
+        return lambda x: x == value
+    number = float(value)
+    return lambda x: x == value or (
+        x is not None
+        and _number_pattern.fullmatch(x) is not None
+        and float(x) == number
+    )
+
+
+@lru_cache(maxsize=1024)
+def compile_filter(query: str) -> Callable[[dict], bool]:
+    """
+    Build a predicate evaluating the filter locally against MO attributes.
+    Should be used only for filters accepted by is_local_filter,
+    which also limits their depth.
+
+    :param query: query filter
+    :return: function returning True when MO attributes match the filter
+    """
+    node = parse_filter(query)
+    if node is None:
+        return lambda data: True
+    return _compile(node)
@@ -0,0 +1,107 @@
+import re
+from datetime import datetime, timezone
+from typing import Match, Optional
+
+# Statistics classes of the current interval, e.g. "eqptIngrBytes5min",
+# have history classes keeping past intervals, e.g. "eqptIngrBytesHist5min"
+_stats_class_pattern = re.compile(
+    r"^(?P<prefix>[a-z][a-zA-Z0-9]*?)"
+    r"(?P<granularity>5min|15min|1h|1d|1w|1mo|1qtr|1year)$"
+)
+
+
+# Granularities of fixed length, in milliseconds
+_granularity_ms = {
+    "5min": 5 * 60 * 1000,
+    "15min": 15 * 60 * 1000,
+    "1h": 60 * 60 * 1000,
+    "1d": 24 * 60 * 60 * 1000,
+}
+
+
+def _match_stats_class(class_name: str) -> Optional[Match[str]]:
+    match = _stats_class_pattern.match(class_name)
+    if match is None or match["prefix"].endswith("Hist"):
+        return None
+    return match
+
+
+def get_history_class(class_name: str) -> Optional[str]:
+    """
+    Get history class of the statistics class.
+
+    :param class_name: class name
+    :return: history class name, None when the class is not a statistics one
+    """
+    match = _match_stats_class(class_name)
+    if match is None:
+        return None
+    return f"{match['prefix']}Hist{match['granularity']}"
+
+
+def get_interval_index(class_name: str, timestamp_ms: float) -> Optional[int]:
+    """
+    Get number of the statistics interval containing the time, counted in UTC,
+    weeks from Monday, and longer intervals by calendar.
+
+    :param class_name: statistics class name
+    :param timestamp_ms: time in milliseconds
+    :return: interval number, None when the class is not a statistics one
+    """
+    match = _match_stats_class(class_name)
+    if match is None:
+        return None
+    granularity = match["granularity"]
+    if granularity in _granularity_ms:
+        return int(timestamp_ms // _granularity_ms[granularity])
+    value = datetime.fromtimestamp(timestamp_ms / 1000, timezone.utc)
+    if granularity == "1w":
+        return (value.toordinal() - 1) // 7
+    months = value.year * 12 + value.month - 1
+    if granularity == "1mo":
+        return months
+    return months // 3 if granularity == "1qtr" else value.year
+
+
+def format_timestamp(timestamp_ms: float) -> str:
+    """
+    Format time as the APIC does, e.g. "2022-08-01T10:05:00.000+00:00".
+
+    :param timestamp_ms: time in milliseconds
+    :return: formatted time
+    """
+    value = datetime.fromtimestamp(timestamp_ms / 1000, timezone.utc)
+    return value.isoformat(timespec="milliseconds")
+
+
+def parse_timestamp(value: str) -> int:
+    """
+    Parse time formatted by the APIC.
+
+    :param value: formatted time
+    :return: time in milliseconds
+    """
+    return int(datetime.fromisoformat(value).timestamp() * 1000)
+
+
+def build_history_filter(history_class: str, since_ms: float) -> str:
+    """
+    Build query filter of history records of intervals, that ended after the time.
+
+    :param history_class: history class name
+    :param since_ms: time in milliseconds
+    :return: query filter
+    """
+    return f'gt({history_class}.repIntvEnd,"{format_timestamp(since_ms)}")'
+
+
+def get_current_dn(dn: str, class_name: str) -> str:
+    """
+    Get DN of the current statistics of the history record,
+    e.g. ".../HDeqptIngrBytes5min-3" is recorded for ".../CDeqptIngrBytes5min".
+
+    :param dn: DN of the history record
+    :param class_name: statistics class name
+    :return: DN of the current statistics MO
+    """
+    return f"{dn.rpartition('/')[0]}/CD{class_name}"
@@ -0,0 +1,151 @@
+from functools import wraps
+from typing import Callable, Iterable, Iterator, TypeVar
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram
+
+# Poller's own metrics, exposed separately from the monitored ones
+registry = CollectorRegistry(auto_describe=True)
+
+_byte_buckets = (1e3, 1e4, 1e5, 1e6, 1e7, 1e8, float("inf"))
+
+apic_request_seconds = Histogram(
+    "aci_monitoring_poller_apic_request_seconds",
+    "Time until APIC started responding to the class query",
+    ["class_name"],
+    registry=registry,
+)
+apic_response_bytes = Histogram(
+    "aci_monitoring_poller_apic_response_bytes",
+    "Size of the APIC class query response",
+    ["class_name"],
+    buckets=_byte_buckets,
+    registry=registry,
+)
+apic_objects = Counter(
+    "aci_monitoring_poller_apic_objects",
+    "Number of MOs returned by APIC",
+    ["class_name"],
+    registry=registry,
+)
+metric_processing_seconds = Histogram(
+    "aci_monitoring_poller_metric_processing_seconds",
+    "Time of processing the metric, from querying APIC to sending all series",
+    ["metric"],
+    registry=registry,
+)
+metric_errors = Counter(
+    "aci_monitoring_poller_metric_errors",
+    "Number of failed metric processing attempts",
+    ["metric"],
+    registry=registry,
+)
+series_emitted = Counter(
+    "aci_monitoring_poller_series",
+    "Number of series sent to Prometheus",
+    ["metric"],
+    registry=registry,
+)
+series_skipped = Counter(
+    "aci_monitoring_poller_series_skipped",
+    "Number of series not sent to Prometheus, as they haven't changed",
+    ["metric"],
+    registry=registry,
+)
+series_backfilled = Counter(
+    "aci_monitoring_poller_series_backfilled",
+    "Number of past samples sent from APIC history records, to fill gaps",
+    ["metric"],
+    registry=registry,
+)
+backfill_skipped = Counter(
+    "aci_monitoring_poller_backfill_skipped",
+    "Number of metrics and attributes that couldn't be filled from history records",
+    ["metric"],
+    registry=registry,
+)
+invalid_values = Counter(
+    "aci_monitoring_poller_invalid_values",
+    "Number of attribute values that couldn't be converted",
+    ["metric"],
+    registry=registry,
+)
+push_seconds = Histogram(
+    "aci_monitoring_poller_push_seconds",
+    "Time of pushing a single group to the Push Gateway",
+    ["metric"],
+    registry=registry,
+)
+sink_write_seconds = Histogram(
+    "aci_monitoring_poller_sink_write_seconds",
+    "Time of writing a single batch of chunks to the output sink",
+    ["sink"],
+    registry=registry,
+)
+sink_errors = Counter(
+    "aci_monitoring_poller_sink_errors",
+    "Number of batches that failed to be written to the output sink",
+    ["sink"],
+    registry=registry,
+)
+sink_queue_items = Gauge(
+    "aci_monitoring_poller_sink_queue_items",
+    "Number of chunks waiting to be written to the output sink",
+    registry=registry,
+)
+deletes = Counter(
+    "aci_monitoring_poller_deletes",
+    "Number of groups deleted from the Push Gateway",
+    ["metric"],
+    registry=registry,
+)
+scheduler_lag_seconds = Histogram(
+    "aci_monitoring_poller_scheduler_lag_seconds",
+    "Delay between time when the metric was due and when it started processing",
+    ["metric"],
+    registry=registry,
+)
+loop_seconds = Histogram(
+    "aci_monitoring_poller_loop_seconds",
+    "Time of a single iteration of the processing loop, excluding waiting",
+    registry=registry,
+)
+redis_request_seconds = Histogram(
+    "aci_monitoring_poller_redis_request_seconds",
+    "Time of the Redis round-trip",
+    ["operation"],
+    registry=registry,
+)
+
+T = TypeVar("T", bound=Callable)
+
+
+def observe_redis(func: T) -> T:
+    """
+    Measure Redis round-trips of the function, labelled with its name.
+
+    :param func: function accessing Redis
+    :return: wrapped function
+    """
+    histogram = redis_request_seconds.labels(func.__name__)
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with histogram.time():
+            return func(*args, **kwargs)
+
+    return wrapper  # type: ignore
+
+
+def count_bytes(chunks: Iterable[bytes], class_name: str) -> Iterator[bytes]:
+    """
+    Pass through response chunks, and record the response size at the end.
+
+    :param chunks: response body chunks
+    :param class_name: queried class name
+    :return: the same chunks
+    """
+    size = 0
+    for chunk in chunks:
+        size += len(chunk)
+        yield chunk
+    apic_response_bytes.labels(class_name).observe(size)
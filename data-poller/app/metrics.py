@@ -1,18 +1,47 @@
+import logging
 import time
-from typing import List, Set
-from json import loads, dumps
+from threading import Event, Lock, Thread
+from typing import Iterable, List, Optional, Set
+from json import loads
 
 import redis
 
+from .instrumentation import observe_redis
 
-def get_processed_key(name: str) -> str:
+logger = logging.getLogger("gunicorn.error")
+
+# Metrics are stored by name in a hash, and indexed in order of addition
+METRICS_KEY = "metric-configs"
+METRICS_INDEX_KEY = "metric-names"
+
+# Metrics list used by previous versions, until the Configuration API migrates it
+LEGACY_METRICS_KEY = "metrics"
+
+# Names of processed metrics, scored by time when they were processed last time
+PROCESSED_KEY = "metrics-processed"
+
+# Configuration version, incremented and published on every change
+METRICS_VERSION_KEY = "metrics-version"
+METRICS_CHANNEL = "metrics-changed"
+
+
+def get_legacy_processed_key(name: str) -> str:
     return f"processed-{name}"
 
 
 def get_related_ids_key(name: str) -> str:
+    return f"related-{name}"
+
+
+def get_legacy_related_ids_key(name: str) -> str:
     return f"mos-{name}"
 
 
+def _decode_ids(ids: Set[bytes]) -> Set[str]:
+    return set(x.decode("utf-8") for x in ids)
+
+
+@observe_redis
 def get_metrics(db: redis.Redis) -> List[dict]:
     """
     Get monitored items from Redis.
@@ -20,9 +49,116 @@ def get_metrics(db: redis.Redis) -> List[dict]:
     :param db: Redis instance
     :return: list of metrics from database
     """
-    return loads(db.get("metrics") or "[]")
+    pipe = db.pipeline()
+    pipe.zrange(METRICS_INDEX_KEY, 0, -1)
+    pipe.hgetall(METRICS_KEY)
+    pipe.get(LEGACY_METRICS_KEY)
+    names, configs, legacy = pipe.execute()
+    if legacy is not None:
+        return loads(legacy)
+    return [loads(configs[name]) for name in names if name in configs]
+
+
+@observe_redis
+def get_metrics_version(db: redis.Redis) -> int:
+    """
+    Get current version of metrics configuration.
+
+    :param db: Redis instance
+    :return: version, 0 when it has never changed
+    """
+    return int(db.get(METRICS_VERSION_KEY) or 0)
+
+
+class MetricsCache:
+    """
+    Parsed metrics configuration, reloaded only when its version changes.
+
+    The configuration API publishes the new version on every change.
+    As notifications may be lost (e.g. while reconnecting),
+    the version is also checked periodically.
+    """
 
+    def __init__(self, db: redis.Redis, fallback_interval: float = 30):
+        self.db = db
+        self.fallback_interval = fallback_interval
+        self.version: Optional[int] = None
+        self.metrics: List[dict] = []
+        self.checked_at = 0.0
+        self._changed = Event()
+        self._lock = Lock()
 
+    def start(self) -> None:
+        """
+        Start listening for configuration changes in the background.
+        """
+        Thread(target=self._listen, daemon=True).start()
+
+    def _listen(self) -> None:
+        while True:
+            try:
+                pubsub = self.db.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(METRICS_CHANNEL)
+                # Changes might have been missed before subscribing
+                self._changed.set()
+                for message in pubsub.listen():
+                    if message.get("type") == "message":
+                        logger.debug(f"metrics configuration changed: {message}")
+                        self._changed.set()
+            except Exception as e:
+                logger.error(f"error listening for configuration changes: {e}")
+                time.sleep(1)
+
+    def wait(self, timeout: float) -> None:
+        """
+        Wait until the configuration changes, or the timeout passes.
+
+        :param timeout: maximum time to wait in seconds
+        """
+        self._changed.wait(timeout)
+
+    def get(self) -> List[dict]:
+        """
+        Get current metrics configuration.
+
+        :return: list of metrics
+        """
+        with self._lock:
+            fallback = time.time() - self.checked_at >= self.fallback_interval
+            if not self._changed.is_set() and not fallback:
+                return self.metrics
+            self._changed.clear()
+            self.checked_at = time.time()
+            version = get_metrics_version(self.db)
+            if version != self.version or self.version is None:
+                self.metrics = get_metrics(self.db)
+                self.version = version
+            return self.metrics
+
+
+@observe_redis
+def migrate_processed_metrics(db: redis.Redis) -> None:
+    """
+    Move processing times saved by previous versions in separate keys
+    into the processed metrics index.
+
+    :param db: Redis instance
+    """
+    keys = list(db.scan_iter(match=get_legacy_processed_key("*"), count=1000))
+    if not keys:
+        return
+    prefix_length = len(get_legacy_processed_key(""))
+    names = [key[prefix_length:].decode("utf-8") for key in keys]
+    values = db.mget(keys)
+    pipe = db.pipeline()
+    for name, value in zip(names, values):
+        if value is not None:
+            pipe.zadd(PROCESSED_KEY, {name: int(value)})
+    pipe.delete(*keys)
+    pipe.execute()
+
+
+@observe_redis
 def get_last_processing_time(db: redis.Redis, names: List[str]) -> dict:
     """
     Get last time the metrics has been processed.
@@ -31,10 +167,11 @@ def get_last_processing_time(db: redis.Redis, names: List[str]) -> dict:
     :param names: list of metrics names to load
     :return: dictionary of <metric name, time when it was processed last time>
     """
-    results = db.mget([get_processed_key(name) for name in names])
+    results = db.zmscore(PROCESSED_KEY, names)
     return dict(zip(names, [int(x or 0) for x in results]))
 
 
+@observe_redis
 def mark_as_processed(db: redis.Redis, name: str) -> None:
     """
     Mark a metric as just processed.
@@ -42,9 +179,10 @@ def mark_as_processed(db: redis.Redis, name: str) -> None:
     :param db: Redis instance
     :param name: metric name
     """
-    db.set(get_processed_key(name), int(time.time() * 1000))
+    db.zadd(PROCESSED_KEY, {name: int(time.time() * 1000)})
 
 
+@observe_redis
 def get_processed_metric_names(db: redis.Redis) -> Set[str]:
     """
     Get list of metric names that has been processed.
@@ -52,23 +190,29 @@ def get_processed_metric_names(db: redis.Redis) -> Set[str]:
     :param db: Redis instance
     :return: list of processed metric names
     """
-    keys = db.keys(get_processed_key("*"))
-    prefix_length = len(get_processed_key("name")) - 4
-    return set([key[prefix_length:].decode("utf-8") for key in keys])
+    return _decode_ids(set(db.zrange(PROCESSED_KEY, 0, -1)))
 
 
-def delete_metric_data(db: redis.Redis, name: str) -> None:
+@observe_redis
+def delete_metric_data(db: redis.Redis, names: Iterable[str]) -> None:
     """
-    Clears information about metric.
+    Clears information about metrics.
     Used to remove obsolete data.
 
     :param db: Redis instance
-    :param name: metric name
+    :param names: metric names
     """
-    db.delete(get_processed_key(name))
-    db.delete(get_related_ids_key(name))
+    names = list(names)
+    if not names:
+        return
+    pipe = db.pipeline()
+    pipe.zrem(PROCESSED_KEY, *names)
+    for name in names:
+        pipe.delete(get_related_ids_key(name), get_legacy_related_ids_key(name))
+    pipe.execute()
 
 
+@observe_redis
 def get_metric_related_ids(db: redis.Redis, name: str) -> Set[str]:
     """
     Get list of gauge IDs related to the metric.
@@ -77,15 +221,52 @@ def get_metric_related_ids(db: redis.Redis, name: str) -> Set[str]:
     :param name: metric name
     :return: list of IDs
     """
-    return set(loads(db.get(get_related_ids_key(name)) or "[]"))
+    pipe = db.pipeline()
+    pipe.smembers(get_related_ids_key(name))
+    pipe.get(get_legacy_related_ids_key(name))
+    related_ids, legacy_ids = pipe.execute()
+    return _decode_ids(related_ids) | set(loads(legacy_ids or "[]"))
+
+
+@observe_redis
+def sync_metric_related_ids(
+    db: redis.Redis, name: str, related_ids: Set[str]
+) -> Set[str]:
+    """
+    Replace list of IDs related to the metric,
+    in a single round-trip to the database.
+
+    :param db: Redis instance
+    :param name: metric name
+    :param related_ids: IDs of currently pushed groups
+    :return: IDs that are no longer related to the metric
+    """
+    key = get_related_ids_key(name)
+    next_key = f"{key}-next"
+    legacy_key = get_legacy_related_ids_key(name)
+    pipe = db.pipeline()
+    if related_ids:
+        pipe.sadd(next_key, *related_ids)
+        pipe.sdiff(key, next_key)
+        pipe.rename(next_key, key)
+    else:
+        pipe.smembers(key)
+        pipe.delete(key)
+    pipe.get(legacy_key)
+    pipe.delete(legacy_key)
+    results = pipe.execute()
+    removed_ids = _decode_ids(results[-4]) | set(loads(results[-2] or "[]"))
+    return removed_ids - related_ids
 
 
-def save_metric_related_ids(db: redis.Redis, name: str, related_ids: Set[str]) -> None:
+@observe_redis
+def add_metric_related_ids(db: redis.Redis, name: str, related_ids: Set[str]) -> None:
     """
-    Save list of IDs related to the metric.
+    Add IDs related to the metric, e.g. when they couldn't be deleted yet.
 
     :param db: Redis instance
     :param name: metric name
-    :param related_ids: DNs of related MOs
+    :param related_ids: IDs of pushed groups
     """
-    db.set(get_related_ids_key(name), dumps(list(related_ids)))
+    if related_ids:
+        db.sadd(get_related_ids_key(name), *related_ids)
@@ -1,52 +1,129 @@
+import asyncio
+import atexit
 import logging
-import hashlib
 import re
-from threading import Thread
-from typing import List
+from collections import Counter
+from concurrent.futures import Future
+from functools import partial
+from threading import Lock
+from typing import (
+    Counter as TypingCounter,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Type,
+    TypeVar,
+)
 import time
 
-from acitoolkit import Session  # type: ignore
 import redis
-from prometheus_client import (
-    CollectorRegistry,
-    Gauge,
-    push_to_gateway,
-    delete_from_gateway,
-)
 
-from ..aci import get_aci_session, aci_query
+from .fingerprints import Fingerprint, Fingerprints, fingerprint
+from .scheduler import Scheduler, now_ms
+from ..aci import get_aci_session, get_attributes, aci_query
+from ..cluster import Cluster
 from ..db import create_db
+from ..session import ApicSession
+from ..aggregation import Aggregator
+from ..converters import Converter, get_converter
+from ..dn import get_dn_parser
+from ..filters import compile_filter, get_filter_attributes, is_local_filter
+from ..history import (
+    build_history_filter,
+    get_current_dn,
+    get_history_class,
+    get_interval_index,
+    parse_timestamp,
+)
+from ..instrumentation import (
+    backfill_skipped,
+    deletes,
+    invalid_values as invalid_values_counter,
+    loop_seconds,
+    metric_errors,
+    metric_processing_seconds,
+    series_backfilled,
+    series_emitted,
+    series_skipped,
+)
+from ..sinks import Chunk, SinkWriter, create_sink
+from ..subscription import get_subscription_manager
+from ..store import store, render_samples
 from ..metrics import (
-    get_metrics,
+    MetricsCache,
     get_last_processing_time,
     mark_as_processed,
+    migrate_processed_metrics,
     get_processed_metric_names,
     get_metric_related_ids,
-    save_metric_related_ids,
+    sync_metric_related_ids,
+    add_metric_related_ids,
     delete_metric_data,
 )
 from ..config import (
-    ACI_URL,
-    ACI_PASSWORD,
-    ACI_USERNAME,
+    ACI_FABRICS,
+    ACI_PAGE_SIZE,
     LOG_LEVEL,
-    PROMETHEUS_PUSHGATEWAY_URL,
+    POLLER_BACKFILL_MAX_AGE,
+    POLLER_CONFIG_REFRESH,
+    POLLER_ENGINE,
+    POLLER_HEARTBEAT_INTERVAL,
+    POLLER_MAX_STALENESS,
+    POLLER_OVERLAP_POLICY,
+    POLLER_REPLICA_ID,
+    POLLER_SINK,
+    POLLER_SINK_BATCH_SIZE,
+    POLLER_SINK_QUEUE_SIZE,
+    POLLER_SINK_WORKERS,
+    POLLER_SWEEP_INTERVAL,
+    POLLER_WORKERS,
+    PROMETHEUS_MODE,
+    PROMETHEUS_PUSH_CHUNK_SIZE,
 )
 
 
 # Configure
 logger = logging.getLogger("gunicorn.error")
 logger.setLevel(LOG_LEVEL)
-config = {
-    "url": ACI_URL,
-    "username": ACI_USERNAME,
-    "password": ACI_PASSWORD,
+fabric_configs: Dict[str, dict] = {
+    name: {
+        "name": name,
+        "urls": [url.strip() for url in url.split(",") if url.strip()],
+        "username": username,
+        "password": password,
+    }
+    for name, (url, username, password) in ACI_FABRICS.items()
 }
+label_names = ("dn", "attribute_name", "fabric")
 
+# Fabric configured with ACI_* variables, when multiple fabrics are not used
+DEFAULT_FABRIC = "default"
 
-def hash_metric(name: str, dn: str, attribute: str) -> str:
-    result = hashlib.md5(f"{name}-{dn}-{attribute}".encode("utf-8")).hexdigest()
-    return result
+
+# Number of values that couldn't be converted, per metric and series
+invalid_values: TypingCounter[Tuple[str, str, str]] = Counter()
+invalid_values_lock = Lock()
+
+# Groups pushed in the last cycle of every metric
+fingerprints = Fingerprints(POLLER_MAX_STALENESS)
+
+# Time when every metric was polled last time (in milliseconds), to detect gaps
+last_processed: Dict[str, float] = {}
+
+# Series are written to the sink in the background, in "push" mode
+writer = SinkWriter(
+    create_sink(POLLER_SINK),
+    POLLER_SINK_QUEUE_SIZE,
+    POLLER_SINK_WORKERS,
+    POLLER_SINK_BATCH_SIZE,
+)
+
+
+def get_group_id(name: str, chunk: int) -> str:
+    return f"{name}-{chunk}"
 
 
 def sanitize_name(name: str) -> str:
@@ -59,153 +136,849 @@ def format_dn(class_name: str, dn: str) -> str:
     return dn[0 : -1 * len(class_name)] if dn.endswith(class_name) else dn
 
 
-def send_metric(name: str, class_name: str, dn: str, attribute: str, value: float):
-    formatted_dn = format_dn(class_name, dn)
-    registry = CollectorRegistry()
-    gauge = Gauge(
-        sanitize_name(name), "", labelnames=("dn", "attribute_name"), registry=registry
-    )
-    gauge.labels(formatted_dn, attribute).set(value)
-    logger.debug(f"sending {name}/{attribute} metric to PushGateway")
-    push_to_gateway(
-        PROMETHEUS_PUSHGATEWAY_URL,
-        job="aci_monitoring",
-        grouping_key={"id": hash_metric(name, dn, attribute)},
-        registry=registry,
+def get_label_names(
+    dn_labels: Tuple[str, ...] = (), aggregated: bool = False
+) -> Tuple[str, ...]:
+    """
+    Get names of labels of the metric series.
+
+    :param dn_labels: labels extracted from the DN
+    :param aggregated: are series aggregated, so they don't have the DN
+    :return: label names, the fabric is the last one
+    """
+    names = label_names[1:-1] if aggregated else label_names[:-1]
+    return names + dn_labels + label_names[-1:]
+
+
+class MetricBatch:
+    """
+    Collects series of a single metric during one poll cycle,
+    and sends them to Prometheus in chunks.
+
+    In "push" mode, each chunk is written to the sink as a separate group,
+    in the background. The Push Gateway replaces the whole group,
+    so series of MOs that disappeared are dropped with the next push,
+    and only groups that are no longer used need to be deleted.
+    Groups that haven't changed since the last push are skipped,
+    until they are stale, when the sink keeps them.
+    All chunks are timestamped with the time when the batch was created,
+    i.e. just before the APIC query, unless the time is provided.
+
+    In "pull" mode, chunks are rendered as they arrive, and the metric
+    is replaced in the local store when the batch is closed.
+
+    Batches of metrics polled from multiple fabrics have separate names,
+    but their series are sent under the same metric name with the fabric label.
+    Selected labels may be also extracted from DNs, e.g. pod, node or tenant.
+
+    Aggregated metrics collect all series of the cycle first,
+    and send only the aggregates grouped by the selected DN labels.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        class_name: str,
+        chunk_size: int,
+        mode: str = PROMETHEUS_MODE,
+        converter: Converter = float,
+        fabric: str = DEFAULT_FABRIC,
+        metric_name: Optional[str] = None,
+        dn_labels: Tuple[str, ...] = (),
+        aggregation: Optional[dict] = None,
+        timestamp_ms: Optional[int] = None,
+    ):
+        self.name = name
+        self.metric_name = sanitize_name(metric_name or name)
+        self.timestamp_ms = int(now_ms()) if timestamp_ms is None else timestamp_ms
+        self.fabric = fabric
+        self.aggregator: Optional[Aggregator] = None
+        if aggregation is not None:
+            self.aggregator = Aggregator(aggregation["function"])
+            dn_labels = tuple(aggregation.get("by") or ())
+        self.label_names = get_label_names(dn_labels, self.aggregator is not None)
+        self.parse_dn = get_dn_parser(class_name, dn_labels) if dn_labels else None
+        self.class_name = class_name
+        self.chunk_size = chunk_size
+        self.mode = mode
+        self.converter = converter
+        self.group_ids: Set[str] = set()
+        self.blocks: List[bytes] = []
+        self.values: List[Tuple[str, str, str]] = []
+        self.invalid_values: TypingCounter[Tuple[str, str]] = Counter()
+        self.skips_unchanged = bool(fingerprints.max_staleness) and (
+            writer.sink.keeps_groups
+        )
+        self.previous = fingerprints.get(name) if self.skips_unchanged else {}
+        self.fingerprints: Dict[str, Fingerprint] = {}
+
+    def add(self, dn: str, attribute: str, value: str) -> None:
+        self.values.append((dn, attribute, value))
+        if len(self.values) >= self.chunk_size:
+            self.flush()
+
+    def convert(self) -> List[tuple]:
+        """
+        Convert collected values in a single pass,
+        skipping the invalid ones.
+
+        :return: samples with DN, attribute name, DN labels and value
+        """
+        convert = self.converter
+        parse_dn = self.parse_dn
+        samples: List[tuple] = []
+        for dn, attribute, value in self.values:
+            dn = format_dn(self.class_name, dn)
+            try:
+                if parse_dn is None:
+                    samples.append((dn, attribute, convert(value)))
+                else:
+                    samples.append((dn, attribute, *parse_dn(dn), convert(value)))
+            except (TypeError, ValueError):
+                self.invalid_values[(dn, attribute)] += 1
+        return samples
+
+    def flush(self) -> None:
+        samples = self.convert()
+        self.values = []
+        if self.aggregator is not None:
+            self.aggregator.add(samples)
+        else:
+            self.emit(samples)
+
+    def emit(self, samples: List[tuple]) -> None:
+        """
+        Send single chunk of series.
+
+        :param samples: samples with label values (except the fabric) and value
+        """
+        if not samples:
+            return
+        if self.mode == "pull":
+            series_emitted.labels(self.name).inc(len(samples))
+            self.blocks.append(
+                render_samples(
+                    self.metric_name, self.label_names, samples, (self.fabric,)
+                )
+            )
+            return
+
+        group_id = get_group_id(self.name, len(self.group_ids))
+        self.group_ids.add(group_id)
+        if not self.skips_unchanged:
+            series_emitted.labels(self.name).inc(len(samples))
+            self.push(group_id, samples)
+            return
+        value = fingerprint(samples)
+        previous = self.previous.get(group_id)
+        if previous is not None and fingerprints.is_fresh(previous, value):
+            series_skipped.labels(self.name).inc(len(samples))
+            self.fingerprints[group_id] = previous
+        else:
+            series_emitted.labels(self.name).inc(len(samples))
+            self.fingerprints[group_id] = (value, time.time())
+            self.push(group_id, samples)
+
+    def chunk(self, group_id: str, samples: List[tuple]) -> Chunk:
+        return Chunk(
+            self.name,
+            self.metric_name,
+            group_id,
+            self.label_names,
+            samples,
+            self.fabric,
+            self.timestamp_ms,
+        )
+
+    def push(self, group_id: str, samples: List[tuple]) -> None:
+        future = writer.write(self.chunk(group_id, samples))
+        future.add_done_callback(partial(self.written, group_id))
+
+    def written(self, group_id: str, future: Future) -> None:
+        """
+        Handle result of writing the chunk, called by the writer.
+        Groups that failed are pushed again in the next cycle.
+
+        :param group_id: group ID
+        :param future: finished write
+        """
+        error = future.exception()
+        if error is not None:
+            self.failed(group_id, error)
+
+    def failed(self, group_id: str, error: BaseException) -> None:
+        """
+        Forget the group that failed to be written, so it's pushed
+        again in the next cycle.
+
+        :param group_id: group ID
+        :param error: error of the write
+        """
+        logger.error(
+            f"error sending '{self.name}' metric: {error}", {"name": self.name}
+        )
+        metric_errors.labels(self.name).inc()
+        self.fingerprints.pop(group_id, None)
+        fingerprints.discard(self.name, group_id)
+
+    def close(self) -> None:
+        self.flush()
+        if self.aggregator is not None:
+            samples = self.aggregator.samples()
+            for index in range(0, len(samples), self.chunk_size):
+                self.emit(samples[index : index + self.chunk_size])
+        if self.invalid_values:
+            count = sum(self.invalid_values.values())
+            invalid_values_counter.labels(self.name).inc(count)
+            logger.warning(f"skipped {count} invalid values of '{self.name}' metric")
+            with invalid_values_lock:
+                for (dn, attribute), count in self.invalid_values.items():
+                    invalid_values[(self.name, dn, attribute)] += count
+            self.invalid_values.clear()
+        if self.mode == "pull":
+            store.set(self.name, self.metric_name, b"".join(self.blocks))
+            self.blocks = []
+        elif self.skips_unchanged:
+            fingerprints.set(self.name, self.fingerprints)
+
+
+class BackfillBatch(MetricBatch):
+    """
+    Metric batch of a single past interval, that waits until all its chunks
+    are written, so they reach the sink before series of later intervals.
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.futures: List[Future] = []
+
+    def push(self, group_id: str, samples: List[tuple]) -> None:
+        series_backfilled.labels(self.name).inc(len(samples))
+        self.futures.append(writer.write(self.chunk(group_id, samples)))
+
+    def close(self) -> None:
+        super().close()
+        for future in self.futures:
+            future.result()
+
+
+Batch = TypeVar("Batch", bound=MetricBatch)
+
+
+def create_batch(metric: dict, batch_class: Type[Batch], **kwargs) -> Batch:
+    """
+    Create batch collecting series of the metric.
+
+    :param metric: metric configuration
+    :param batch_class: batch class
+    :param kwargs: other arguments of the batch
+    :return: batch
+    """
+    return batch_class(
+        metric["name"],
+        metric["className"],
+        PROMETHEUS_PUSH_CHUNK_SIZE,
+        converter=get_converter(metric.get("converter")),
+        fabric=metric.get("fabric", DEFAULT_FABRIC),
+        metric_name=metric.get("metricName"),
+        dn_labels=tuple(metric.get("dnLabels") or ()),
+        aggregation=metric.get("aggregation"),
+        **kwargs,
     )
 
 
 def delete_metric_by_id(related_id: str):
-    delete_from_gateway(
-        PROMETHEUS_PUSHGATEWAY_URL,
-        job="aci_monitoring",
-        grouping_key={"id": related_id},
-    )
+    # Waits for writes of the group queued before, and raises when it failed
+    writer.delete(related_id).result()
 
 
-def delete_metric(db: redis.Redis, name: str):
-    related_ids = get_metric_related_ids(db, name)
+def delete_metric(db: redis.Redis, name: str, pushed_ids: Optional[Set[str]] = None):
+    fingerprints.forget(name)
+    if PROMETHEUS_MODE == "pull":
+        store.delete(name)
+        return
+    related_ids = get_metric_related_ids(db, name) | (pushed_ids or set())
     for related_id in related_ids:
         delete_metric_by_id(related_id)
+        deletes.labels(name).inc()
+
+
+def delete_obsolete_groups(db: redis.Redis, name: str, group_ids: Set[str]) -> None:
+    # Save information about recently pushed groups
+    try:
+        obsolete_group_ids = sync_metric_related_ids(db, name, group_ids)
+    except Exception as e:
+        logger.error(f"error saving related IDs for {name} metric: {e}")
+        return
+
+    logger.debug(f"deleting {len(obsolete_group_ids)} obsolete groups for {name}")
+    for group_id in list(obsolete_group_ids):
+        try:
+            delete_metric_by_id(group_id)
+            deletes.labels(name).inc()
+            obsolete_group_ids.remove(group_id)
+        except Exception as e:
+            logger.error(f"error deleting obsolete group {group_id} for {name}: {e}")
+
+    # Keep groups that failed to be deleted, to retry in the next run
+    try:
+        add_metric_related_ids(db, name, obsolete_group_ids)
+    except Exception as e:
+        logger.error(f"error saving related IDs for {name} metric: {e}")
+
 
+def get_query_filter(metric: dict) -> str:
+    """
+    Get query filter of the metric, in the canonical form when it's available.
+    Metrics with equivalent filters have the same canonical one.
 
-def delete_all_metrics():
-    delete_from_gateway(PROMETHEUS_PUSHGATEWAY_URL, job="aci_monitoring")
+    :param metric: metric configuration
+    :return: query filter
+    """
+    return metric.get("optimizedQueryFilter", metric["queryFilter"])
 
 
-def process_metric(db: redis.Redis, session: Session, metric: dict) -> None:
-    # Load data
-    name: str = metric["name"]
+def get_query_key(metric: dict) -> Tuple[str, str, Optional[str]]:
+    """
+    Get key of the APIC query used by the metric.
+    Metrics with the same key are loaded with a single query.
+
+    :param metric: metric configuration
+    :return: mode, class name, and query filter (None when it can be merged)
+    """
+    mode: str = metric.get("mode") or "poll"
+    class_name: str = metric["className"]
+    query_filter = get_query_filter(metric)
+    if mode == "poll" and is_local_filter(class_name, query_filter):
+        return mode, class_name, None
+    return mode, class_name, query_filter
+
+
+def build_query_filter(metrics: List[dict]) -> str:
+    """
+    Build query filter, that matches MOs of all provided metrics.
+
+    :param metrics: metrics with the same query key
+    :return: query filter
+    """
+    query_filters = sorted(set(get_query_filter(metric) for metric in metrics))
+    if len(query_filters) == 1:
+        return query_filters[0]
+    if "" in query_filters:
+        return ""
+    return f"or({','.join(query_filters)})"
+
+
+def includes_health(metrics: List[dict]) -> bool:
+    """
+    Check if the health subtree should be queried, as any metric needs it.
+
+    :param metrics: metrics with the same query key
+    :return: True when any metric opted in
+    """
+    return any(metric.get("includeHealth") for metric in metrics)
+
+
+def load_items(
+    session: ApicSession,
+    metric: dict,
+    query_filter: str,
+    include_health: bool = False,
+) -> Iterable[dict]:
+    """
+    Load MOs for the metric, either from the APIC subscription or by polling.
+    Subscriptions don't include the health subtree.
+
+    :param session: APIC session
+    :param metric: metric configuration
+    :param query_filter: query filter
+    :param include_health: include the health subtree when polling
+    :return: MOs in the APIC "imdata" format
+    """
     class_name: str = metric["className"]
-    query_filter: str = metric["queryFilter"]
-    attributes: List[str] = metric["attributes"]
+    if metric.get("mode") == "subscribe":
+        manager = get_subscription_manager(session)
+        subscription = manager.get(class_name, query_filter)
+        if subscription is not None:
+            return subscription.items()
+    return aci_query(session, class_name, query_filter, ACI_PAGE_SIZE, include_health)
+
+
+def is_backfill_enabled() -> bool:
+    """
+    Check if gaps are filled, as the sink keeps timestamps of past samples.
+
+    :return: True when they are
+    """
+    return (
+        PROMETHEUS_MODE == "push"
+        and POLLER_BACKFILL_MAX_AGE > 0
+        and writer.sink.keeps_timestamps
+    )
+
+
+def get_backfill_start(metric: dict, started_ms: float) -> Optional[float]:
+    """
+    Get start of the gap since the metric was polled last time,
+    when a whole interval of its statistics class passed without any poll,
+    so its history record is missing. The gap is limited by the max age.
+
+    :param metric: metric configuration
+    :param started_ms: time when the current poll started
+    :return: time in milliseconds, None when there's no gap
+    """
+    processed_ms = last_processed.get(metric["name"])
+    if not processed_ms:
+        return None
+    start_ms = max(processed_ms, started_ms - POLLER_BACKFILL_MAX_AGE * 1000)
+    first = get_interval_index(metric["className"], start_ms)
+    last = get_interval_index(metric["className"], started_ms)
+    if first is None or last is None or last - first < 2:
+        return None
+    return start_ms
+
+
+def backfill_metrics(
+    session: ApicSession, metrics: List[dict], started_ms: float
+) -> None:
+    """
+    Fill gaps of metrics with the same query key, that missed some intervals,
+    from records of the history class of their statistics class
+    (e.g. eqptIngrBytesHist5min for eqptIngrBytes5min), loaded in a single query.
+
+    Records are sent with the time when their interval ended, in order,
+    and before series of the current poll, as sinks may reject older samples.
+    Filters are evaluated with the DN of the current statistics MO.
+    Metrics with filters that can't be evaluated locally, or on attributes
+    the history class lacks, are not filled, and neither are the attributes
+    the history class lacks (e.g. "...Last"); they are logged and counted.
+
+    :param session: APIC session
+    :param metrics: metrics with the same query key
+    :param started_ms: time when the current poll started
+    """
+    class_name: str = metrics[0]["className"]
+    history_class = get_history_class(class_name)
+    if history_class is None:
+        return
+    gaps = []
+    for metric in metrics:
+        start_ms = get_backfill_start(metric, started_ms)
+        if start_ms is None:
+            continue
+        if not is_local_filter(class_name, get_query_filter(metric)):
+            skip_backfill(metric, "its filter can't be evaluated locally")
+            continue
+        gaps.append((metric, start_ms, compile_filter(get_query_filter(metric))))
+    if not gaps:
+        return
 
-    # Get all matching items from ACI
+    # Load records of all missed intervals, they are sorted by DN,
+    # and refer to the DN of the current statistics MO
+    since_ms = min(start_ms for _, start_ms, _ in gaps)
+    logger.info(f"filling gaps of {len(gaps)} metrics from {history_class}")
+    query_filter = build_history_filter(history_class, since_ms)
+    intervals: Dict[int, List[dict]] = {}
+    available = {"dn"}
+    for item in aci_query(session, history_class, query_filter, ACI_PAGE_SIZE):
+        data = item[history_class]["attributes"]
+        ended_ms = parse_timestamp(data["repIntvEnd"])
+        if ended_ms <= started_ms:
+            available.update(data)
+            data["dn"] = get_current_dn(data["dn"], class_name)
+            intervals.setdefault(ended_ms, []).append(data)
+    if not intervals:
+        return
+
+    filled = []
+    for metric, start_ms, predicate in gaps:
+        missing = get_filter_attributes(get_query_filter(metric)) - available
+        if missing:
+            skip_backfill(metric, f"its filter uses {', '.join(sorted(missing))}")
+            continue
+        missing = set(metric["attributes"]) - available
+        if missing:
+            skip_backfill(metric, f"records have no {', '.join(sorted(missing))}")
+        attributes = [x for x in metric["attributes"] if x not in missing]
+        if attributes:
+            filled.append((metric, start_ms, predicate, attributes))
+
+    for ended_ms in sorted(intervals):
+        for metric, start_ms, predicate, attributes in filled:
+            if ended_ms <= start_ms:
+                continue
+            batch = create_batch(metric, BackfillBatch, timestamp_ms=ended_ms)
+            for data in intervals[ended_ms]:
+                if not predicate(data):
+                    continue
+                for attribute in attributes:
+                    if attribute in data:
+                        batch.add(data["dn"], attribute, data[attribute])
+            batch.close()
+
+
+def skip_backfill(metric: dict, reason: str) -> None:
+    logger.warning(
+        f"gaps of {metric['name']} metric can't be filled fully "
+        f"from history records: {reason}"
+    )
+    backfill_skipped.labels(metric["name"]).inc()
+
+
+def fill_gaps(session: ApicSession, metrics: List[dict], started_ms: float) -> None:
+    """
+    Fill gaps of metrics, when it's enabled, without failing their processing.
+
+    :param session: APIC session
+    :param metrics: metrics with the same query key
+    :param started_ms: time when the current poll started
+    """
+    if not is_backfill_enabled():
+        return
+    try:
+        backfill_metrics(session, metrics, started_ms)
+    except Exception as e:
+        names = [metric["name"] for metric in metrics]
+        logger.error(f"error filling gaps of metrics {names}: {e}")
+
+
+def fail_metric(
+    db: redis.Redis, name: str, batch: Optional[MetricBatch] = None
+) -> None:
+    metric_errors.labels(name).inc()
+    try:
+        delete_metric(db, name, batch.group_ids if batch else None)
+    except Exception as e:
+        logger.error(f"error deleting '{name}' metric: {e}", {"name": name})
+
+
+def process_metrics(db: redis.Redis, session: ApicSession, metrics: List[dict]) -> None:
+    """
+    Load data for metrics with the same query key from APIC in a single query,
+    and send it to Prometheus.
+
+    :param db: Redis instance
+    :param session: APIC session
+    :param metrics: metrics with the same query key
+    """
+    started_at = time.perf_counter()
+    class_name: str = metrics[0]["className"]
+    query_filter = build_query_filter(metrics)
+    include_health = includes_health(metrics)
+    names = [metric["name"] for metric in metrics]
+
+    # Fill intervals missed since the last poll first, they are older
+    fill_gaps(session, metrics, now_ms())
+
+    # Prepare batches, with local filters when the query has been merged
+    batches = {
+        metric["name"]: (
+            metric["attributes"],
+            create_batch(metric, MetricBatch),
+            None
+            if get_query_filter(metric) == query_filter
+            else compile_filter(get_query_filter(metric)),
+        )
+        for metric in metrics
+    }
+
+    # Stream all matching items from ACI, and pass each to every matching metric
     try:
         logger.debug(
             "loading ACI data",
-            {"name": name, "class_name": class_name, "query_filter": query_filter},
+            {"names": names, "class_name": class_name, "query_filter": query_filter},
         )
-        items = aci_query(session, class_name, query_filter)
-        mos = set([item[class_name]["attributes"]["dn"] for item in items])
+        for item in load_items(session, metrics[0], query_filter, include_health):
+            mo = item[class_name]
+            data = get_attributes(mo) if include_health else mo["attributes"]
+            dn = data["dn"]
+            for name, (attributes, batch, predicate) in list(batches.items()):
+                if predicate is not None and not predicate(data):
+                    continue
+                try:
+                    for attribute in attributes:
+                        batch.add(dn, attribute, data[attribute])
+                except Exception as e:
+                    logger.error(f"error sending '{name}' metric: {e}", {"name": name})
+                    del batches[name]
+                    fail_metric(db, name, batch)
     except Exception as e:
         logger.error(
             f"error querying ACI: ${e}",
-            {"name": name, "class_name": class_name, "query_filter": query_filter},
+            {"names": names, "class_name": class_name, "query_filter": query_filter},
         )
-        try:
-            delete_metric(db, name)
-        except Exception as e:
-            logger.error(f"error deleting '{name}' metric: {e}", {"name": name})
+        for name, (_, batch, _) in batches.items():
+            fail_metric(db, name, batch)
         return
 
-    # Iterate over every item
-    try:
-        for item in items:
-            data = item[class_name]["attributes"]
-            dn = data["dn"]
-            for attribute in attributes:
-                send_metric(name, class_name, dn, attribute, data[attribute])
-    except Exception as e:
-        logger.error(f"error sending '{name}' metric: {e}", {"name": name})
+    for name, (_, batch, _) in batches.items():
         try:
-            delete_metric(db, name)
+            batch.close()
         except Exception as e:
-            logger.error(f"error deleting '{name}' metric: {e}", {"name": name})
-        return
+            logger.error(f"error sending '{name}' metric: {e}", {"name": name})
+            fail_metric(db, name, batch)
+            continue
+        elapsed = time.perf_counter() - started_at
+        metric_processing_seconds.labels(name).observe(elapsed)
+        last_processed[name] = batch.timestamp_ms
+
+        # Save information that it has been just processed
+        try:
+            mark_as_processed(db, name)
+        except Exception as e:
+            logger.error(f"error marking '{name}' metric as processed: {e}")
 
-    # Save information that it has been just processed
-    try:
-        mark_as_processed(db, name)
-    except Exception as e:
-        logger.error(f"error marking '{name}' metric as processed: {e}")
+        # Delete groups that are no longer used (i.e. less MOs than before)
+        if PROMETHEUS_MODE == "push":
+            delete_obsolete_groups(db, name, batch.group_ids)
 
-    # Delete metrics for obsolete MOs
-    try:
-        previous_related_ids = get_metric_related_ids(db, name)
-        current_related_ids = set()
-        for dn in mos:
-            for attribute in attributes:
-                current_related_ids.add(hash_metric(name, dn, attribute))
-        obsolete_related_ids = previous_related_ids - current_related_ids
-        logger.debug(
-            f"deleting {len(obsolete_related_ids)} obsolete entries for {name}"
-        )
-        for related_id in obsolete_related_ids:
-            delete_metric_by_id(related_id)
-    except Exception as e:
-        logger.error(f"error deleting obsolete entries for {name}: {e}")
 
-    # Save information about recent MOs
+def process_metric(db: redis.Redis, session: ApicSession, metric: dict) -> None:
+    process_metrics(db, session, [metric])
+
+
+def process_fabric_metrics(db: redis.Redis, config: dict, metrics: List[dict]) -> None:
+    """
+    Process metrics with the same query key in the fabric,
+    logging in when it's polled for the first time.
+
+    :param db: Redis instance
+    :param config: fabric configuration
+    :param metrics: metrics with the same query key
+    """
     try:
-        if previous_related_ids != current_related_ids:
-            save_metric_related_ids(db, name, current_related_ids)
+        session = get_aci_session(config)
     except Exception as e:
-        logger.error(f"error saving related IDs for {name} metric: {e}")
+        logger.error(f"error obtaining APIC session of '{config['name']}' fabric: {e}")
+        for metric in metrics:
+            fail_metric(db, metric["name"])
+        return
+    process_metrics(db, session, metrics)
 
 
-def process():
-    db = create_db()
+def for_fabric(metric: dict, fabric: str) -> dict:
+    """
+    Get configuration of the metric polled from the fabric.
+    Its data is kept under the name including the fabric (besides the default one),
+    and the name of the Prometheus metric is kept in "metricName".
 
-    # Obtain APIC session - retry after minimum second
-    session = None
-    while session is None:
-        try:
-            session = get_aci_session(config)
-        except Exception as e:
-            logger.error(f"error obtaining APIC session: {e}")
-            time.sleep(1)
+    :param metric: metric configuration
+    :param fabric: fabric name
+    :return: metric configuration with "fabric"
+    """
+    name = metric["name"] if fabric == DEFAULT_FABRIC else f"{metric['name']}@{fabric}"
+    return metric | {"name": name, "metricName": metric["name"], "fabric": fabric}
 
-    # Processing loop
-    while True:
-        # Wait a moment to avoid immediate operations
-        time.sleep(0.5)
 
-        # Load recent configuration and last processing time
-        metrics = get_metrics(db)
-        names = [metric["name"] for metric in metrics]
-        processed_at = get_last_processing_time(db, names)
+# Metrics expanded to their fabrics, for the last configuration
+_fabric_metrics: Tuple[Optional[List[dict]], Tuple[str, ...], List[dict]] = (
+    None,
+    (),
+    [],
+)
+
 
-        # Detect metrics that needs processing, and do it
-        now_ms = time.time() * 1000
-        threads = [
-            Thread(target=process_metric, args=(db, session, metric))
+def get_fabric_metrics(metrics: List[dict], fabrics: Iterable[str]) -> List[dict]:
+    """
+    Get metrics for every fabric they target, all fabrics by default.
+    Fabrics that are not configured here are skipped.
+    The result is reused until the configuration changes.
+
+    :param metrics: metrics configuration
+    :param fabrics: names of configured fabrics
+    :return: metrics with "fabric"
+    """
+    global _fabric_metrics
+    fabrics = tuple(fabrics)
+    source, source_fabrics, result = _fabric_metrics
+    if source is metrics and source_fabrics == fabrics:
+        return result
+    result = [
+        for_fabric(metric, fabric)
+        for metric in metrics
+        for fabric in metric.get("fabrics") or fabrics
+        if fabric in fabrics
+    ]
+    _fabric_metrics = (metrics, fabrics, result)
+    return result
+
+
+def create_cluster(db: redis.Redis) -> Cluster:
+    """
+    Register this replica of the poller, and unregister it on exit.
+
+    :param db: Redis instance
+    :return: started cluster
+    """
+    cluster = Cluster(
+        db, POLLER_REPLICA_ID, POLLER_HEARTBEAT_INTERVAL, 3 * POLLER_HEARTBEAT_INTERVAL
+    )
+    cluster.start()
+    atexit.register(cluster.stop)
+    return cluster
+
+
+def update_schedule(
+    db: redis.Redis,
+    metrics_cache: MetricsCache,
+    schedulers: Dict[str, Scheduler],
+    cluster: Optional[Cluster] = None,
+) -> List[dict]:
+    """
+    Load recent configuration, and last processing time of new metrics,
+    and pass metrics owned by this replica to schedulers of their fabrics.
+
+    Metrics taken over from another replica continue from the processing time
+    it saved, and metrics that are deleted or moved to another replica
+    are no longer exposed here.
+
+    :param db: Redis instance
+    :param metrics_cache: metrics configuration
+    :param schedulers: schedulers to update, by fabric name
+    :param cluster: replicas of the poller, None to process all metrics
+    :return: list of all metrics, for every fabric they target
+    """
+    metrics = get_fabric_metrics(metrics_cache.get(), schedulers)
+    owned = metrics
+    if cluster is not None:
+        owned = [
+            metric
             for metric in metrics
-            if processed_at[metric["name"]] + metric["interval"] < now_ms
+            if cluster.owns((metric["fabric"], get_query_key(metric)))
         ]
-        for x in threads:
-            x.start()
-        for x in threads:
-            x.join()
+    owned_names = set(metric["name"] for metric in owned)
+    fingerprints.retain(owned_names)
+    for name in set(last_processed) - owned_names:
+        last_processed.pop(name, None)
+    names = [
+        metric["name"]
+        for metric in owned
+        if metric["name"] not in schedulers[metric["fabric"]]
+    ]
+    processed_at = get_last_processing_time(db, names) if names else {}
+    last_processed.update(
+        (name, value) for name, value in processed_at.items() if value
+    )
+    for fabric, scheduler in schedulers.items():
+        # Series of metrics that are deleted, or moved to another replica,
+        # are exposed only by the replica that processed them
+        if PROMETHEUS_MODE == "pull":
+            for name in scheduler.names() - owned_names:
+                store.delete(name)
+        scheduler.update([x for x in owned if x["fabric"] == fabric], processed_at)
+    return metrics
+
+
+def delete_obsolete_metrics(db: redis.Redis, metrics: List[dict]) -> None:
+    """
+    Delete data of metrics that are no longer configured.
+
+    :param db: Redis instance
+    :param metrics: list of active metrics
+    """
+    try:
+        processed_metric_names = get_processed_metric_names(db)
+        active_metric_names = set([metric["name"] for metric in metrics])
+        obsolete_metric_names = processed_metric_names - active_metric_names
+        for name in obsolete_metric_names:
+            logger.debug(f"deleting obsolete metric: {name}")
+            delete_metric(db, name)
+        delete_metric_data(db, obsolete_metric_names)
+    except Exception as e:
+        logger.error(f"error detecting/deleting obsolete metrics: {e}")
+
+
+class ObsoleteMetricsSweep:
+    """
+    Decide when to look for obsolete metrics:
+    after configuration changes, and periodically in case any sweep failed.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.version: Optional[int] = None
+        self.swept_at = 0.0
+
+    def is_due(self, version: Optional[int]) -> bool:
+        """
+        Check if the sweep should run now, and mark it as started.
+
+        :param version: current configuration version
+        :return: True when it's due
+        """
+        if version == self.version and time.time() - self.swept_at < self.interval:
+            return False
+        self.version = version
+        self.swept_at = time.time()
+        return True
+
+
+# Time to wait after the processing loop failed (in seconds)
+LOOP_ERROR_DELAY = 1
+
+
+def get_sleep_time(*schedulers: Scheduler) -> float:
+    """
+    Get time to wait until the next run of any scheduler is due.
+
+    :param schedulers: schedulers
+    :return: time in seconds
+    """
+    timeout = 1000.0
+    for scheduler in schedulers:
+        next_due = scheduler.next_due()
+        if next_due is not None:
+            timeout = min(timeout, next_due - now_ms())
+    return max(timeout, 10) / 1000
+
+
+def create_fabric_scheduler(db: redis.Redis, config: dict) -> Scheduler:
+    return Scheduler(
+        lambda metrics: process_fabric_metrics(db, config, metrics),
+        POLLER_WORKERS,
+        POLLER_OVERLAP_POLICY,
+        get_query_key,
+    )
+
 
-        # Delete obsolete metrics
+def process():
+    if POLLER_ENGINE == "asyncio":
+        from .aio import process_async
+
+        asyncio.run(process_async())
+        return
+
+    db = create_db()
+    migrate_processed_metrics(db)
+    metrics_cache = MetricsCache(db, POLLER_CONFIG_REFRESH)
+    metrics_cache.start()
+    cluster = create_cluster(db)
+    sweep = ObsoleteMetricsSweep(POLLER_SWEEP_INTERVAL)
+    atexit.register(writer.close)
+
+    # Every fabric has its own session and workers, so slow fabric doesn't
+    # delay the others, and sessions are obtained when they are used
+    schedulers = {
+        name: create_fabric_scheduler(db, config)
+        for name, config in fabric_configs.items()
+    }
+
+    # Processing loop, that keeps running whatever fails in a single iteration
+    while True:
         try:
-            processed_metric_names = set(get_processed_metric_names(db))
-            active_metric_names = set([metric["name"] for metric in metrics])
-            obsolete_metric_names = processed_metric_names - active_metric_names
-            for name in obsolete_metric_names:
-                logger.debug(f"deleting obsolete metric: {name}")
-                delete_metric(db, name)
-                delete_metric_data(db, name)
+            with loop_seconds.time():
+                metrics = update_schedule(db, metrics_cache, schedulers, cluster)
+
+                # Start processing due metrics, without waiting for them
+                for scheduler in schedulers.values():
+                    scheduler.run_pending()
+
+                # Only one replica deletes data of all obsolete metrics
+                if cluster.is_leader() and sweep.is_due(metrics_cache.version):
+                    delete_obsolete_metrics(db, metrics)
         except Exception as e:
-            logger.error(f"error detecting/deleting obsolete metrics: {e}")
+            logger.error(f"error in processing loop: {e}")
+            time.sleep(LOOP_ERROR_DELAY)
+
+        # Wait for the next run, or configuration change
+        metrics_cache.wait(get_sleep_time(*schedulers.values()))
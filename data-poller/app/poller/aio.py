@@ -0,0 +1,458 @@
+"""
+Polling engine running metric groups as tasks of a single event loop.
+
+Both APIC queries and delivery of the series use the asynchronous HTTP client.
+Chunks are written directly from the event loop, bypassing the writer queues,
+so the loop never waits for the writer threads; sinks without asynchronous
+client write in a thread.
+"""
+import asyncio
+import atexit
+import time
+from typing import (
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
+
+import aiohttp
+import redis
+
+from . import (
+    MetricBatch,
+    ObsoleteMetricsSweep,
+    build_query_filter,
+    DEFAULT_FABRIC,
+    LOOP_ERROR_DELAY,
+    create_batch,
+    create_cluster,
+    delete_obsolete_groups,
+    delete_obsolete_metrics,
+    fabric_configs,
+    fail_metric,
+    fill_gaps,
+    get_backfill_start,
+    get_query_filter,
+    get_query_key,
+    get_sleep_time,
+    includes_health,
+    is_backfill_enabled,
+    last_processed,
+    logger,
+    update_schedule,
+    writer,
+)
+from .scheduler import Scheduler, now_ms
+from ..aci import ImdataParser, build_query_url, get_aci_session, get_attributes
+from ..db import create_db
+from ..filters import compile_filter
+from ..instrumentation import (
+    apic_objects,
+    apic_request_seconds,
+    apic_response_bytes,
+    loop_seconds,
+    metric_processing_seconds,
+)
+from ..metrics import MetricsCache, mark_as_processed, migrate_processed_metrics
+from ..session import BaseApicSession
+from ..sinks import Chunk
+from ..subscription import get_subscription_manager
+from ..config import (
+    ACI_MAX_CONNECTIONS_PER_HOST,
+    ACI_PAGE_SIZE,
+    ACI_REQUEST_TIMEOUT,
+    POLLER_ASYNC_TASKS,
+    POLLER_CONFIG_REFRESH,
+    POLLER_OVERLAP_POLICY,
+    POLLER_SWEEP_INTERVAL,
+)
+
+
+def create_http_session() -> aiohttp.ClientSession:
+    """
+    Create HTTP client with per-host concurrency limit and request timeouts.
+
+    :return: aiohttp session
+    """
+    return aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(
+            limit=0, limit_per_host=ACI_MAX_CONNECTIONS_PER_HOST, ssl=False
+        ),
+        timeout=aiohttp.ClientTimeout(
+            sock_connect=ACI_REQUEST_TIMEOUT, sock_read=ACI_REQUEST_TIMEOUT
+        ),
+    )
+
+
+class AsyncApicSession(BaseApicSession):
+    """
+    Asynchronous session to the APIC cluster,
+    with the same token and failover handling as ApicSession.
+    """
+
+    def __init__(self, http: aiohttp.ClientSession, urls: List[str], *args, **kwargs):
+        super().__init__(urls, *args, **kwargs)
+        self.http = http
+        self._token_lock = asyncio.Lock()
+
+    async def _send(self, method: str, url: str, **kwargs) -> aiohttp.ClientResponse:
+        errors = []
+        for member in self._candidates():
+            started = time.time()
+            try:
+                response = await self.http.request(
+                    method, member.url + url, cookies=self.cookies, **kwargs
+                )
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                errors.append(f"{member.url}: {e!r}")
+            else:
+                if response.status < 500:
+                    self._mark_up(member, time.time() - started)
+                    return response
+                errors.append(f"{member.url}: HTTP {response.status}")
+                response.release()
+            self._mark_down(member)
+        raise ConnectionError(f"no APIC member is available: {'; '.join(errors)}")
+
+    async def _authenticate(self, method: str, url: str, **kwargs) -> None:
+        async with await self._send(method, url, **kwargs) as response:
+            if response.status != 200:
+                text = await response.text()
+                raise Exception(f"APIC authentication failed: {text}")
+            self._update_token(await response.json(content_type=None))
+
+    async def login(self) -> None:
+        """
+        Log in to the APIC cluster.
+        """
+        self.token = None
+        await self._authenticate("POST", "/api/aaaLogin.json", json=self.login_payload)
+
+    async def refresh(self) -> None:
+        """
+        Refresh the token, or log in again when it's not possible.
+        """
+        try:
+            await self._authenticate("GET", "/api/aaaRefresh.json")
+        except Exception as e:
+            logger.info(f"refreshing APIC token failed, logging in again: {e}")
+            await self.login()
+
+    async def get(self, url: str) -> aiohttp.ClientResponse:
+        """
+        Perform GET request to the APIC.
+
+        :param url: URL path, starting with /api
+        :return: response, that should be released by the caller
+        """
+        async with self._token_lock:
+            if self.token is None:
+                await self.login()
+            elif self._claim_refresh():
+                await self.refresh()
+        response = await self._send("GET", url)
+        if response.status == 403:
+            response.release()
+            async with self._token_lock:
+                await self.login()
+            response = await self._send("GET", url)
+        return response
+
+
+async def aci_query_async(
+    session: AsyncApicSession,
+    class_name: str,
+    query: str,
+    page_size: int = 0,
+    include_health: bool = False,
+) -> AsyncIterator[dict]:
+    """
+    Query all MOs of the class matching the filter,
+    streaming the results and loading them in pages.
+
+    :param session: APIC session
+    :param class_name: class name
+    :param query: query filter
+    :param page_size: number of MOs loaded in a single request, 0 to disable paging
+    :param include_health: include the health subtree of every MO
+    :return: asynchronous generator of MOs
+    """
+    page = 0
+    while True:
+        url = build_query_url(class_name, query, page, page_size, include_health)
+        started_at = time.perf_counter()
+        async with await session.get(url) as response:
+            apic_request_seconds.labels(class_name).observe(
+                time.perf_counter() - started_at
+            )
+            if response.status != 200:
+                text = await response.text()
+                raise Exception(f'error while querying "{class_name}": {text}')
+            count = 0
+            size = 0
+            parser = ImdataParser()
+            async for chunk in response.content.iter_chunked(65536):
+                size += len(chunk)
+                for item in parser.feed(chunk):
+                    count += 1
+                    yield item
+            for item in parser.feed(b"", final=True):
+                count += 1
+                yield item
+            apic_response_bytes.labels(class_name).observe(size)
+            apic_objects.labels(class_name).inc(count)
+
+        if not page_size or count < page_size:
+            return
+        page += 1
+
+
+class AsyncMetricBatch(MetricBatch):
+    """
+    Metric batch, that writes chunks with the asynchronous HTTP client
+    of the event loop.
+    """
+
+    def __init__(self, *args, http: aiohttp.ClientSession, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.http = http
+        self.chunks: List[Chunk] = []
+
+    def push(self, group_id: str, samples: List[tuple]) -> None:
+        self.chunks.append(self.chunk(group_id, samples))
+
+    async def send(self) -> None:
+        chunks, self.chunks = self.chunks, []
+        if not chunks:
+            return
+        try:
+            await writer.write_async(chunks, self.http)
+        except Exception as e:
+            for chunk in chunks:
+                self.failed(chunk.group_id, e)
+
+
+async def load_items_async(
+    session: AsyncApicSession,
+    metric: dict,
+    query_filter: str,
+    include_health: bool = False,
+) -> AsyncIterator[dict]:
+    class_name: str = metric["className"]
+    if metric.get("mode") == "subscribe":
+        # Subscriptions use the threaded session, they need requests only rarely
+        def get_subscription():
+            config = fabric_configs[metric.get("fabric", DEFAULT_FABRIC)]
+            manager = get_subscription_manager(get_aci_session(config))
+            return manager.get(class_name, query_filter)
+
+        subscription = await asyncio.to_thread(get_subscription)
+        if subscription is not None:
+            for item in subscription.items():
+                yield item
+            return
+    async for item in aci_query_async(
+        session, class_name, query_filter, ACI_PAGE_SIZE, include_health
+    ):
+        yield item
+
+
+async def process_metrics_async(
+    db: redis.Redis,
+    session: AsyncApicSession,
+    metrics: List[dict],
+) -> None:
+    """
+    Asynchronous version of process_metrics.
+
+    :param db: Redis instance
+    :param session: APIC session
+    :param metrics: metrics with the same query key
+    """
+    started_at = time.perf_counter()
+    class_name: str = metrics[0]["className"]
+    query_filter = build_query_filter(metrics)
+    include_health = includes_health(metrics)
+    names = [metric["name"] for metric in metrics]
+
+    # Fill intervals missed since the last poll first, using the threaded session
+    started_ms = now_ms()
+    if is_backfill_enabled() and any(
+        get_backfill_start(metric, started_ms) is not None for metric in metrics
+    ):
+
+        def backfill() -> None:
+            config = fabric_configs[metrics[0].get("fabric", DEFAULT_FABRIC)]
+            try:
+                session = get_aci_session(config)
+            except Exception as e:
+                logger.error(f"error filling gaps of metrics {names}: {e}")
+                return
+            fill_gaps(session, metrics, started_ms)
+
+        await asyncio.to_thread(backfill)
+
+    batches = {
+        metric["name"]: (
+            metric["attributes"],
+            create_batch(metric, AsyncMetricBatch, http=session.http),
+            None
+            if get_query_filter(metric) == query_filter
+            else compile_filter(get_query_filter(metric)),
+        )
+        for metric in metrics
+    }
+    failed: Set[str] = set()
+
+    async def fail(name: str, batch: AsyncMetricBatch) -> None:
+        failed.add(name)
+        await asyncio.to_thread(fail_metric, db, name, batch)
+
+    try:
+        async for item in load_items_async(
+            session, metrics[0], query_filter, include_health
+        ):
+            mo = item[class_name]
+            data = get_attributes(mo) if include_health else mo["attributes"]
+            dn = data["dn"]
+            for name, (attributes, batch, predicate) in batches.items():
+                if name in failed or (predicate is not None and not predicate(data)):
+                    continue
+                try:
+                    for attribute in attributes:
+                        batch.add(dn, attribute, data[attribute])
+                    await batch.send()
+                except Exception as e:
+                    logger.error(f"error sending '{name}' metric: {e}", {"name": name})
+                    await fail(name, batch)
+    except Exception as e:
+        logger.error(
+            f"error querying ACI: ${e}",
+            {"names": names, "class_name": class_name, "query_filter": query_filter},
+        )
+        for name, (_, batch, _) in batches.items():
+            if name not in failed:
+                await fail(name, batch)
+        return
+
+    for name, (_, batch, _) in batches.items():
+        if name in failed:
+            continue
+        try:
+            batch.close()
+            await batch.send()
+        except Exception as e:
+            logger.error(f"error sending '{name}' metric: {e}", {"name": name})
+            await fail(name, batch)
+            continue
+        elapsed = time.perf_counter() - started_at
+        metric_processing_seconds.labels(name).observe(elapsed)
+        last_processed[name] = batch.timestamp_ms
+
+        def finish(name: str, batch: AsyncMetricBatch) -> None:
+            try:
+                mark_as_processed(db, name)
+            except Exception as e:
+                logger.error(f"error marking '{name}' metric as processed: {e}")
+            if batch.mode == "push":
+                delete_obsolete_groups(db, name, batch.group_ids)
+
+        await asyncio.to_thread(finish, name, batch)
+
+
+class AsyncScheduler(Scheduler):
+    """
+    Scheduler running metrics as tasks in the event loop,
+    with limited number of concurrent tasks.
+    """
+
+    def __init__(
+        self,
+        func: Callable[[List[dict]], Awaitable[None]],
+        tasks: int,
+        *args,
+        **kwargs,
+    ):
+        super().__init__(lambda metrics: None, 1, *args, **kwargs)
+        self.async_func = func
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._tasks: Set[asyncio.Task] = set()
+        self._limit = tasks
+
+    def _submit(self, group: List[Tuple[dict, float]]) -> None:
+        task = asyncio.get_running_loop().create_task(self._run_async(group))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run_async(self, group: List[Tuple[dict, float]]) -> None:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._limit)
+        async with self._semaphore:
+            names = self._started(group)
+            try:
+                await self.async_func([metric for metric, _ in group])
+            except Exception as e:
+                logger.error(f"error processing metrics {names}: {e}")
+            finally:
+                self._finished(group)
+
+
+def create_fabric_scheduler(
+    db: redis.Redis, http: aiohttp.ClientSession, config: dict
+) -> AsyncScheduler:
+    session = AsyncApicSession(
+        http, config["urls"], config["username"], config["password"]
+    )
+    return AsyncScheduler(
+        lambda metrics: process_metrics_async(db, session, metrics),
+        POLLER_ASYNC_TASKS,
+        POLLER_OVERLAP_POLICY,
+        get_query_key,
+    )
+
+
+async def process_async() -> None:
+    db = create_db()
+    await asyncio.to_thread(migrate_processed_metrics, db)
+    metrics_cache = MetricsCache(db, POLLER_CONFIG_REFRESH)
+    metrics_cache.start()
+    cluster = await asyncio.to_thread(create_cluster, db)
+    sweep = ObsoleteMetricsSweep(POLLER_SWEEP_INTERVAL)
+    atexit.register(writer.close)
+
+    async with create_http_session() as http:
+        # Every fabric has its own session and limit of tasks, so slow fabric
+        # doesn't delay the others, and sessions log in when they are used
+        schedulers: Dict[str, Scheduler] = {
+            name: create_fabric_scheduler(db, http, config)
+            for name, config in fabric_configs.items()
+        }
+
+        # Processing loop, that keeps running whatever fails in a single iteration
+        while True:
+            try:
+                with loop_seconds.time():
+                    metrics = await asyncio.to_thread(
+                        update_schedule, db, metrics_cache, schedulers, cluster
+                    )
+
+                    # Start processing due metrics, without waiting for them
+                    for scheduler in schedulers.values():
+                        scheduler.run_pending()
+
+                    # Only one replica deletes data of all obsolete metrics
+                    if cluster.is_leader() and sweep.is_due(metrics_cache.version):
+                        await asyncio.to_thread(delete_obsolete_metrics, db, metrics)
+            except Exception as e:
+                logger.error(f"error in processing loop: {e}")
+                await asyncio.sleep(LOOP_ERROR_DELAY)
+
+            # Wait for the next run, or configuration change
+            await asyncio.to_thread(
+                metrics_cache.wait, get_sleep_time(*schedulers.values())
+            )
@@ -0,0 +1,98 @@
+import time
+from threading import Lock
+from typing import Dict, List, Set, Tuple
+
+# Fingerprint of the pushed series, and time when it was pushed
+Fingerprint = Tuple[int, float]
+
+
+def fingerprint(samples: List[tuple]) -> int:
+    """
+    Get compact fingerprint of series values.
+
+    :param samples: samples with label values and value
+    :return: hash, that is the same for the same series and values
+    """
+    return hash(tuple(samples))
+
+
+class Fingerprints:
+    """
+    Fingerprints of the groups last pushed for every metric,
+    to skip pushing groups whose series haven't changed since.
+
+    The Push Gateway replaces the whole group with every push,
+    so a group is only skipped when none of its series has changed.
+    Groups are pushed anyway when they are older than the max staleness,
+    so the Push Gateway is refreshed after restart, and the push time is recent.
+    """
+
+    def __init__(self, max_staleness: float):
+        self.max_staleness = max_staleness
+        self._metrics: Dict[str, Dict[str, Fingerprint]] = {}
+        self._lock = Lock()
+
+    def get(self, name: str) -> Dict[str, Fingerprint]:
+        """
+        Get fingerprints of groups pushed in the previous cycle.
+
+        :param name: metric name
+        :return: fingerprints by group ID
+        """
+        with self._lock:
+            return self._metrics.get(name, {})
+
+    def is_fresh(self, previous: Fingerprint, value: int) -> bool:
+        """
+        Check if the group hasn't changed, and it's not stale yet.
+
+        :param previous: fingerprint of the last push
+        :param value: fingerprint of current series
+        :return: True when the push may be skipped
+        """
+        hash_value, pushed_at = previous
+        return hash_value == value and time.time() - pushed_at < self.max_staleness
+
+    def set(self, name: str, fingerprints: Dict[str, Fingerprint]) -> None:
+        """
+        Replace fingerprints of the metric after the cycle.
+
+        :param name: metric name
+        :param fingerprints: fingerprints of all groups used in the cycle
+        """
+        with self._lock:
+            self._metrics[name] = fingerprints
+
+    def forget(self, name: str) -> None:
+        """
+        Forget fingerprints of the metric, so all its groups are pushed next time.
+        Must be called when groups of the metric are deleted.
+
+        :param name: metric name
+        """
+        with self._lock:
+            self._metrics.pop(name, None)
+
+    def discard(self, name: str, group_id: str) -> None:
+        """
+        Forget fingerprint of the group, so it's pushed next time.
+
+        :param name: metric name
+        :param group_id: group ID
+        """
+        with self._lock:
+            self._metrics.get(name, {}).pop(group_id, None)
+
+    def retain(self, names: Set[str]) -> None:
+        """
+        Forget fingerprints of metrics, that are no longer processed here.
+
+        :param names: names of metrics processed by this replica
+        """
+        with self._lock:
+            for name in set(self._metrics) - names:
+                del self._metrics[name]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._metrics.clear()
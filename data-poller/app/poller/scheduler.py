@@ -0,0 +1,210 @@
+import heapq
+import logging
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from typing import Callable, Dict, Hashable, List, Optional, Set, Tuple
+
+from ..instrumentation import scheduler_lag_seconds
+
+logger = logging.getLogger("gunicorn.error")
+
+
+def now_ms() -> float:
+    return time.time() * 1000
+
+
+class Scheduler:
+    """
+    Deadline-based scheduler for processing metrics.
+
+    Metrics are kept in a priority queue keyed by the time when they are due,
+    and executed on a bounded pool of reusable worker threads. Each metric is
+    scheduled again only after its run finishes, so a run never overlaps
+    with the next one of the same metric. When the run took longer than
+    the interval, the overlap policy decides what happens:
+
+    * "skip" - missed slots are dropped, the next run waits for the next slot
+    * "queue" - the next run starts immediately after the previous one
+
+    Due metrics with the same group key are passed to a single run,
+    so they may share the work (e.g. the APIC query). Metrics of the group
+    that would be due soon (within 10% of their interval) join it earlier,
+    so such metrics stay aligned.
+    """
+
+    def __init__(
+        self,
+        func: Callable[[List[dict]], None],
+        workers: int,
+        overlap_policy: str = "skip",
+        group_key: Callable[[dict], Hashable] = lambda metric: metric["name"],
+    ):
+        if overlap_policy not in ("skip", "queue"):
+            raise ValueError("overlap policy should be either 'skip' or 'queue'")
+        self.func = func
+        self.group_key = group_key
+        self.overlap_policy = overlap_policy
+        self.lag: Dict[str, float] = {}
+        self._lock = Lock()
+        self._queue: List[Tuple[float, int, str]] = []
+        self._counter = 0
+        self._metrics: Dict[str, dict] = {}
+        self._due: Dict[str, float] = {}
+        self._pool = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="poller"
+        )
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._metrics
+
+    def names(self) -> Set[str]:
+        """
+        Get names of the scheduled metrics.
+
+        :return: metric names
+        """
+        with self._lock:
+            return set(self._metrics)
+
+    def _push(self, name: str, due_ms: float) -> None:
+        self._counter += 1
+        self._due[name] = due_ms
+        heapq.heappush(self._queue, (due_ms, self._counter, name))
+
+    def update(self, metrics: List[dict], processed_at: Dict[str, int]) -> None:
+        """
+        Synchronize scheduled metrics with the configuration.
+
+        :param metrics: current list of metrics
+        :param processed_at: last processing time of metrics that are not known yet
+        """
+        with self._lock:
+            current = {metric["name"]: metric for metric in metrics}
+
+            # Forget deleted metrics, their entries in the queue are ignored later
+            for name in set(self._metrics) - set(current):
+                del self._metrics[name]
+                self._due.pop(name, None)
+                self.lag.pop(name, None)
+
+            for name, metric in current.items():
+                previous = self._metrics.get(name)
+                self._metrics[name] = metric
+                if previous is None:
+                    # Metrics never processed, or not for a long time, are due now,
+                    # so their first run doesn't count as an overlapping one
+                    due_ms = processed_at.get(name, 0) + metric["interval"]
+                    self._push(name, max(due_ms, now_ms()))
+                elif previous["interval"] != metric["interval"] and name in self._due:
+                    due_ms = self._due[name]
+                    self._push(name, due_ms - previous["interval"] + metric["interval"])
+
+    def next_due(self) -> Optional[float]:
+        """
+        Get time when the closest run is due.
+
+        :return: time in milliseconds, or None when nothing is scheduled
+        """
+        with self._lock:
+            while self._queue and self._due.get(self._queue[0][2]) != self._queue[0][0]:
+                heapq.heappop(self._queue)
+            return self._queue[0][0] if self._queue else None
+
+    def run_pending(self) -> int:
+        """
+        Submit all due metrics to the worker pool, without waiting for them.
+
+        :return: number of submitted runs
+        """
+        groups: Dict[Hashable, List[Tuple[dict, float]]] = {}
+        with self._lock:
+            current_ms = now_ms()
+            while self._queue and self._queue[0][0] <= current_ms:
+                due_ms, _, name = heapq.heappop(self._queue)
+                if self._due.get(name) != due_ms:
+                    continue
+                del self._due[name]
+                metric = self._metrics[name]
+                groups.setdefault(self.group_key(metric), []).append((metric, due_ms))
+
+            # Include metrics of the same groups that are due soon
+            if groups:
+                for name, due_ms in list(self._due.items()):
+                    metric = self._metrics[name]
+                    if due_ms > current_ms + metric["interval"] * 0.1:
+                        continue
+                    group = groups.get(self.group_key(metric))
+                    if group is not None:
+                        del self._due[name]
+                        group.append((metric, current_ms))
+
+            for group in groups.values():
+                self._submit(group)
+        return len(groups)
+
+    def next_slot(self, due_ms: float, interval: int, finished_ms: float) -> float:
+        """
+        Calculate when the metric should run again.
+
+        :param due_ms: time when the finished run was due
+        :param interval: metric interval in milliseconds
+        :param finished_ms: time when the run finished
+        :return: time in milliseconds
+        """
+        next_ms = due_ms + interval
+        if next_ms >= finished_ms:
+            return next_ms
+        if self.overlap_policy == "queue":
+            return finished_ms
+        return next_ms + math.ceil((finished_ms - next_ms) / interval) * interval
+
+    def _submit(self, group: List[Tuple[dict, float]]) -> None:
+        self._pool.submit(self._run, group)
+
+    def _started(self, group: List[Tuple[dict, float]]) -> str:
+        names = ", ".join(metric["name"] for metric, _ in group)
+        started_ms = now_ms()
+        for metric, due_ms in group:
+            name = metric["name"]
+            # First run is due when the metric was loaded, so it has no real lag
+            if name in self.lag:
+                lag_ms = max(0, started_ms - due_ms)
+                scheduler_lag_seconds.labels(name).observe(lag_ms / 1000)
+            self.lag[name] = started_ms - due_ms
+        logger.debug(f"processing metrics: {names}")
+        return names
+
+    def _finished(self, group: List[Tuple[dict, float]]) -> None:
+        with self._lock:
+            finished_ms = now_ms()
+            for metric, due_ms in group:
+                self._reschedule(metric["name"], due_ms, finished_ms)
+
+    def _run(self, group: List[Tuple[dict, float]]) -> None:
+        names = self._started(group)
+        try:
+            self.func([metric for metric, _ in group])
+        except Exception as e:
+            logger.error(f"error processing metrics {names}: {e}")
+        finally:
+            self._finished(group)
+
+    def _reschedule(self, name: str, due_ms: float, finished_ms: float) -> None:
+        metric = self._metrics.get(name)
+        if metric is None or name in self._due:
+            return
+        interval = metric["interval"]
+        next_ms = self.next_slot(due_ms, interval, finished_ms)
+        if next_ms > due_ms + interval:
+            logger.warning(f"processing {name} took longer than interval")
+        self._push(name, next_ms)
+
+    def shutdown(self, wait: bool = True) -> None:
+        """
+        Stop the worker pool.
+
+        :param wait: wait for running jobs to finish
+        """
+        self._pool.shutdown(wait=wait)
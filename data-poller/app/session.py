@@ -0,0 +1,241 @@
+import logging
+import time
+from threading import Lock, local
+from typing import List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+import urllib3
+
+logger = logging.getLogger("gunicorn.error")
+
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+
+class ApicMember:
+    """
+    Single APIC cluster member, with its health information.
+    """
+
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+        self.latency = 0.0
+        self.down_until = 0.0
+
+    def record_latency(self, latency: float) -> None:
+        self.latency = (
+            latency if self.latency == 0 else 0.8 * self.latency + 0.2 * latency
+        )
+
+
+class BaseApicSession:
+    """
+    State shared by APIC sessions: cluster members and the token.
+
+    Requests should be spread across the fast cluster members,
+    and members that are slow or down are used only when there is nothing better.
+    """
+
+    def __init__(
+        self,
+        urls: List[str],
+        username: str,
+        password: str,
+        verify_ssl: bool = False,
+        down_time: float = 30,
+    ):
+        if not urls:
+            raise ValueError("at least one APIC URL is required")
+        self.members = [ApicMember(url) for url in urls]
+        self.username = username
+        self.password = password
+        self.verify_ssl = verify_ssl
+        self.down_time = down_time
+        self.token: Optional[str] = None
+        self.expires_at = 0.0
+        self._refresh_timeout = 600.0
+        self._lock = Lock()
+        self._counter = 0
+
+    @property
+    def api(self) -> str:
+        """
+        URL of the preferred cluster member.
+        """
+        return self._candidates()[0].url
+
+    @property
+    def login_payload(self) -> dict:
+        return {
+            "aaaUser": {"attributes": {"name": self.username, "pwd": self.password}}
+        }
+
+    @property
+    def cookies(self) -> Optional[dict]:
+        return {"APIC-cookie": self.token} if self.token else None
+
+    def _candidates(self) -> List[ApicMember]:
+        now = time.time()
+        up = [x for x in self.members if x.down_until <= now]
+        down = sorted(
+            [x for x in self.members if x.down_until > now], key=lambda x: x.down_until
+        )
+        if not up:
+            return down
+        best = min(x.latency for x in up)
+        fast = [x for x in up if x.latency <= 2 * best + 0.05]
+        slow = sorted([x for x in up if x not in fast], key=lambda x: x.latency)
+        with self._lock:
+            self._counter += 1
+            offset = self._counter % len(fast)
+        return fast[offset:] + fast[:offset] + slow + down
+
+    def _mark_up(self, member: ApicMember, latency: float) -> None:
+        member.record_latency(latency)
+        member.down_until = 0
+
+    def _mark_down(self, member: ApicMember) -> None:
+        logger.warning(f"APIC {member.url} is not available, trying other member")
+        member.down_until = time.time() + self.down_time
+
+    def _update_token(self, data: dict) -> None:
+        attributes = data["imdata"][0]["aaaLogin"]["attributes"]
+        with self._lock:
+            self.token = attributes["token"]
+            self._refresh_timeout = float(
+                attributes.get("refreshTimeoutSeconds") or 600
+            )
+            self.expires_at = time.time() + self._refresh_timeout
+
+    def _claim_refresh(self) -> bool:
+        # Refresh when less than a third of the token lifetime is left,
+        # and avoid other requests refreshing at the same time
+        if time.time() <= self.expires_at - self._refresh_timeout / 3:
+            return False
+        with self._lock:
+            if time.time() <= self.expires_at - self._refresh_timeout / 3:
+                return False
+            self.expires_at += self._refresh_timeout / 3
+            return True
+
+
+class ApicSession(BaseApicSession):
+    """
+    Session to the APIC cluster, shared by the worker threads.
+
+    * Token is refreshed before it expires, and obtained again when it's rejected,
+      by a single thread at a time
+    * Every thread has its own HTTP session (and connection pool), as sessions
+      are not safe to share between threads
+    * Requests are spread across the fast cluster members, and members that are
+      slow or down are used only when there is nothing better
+    """
+
+    def __init__(
+        self,
+        urls: List[str],
+        username: str,
+        password: str,
+        verify_ssl: bool = False,
+        down_time: float = 30,
+    ):
+        super().__init__(urls, username, password, verify_ssl, down_time)
+        self._local = local()
+        self._token_lock = Lock()
+
+    @property
+    def http(self) -> requests.Session:
+        """
+        Session of the current thread, created when it's used for the first time.
+        """
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=len(self.members))
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+        return session
+
+    def _send(
+        self, method: str, url: str, timeout: float, stream: bool = False, **kwargs
+    ) -> requests.Response:
+        errors = []
+        for member in self._candidates():
+            started = time.time()
+            try:
+                response = self.http.request(
+                    method,
+                    member.url + url,
+                    timeout=timeout,
+                    verify=self.verify_ssl,
+                    stream=stream,
+                    cookies=self.cookies,
+                    **kwargs,
+                )
+            except requests.RequestException as e:
+                errors.append(f"{member.url}: {e}")
+            else:
+                if response.status_code < 500:
+                    self._mark_up(member, time.time() - started)
+                    return response
+                errors.append(f"{member.url}: HTTP {response.status_code}")
+                response.close()
+            self._mark_down(member)
+        raise ConnectionError(f"no APIC member is available: {'; '.join(errors)}")
+
+    def login(self, timeout: float = 2) -> None:
+        """
+        Log in to the APIC cluster.
+
+        :param timeout: request timeout in seconds
+        """
+        self.token = None
+        response = self._send(
+            "POST", "/api/aaaLogin.json", timeout, json=self.login_payload
+        )
+        if response.status_code != 200:
+            raise Exception(f"APIC authentication failed: {response.text}")
+        self._update_token(response.json())
+
+    def refresh(self, timeout: float = 2) -> None:
+        """
+        Refresh the token, or log in again when it's not possible.
+
+        :param timeout: request timeout in seconds
+        """
+        try:
+            response = self._send("GET", "/api/aaaRefresh.json", timeout)
+            if response.status_code != 200:
+                raise Exception(response.text)
+            self._update_token(response.json())
+        except Exception as e:
+            logger.info(f"refreshing APIC token failed, logging in again: {e}")
+            self.login(timeout)
+
+    def _ensure_token(self) -> None:
+        with self._token_lock:
+            if self.token is None:
+                self.login()
+            elif self._claim_refresh():
+                self.refresh()
+
+    def get(self, url: str, timeout: float = 5, stream: bool = False):
+        """
+        Perform GET request to the APIC.
+
+        :param url: URL path, starting with /api
+        :param timeout: request timeout in seconds
+        :param stream: don't load the response body immediately
+        :return: response
+        """
+        self._ensure_token()
+        token = self.token
+        response = self._send("GET", url, timeout, stream)
+        if response.status_code == 403:
+            response.close()
+            with self._token_lock:
+                # Other threads rejected at the same time use the new token
+                if self.token == token:
+                    self.login()
+            response = self._send("GET", url, timeout, stream)
+        return response
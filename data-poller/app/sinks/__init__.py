@@ -0,0 +1,357 @@
+import asyncio
+import logging
+import queue
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import Future
+from itertools import groupby
+from threading import Lock, Thread, local
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+import aiohttp
+import requests
+
+from ..instrumentation import sink_errors, sink_queue_items, sink_write_seconds
+
+logger = logging.getLogger("gunicorn.error")
+
+
+class Chunk(NamedTuple):
+    """
+    Series of a single group, as they were polled in one cycle.
+    """
+
+    # Metric name, including the fabric
+    name: str
+    # Sanitized Prometheus metric name
+    metric_name: str
+    group_id: str
+    # Label names, the fabric is the last one
+    label_names: Tuple[str, ...]
+    # Samples with label values (except the fabric) and value
+    samples: List[tuple]
+    fabric: str
+    # Time when the APIC query of the cycle started, in milliseconds
+    timestamp_ms: int
+
+    def series(self) -> Iterator[Tuple[Dict[str, str], float]]:
+        """
+        Iterate series of the chunk.
+
+        :return: labels and value of every series
+        """
+        for sample in self.samples:
+            values = (*sample[:-1], self.fabric)
+            yield dict(zip(self.label_names, values)), sample[-1]
+
+
+class Sink(ABC):
+    """
+    Destination of the polled series.
+
+    Sinks are called concurrently by the writer threads, every thread
+    with batches of its own shard of groups.
+    """
+
+    name = "sink"
+
+    # The sink keeps the last chunk of every group until it's replaced or deleted,
+    # so unchanged groups may be skipped, and queued chunks superseded
+    keeps_groups = False
+
+    # The sink stores samples with their timestamps, so past intervals may be filled
+    keeps_timestamps = False
+
+    @abstractmethod
+    def write(self, chunks: List[Chunk]) -> None:
+        """
+        Write chunks, raising when any of them failed.
+
+        :param chunks: chunks in the order they were produced
+        """
+
+    async def write_async(
+        self, chunks: List[Chunk], http: aiohttp.ClientSession
+    ) -> None:
+        """
+        Write chunks from the event loop, raising when any of them failed.
+        Sinks without asynchronous client write in a thread.
+
+        :param chunks: chunks in the order they were produced
+        :param http: asynchronous HTTP client
+        """
+        await asyncio.to_thread(self.write, chunks)
+
+    def delete(self, group_ids: List[str]) -> None:
+        """
+        Delete series of the groups, that are no longer used.
+
+        :param group_ids: group IDs
+        """
+
+    def close(self) -> None:
+        """
+        Release resources of the sink, after all chunks were written.
+        """
+
+
+class HttpRequest(NamedTuple):
+    method: str
+    url: str
+    headers: Dict[str, str]
+    data: bytes
+
+
+class HttpSink(Sink):
+    """
+    Sink sending chunks over HTTP, either from the writer threads,
+    or from the event loop. Every writer thread has its own session
+    (and connection pool), as sessions are not safe to share between threads.
+    """
+
+    def __init__(self, url: str, timeout: float = 30):
+        self.url = url
+        self.timeout = timeout
+        self._local = local()
+        self._sessions: List[requests.Session] = []
+        self._sessions_lock = Lock()
+
+    @property
+    def http(self) -> requests.Session:
+        """
+        Session of the current thread, created when it's used for the first time.
+        """
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+            with self._sessions_lock:
+                self._sessions.append(session)
+        return session
+
+    def send(self, request: HttpRequest) -> None:
+        """
+        Send the request with the session of the current thread.
+
+        :param request: request
+        :raises IOError: when the request failed
+        """
+        response = self.http.request(
+            request.method,
+            request.url,
+            data=request.data,
+            headers=request.headers,
+            timeout=self.timeout,
+        )
+        if response.status_code >= 400:
+            raise IOError(
+                f"error sending to {self.name}: {response.status_code} {response.text}"
+            )
+
+    async def send_async(
+        self, request: HttpRequest, http: aiohttp.ClientSession
+    ) -> None:
+        """
+        Send the request with the asynchronous client.
+
+        :param request: request
+        :param http: asynchronous HTTP client
+        :raises IOError: when the request failed
+        """
+        async with http.request(
+            request.method,
+            request.url,
+            data=request.data,
+            headers=request.headers,
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+        ) as response:
+            if response.status >= 400:
+                raise IOError(
+                    f"error sending to {self.name}: "
+                    f"{response.status} {await response.text()}"
+                )
+
+    def close(self) -> None:
+        with self._sessions_lock:
+            sessions, self._sessions = self._sessions, []
+        for session in sessions:
+            session.close()
+
+
+# Operation queued in the writer: "write" with a chunk, or "delete" with a group ID
+Operation = Tuple[str, Union[Chunk, str], Future]
+
+
+class SinkWriter:
+    """
+    Writes chunks to the sink in background threads, so polling doesn't wait
+    for the sink, unless it falls behind and the queues are full.
+
+    Operations are sharded by the group ID, so writes and deletes of the same
+    group keep their order. Every worker takes all operations waiting in its
+    queue (up to the batch size), and passes them to the sink at once.
+    Operations return futures, that are resolved when they are done.
+
+    With the queue size 0, operations are done in the calling thread.
+    """
+
+    def __init__(
+        self, sink: Sink, queue_size: int = 1000, workers: int = 4, batch_size: int = 10
+    ):
+        self.sink = sink
+        self.batch_size = max(batch_size, 1)
+        self.workers = max(workers, 1) if queue_size else 0
+        self._queues: List["queue.Queue[Optional[Operation]]"] = [
+            queue.Queue(max(queue_size // self.workers, 1)) for _ in range(self.workers)
+        ]
+        self._threads: List[Thread] = []
+        self._lock = Lock()
+        self._closed = False
+        sink_queue_items.set_function(lambda: sum(x.qsize() for x in self._queues))
+
+    def write(self, chunk: Chunk, block: bool = True) -> Future:
+        """
+        Queue the chunk to be written.
+
+        :param chunk: chunk
+        :param block: wait for space in the queue, otherwise raise queue.Full
+        :return: future resolved when the chunk is written
+        """
+        return self._submit(("write", chunk, Future()), chunk.group_id, block)
+
+    async def write_async(
+        self, chunks: List[Chunk], http: aiohttp.ClientSession
+    ) -> None:
+        """
+        Write chunks directly from the event loop, bypassing the queues.
+        Should be used only when all chunks of their groups are written this way.
+
+        :param chunks: chunks
+        :param http: asynchronous HTTP client
+        """
+        started_at = time.perf_counter()
+        try:
+            await self.sink.write_async(chunks, http)
+        except Exception:
+            sink_errors.labels(self.sink.name).inc()
+            raise
+        sink_write_seconds.labels(self.sink.name).observe(
+            time.perf_counter() - started_at
+        )
+
+    def delete(self, group_id: str, block: bool = True) -> Future:
+        """
+        Queue deletion of the group, after it's written.
+
+        :param group_id: group ID
+        :param block: wait for space in the queue, otherwise raise queue.Full
+        :return: future resolved when the group is deleted
+        """
+        return self._submit(("delete", group_id, Future()), group_id, block)
+
+    def _submit(self, operation: Operation, group_id: str, block: bool) -> Future:
+        if not self.workers:
+            self._process([operation])
+            return operation[2]
+        self._start()
+        self._queues[hash(group_id) % self.workers].put(operation, block)
+        return operation[2]
+
+    def _start(self) -> None:
+        if self._threads:
+            return
+        with self._lock:
+            if not self._threads and not self._closed:
+                self._threads = [
+                    Thread(target=self._work, args=(x,), daemon=True)
+                    for x in self._queues
+                ]
+                for thread in self._threads:
+                    thread.start()
+
+    def _work(self, operations: "queue.Queue[Optional[Operation]]") -> None:
+        while True:
+            operation = operations.get()
+            if operation is None:
+                return
+            batch = [operation]
+            while len(batch) < self.batch_size:
+                try:
+                    operation = operations.get_nowait()
+                except queue.Empty:
+                    break
+                if operation is None:
+                    self._process(batch)
+                    return
+                batch.append(operation)
+            self._process(batch)
+
+    def _process(self, batch: List[Operation]) -> None:
+        # Only the last operation of every group matters, when the sink keeps groups
+        if self.sink.keeps_groups and len(batch) > 1:
+            latest: Dict[str, Operation] = {}
+            for operation in batch:
+                kind, item, future = operation
+                group_id = item.group_id if isinstance(item, Chunk) else item
+                superseded = latest.pop(group_id, None)
+                if superseded is not None:
+                    superseded[2].set_result(None)
+                latest[group_id] = operation
+            batch = list(latest.values())
+
+        for kind, operations in groupby(batch, key=lambda x: x[0]):
+            group = list(operations)
+            started_at = time.perf_counter()
+            try:
+                if kind == "write":
+                    self.sink.write([item for _, item, _ in group])  # type: ignore
+                else:
+                    self.sink.delete([item for _, item, _ in group])  # type: ignore
+            except Exception as e:
+                sink_errors.labels(self.sink.name).inc()
+                for _, _, future in group:
+                    future.set_exception(e)
+                continue
+            sink_write_seconds.labels(self.sink.name).observe(
+                time.perf_counter() - started_at
+            )
+            for _, _, future in group:
+                future.set_result(None)
+
+    def close(self, timeout: float = 10) -> None:
+        """
+        Write queued operations, and close the sink.
+
+        :param timeout: maximum time to wait for every worker (in seconds)
+        """
+        with self._lock:
+            self._closed = True
+            threads, self._threads = self._threads, []
+        for operations in self._queues[: len(threads)]:
+            operations.put(None)
+        for thread in threads:
+            thread.join(timeout)
+        self.sink.close()
+
+
+def create_sink(kind: str) -> Sink:
+    """
+    Create sink configured by environment variables.
+
+    :param kind: "pushgateway", "remote_write" or "file"
+    :return: sink
+    """
+    if kind == "remote_write":
+        from .remote_write import RemoteWriteSink
+        from ..config import PROMETHEUS_REMOTE_WRITE_URL
+
+        return RemoteWriteSink(PROMETHEUS_REMOTE_WRITE_URL)
+    if kind == "file":
+        from .file import FileSink
+        from ..config import POLLER_SINK_FILE, POLLER_SINK_FILE_FORMAT
+
+        return FileSink(POLLER_SINK_FILE, POLLER_SINK_FILE_FORMAT)
+
+    from .pushgateway import PushGatewaySink
+    from ..config import PROMETHEUS_PUSHGATEWAY_URL
+
+    return PushGatewaySink(PROMETHEUS_PUSHGATEWAY_URL)
@@ -0,0 +1,87 @@
+import json
+from threading import Lock
+from typing import IO, List, Optional
+
+from . import Chunk, Sink
+from ..store import render_samples
+
+# Formats of the file: one JSON object per line, or OpenMetrics-like text
+FILE_FORMATS = ("ndjson", "openmetrics")
+
+
+def format_ndjson(chunk: Chunk) -> str:
+    """
+    Format series of the chunk as JSON objects, one per line.
+
+    :param chunk: chunk
+    :return: lines
+    """
+    return "".join(
+        json.dumps(
+            {
+                "name": chunk.metric_name,
+                "labels": labels,
+                "value": value,
+                "timestamp": chunk.timestamp_ms,
+            }
+        )
+        + "\n"
+        for labels, value in chunk.series()
+    )
+
+
+def format_openmetrics(chunk: Chunk) -> str:
+    """
+    Format series of the chunk as OpenMetrics sample lines, with timestamps
+    in seconds.
+
+    :param chunk: chunk
+    :return: lines
+    """
+    return render_samples(
+        chunk.metric_name,
+        chunk.label_names,
+        chunk.samples,
+        (chunk.fabric,),
+        chunk.timestamp_ms / 1000,
+    ).decode("utf-8")
+
+
+class FileSink(Sink):
+    """
+    Appends series to a local file, for offline analysis.
+
+    Every write appends all series of the chunk with the time of the query,
+    so the file contains the full history. Deleted groups are not recorded.
+
+    The "openmetrics" format is OpenMetrics-like text: sample lines only,
+    without "# TYPE" metadata and "# EOF", and with metric families interleaved,
+    as the file is appended to over time and across restarts. It has to be
+    grouped by metric family and terminated before it's imported as OpenMetrics.
+    """
+
+    name = "file"
+    keeps_timestamps = True
+
+    def __init__(self, path: str, file_format: str = "ndjson"):
+        if file_format not in FILE_FORMATS:
+            raise ValueError(f"unknown file format: {file_format}")
+        self.path = path
+        self.format = format_ndjson if file_format == "ndjson" else format_openmetrics
+        self._file: Optional[IO[str]] = None
+        self._lock = Lock()
+
+    def write(self, chunks: List[Chunk]) -> None:
+        # Format outside of the lock, as writers of all shards share the file
+        data = "".join(self.format(chunk) for chunk in chunks)
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, "a", encoding="utf-8")
+            self._file.write(data)
+            self._file.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
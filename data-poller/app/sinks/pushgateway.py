@@ -0,0 +1,116 @@
+from functools import partial
+from typing import Callable, List, Sequence, Tuple
+
+import aiohttp
+from prometheus_client import (
+    CollectorRegistry,
+    Gauge,
+    delete_from_gateway,
+    push_to_gateway,
+)
+
+from . import Chunk, HttpRequest, HttpSink, logger
+from ..instrumentation import push_seconds
+
+JOB = "aci_monitoring"
+
+
+def build_registry(chunk: Chunk) -> CollectorRegistry:
+    registry = CollectorRegistry()
+    gauge = Gauge(
+        chunk.metric_name, "", labelnames=chunk.label_names, registry=registry
+    )
+    for sample in chunk.samples:
+        gauge.labels(*sample[:-1], chunk.fabric).set(sample[-1])
+    return registry
+
+
+class PushGatewaySink(HttpSink):
+    """
+    Pushes every chunk as a separate group of the Prometheus Push Gateway.
+
+    The Push Gateway keeps the last push of every group, so chunks superseded
+    while they were queued are not pushed, and the requests of a batch
+    reuse a single connection. Timestamps are not pushed, as the Push Gateway
+    rejects them.
+    """
+
+    name = "pushgateway"
+    keeps_groups = True
+
+    def handler(
+        self,
+        url: str,
+        method: str,
+        timeout: float,
+        headers: Sequence[Tuple[str, str]],
+        data: bytes,
+    ) -> Callable[[], None]:
+        return partial(self.send, HttpRequest(method, url, dict(headers), data))
+
+    def build_requests(self, chunk: Chunk) -> List[HttpRequest]:
+        """
+        Build the push request of the chunk, without sending it.
+
+        :param chunk: chunk
+        :return: requests to send
+        """
+        requests: List[HttpRequest] = []
+
+        def capture(
+            url: str,
+            method: str,
+            timeout: float,
+            headers: Sequence[Tuple[str, str]],
+            data: bytes,
+        ) -> Callable[[], None]:
+            request = HttpRequest(method, url, dict(headers), data)
+            return partial(requests.append, request)
+
+        push_to_gateway(
+            self.url,
+            job=JOB,
+            grouping_key={"id": chunk.group_id},
+            registry=build_registry(chunk),
+            timeout=self.timeout,
+            handler=capture,
+        )
+        return requests
+
+    def write(self, chunks: List[Chunk]) -> None:
+        for chunk in chunks:
+            logger.debug(
+                f"sending {len(chunk.samples)} series of {chunk.name} metric "
+                "to PushGateway"
+            )
+            with push_seconds.labels(chunk.name).time():
+                push_to_gateway(
+                    self.url,
+                    job=JOB,
+                    grouping_key={"id": chunk.group_id},
+                    registry=build_registry(chunk),
+                    timeout=self.timeout,
+                    handler=self.handler,
+                )
+
+    async def write_async(
+        self, chunks: List[Chunk], http: aiohttp.ClientSession
+    ) -> None:
+        for chunk in chunks:
+            logger.debug(
+                f"sending {len(chunk.samples)} series of {chunk.name} metric "
+                "to PushGateway"
+            )
+            with push_seconds.labels(chunk.name).time():
+                for request in self.build_requests(chunk):
+                    await self.send_async(request, http)
+
+    def delete(self, group_ids: List[str]) -> None:
+        for group_id in group_ids:
+            delete_from_gateway(
+                self.url,
+                job=JOB,
+                grouping_key={"id": group_id},
+                timeout=self.timeout,
+                handler=self.handler,
+            )
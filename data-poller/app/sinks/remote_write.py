@@ -0,0 +1,121 @@
+import struct
+from typing import Dict, List, Tuple
+
+import aiohttp
+import snappy  # type: ignore
+
+from . import Chunk, HttpRequest, HttpSink
+
+# Version of the remote-write protocol
+REMOTE_WRITE_VERSION = "0.1.0"
+
+
+def encode_varint(value: int) -> bytes:
+    """
+    Encode non-negative integer as a protobuf varint.
+
+    :param value: integer
+    :return: encoded bytes
+    """
+    result = bytearray()
+    while value > 0x7F:
+        result.append((value & 0x7F) | 0x80)
+        value >>= 7
+    result.append(value)
+    return bytes(result)
+
+
+def encode_field(tag: int, data: bytes) -> bytes:
+    """
+    Encode length-delimited protobuf field.
+
+    :param tag: field tag, with the wire type
+    :param data: encoded value
+    :return: encoded bytes
+    """
+    return bytes((tag,)) + encode_varint(len(data)) + data
+
+
+def encode_label(name: str, value: str) -> bytes:
+    # Label: name = 1, value = 2
+    return encode_field(0x0A, name.encode("utf-8")) + encode_field(
+        0x12, value.encode("utf-8")
+    )
+
+
+def encode_sample(value: float, timestamp_ms: int) -> bytes:
+    # Sample: double value = 1, int64 timestamp = 2
+    return b"\x09" + struct.pack("<d", value) + b"\x10" + encode_varint(timestamp_ms)
+
+
+def encode_chunks(chunks: List[Chunk]) -> bytes:
+    """
+    Encode chunks as a remote-write WriteRequest message,
+    with one sample of every series, timestamped with the time of the query.
+
+    :param chunks: chunks
+    :return: encoded message
+    """
+    # Most labels repeat between series (metric name, attribute, fabric),
+    # so every label is encoded once per request
+    cache: Dict[Tuple[str, str], bytes] = {}
+    timeseries = []
+    for chunk in chunks:
+        # Labels must be sorted by name, the metric name is the "__name__" label
+        names = ("__name__",) + chunk.label_names
+        order = sorted(range(len(names)), key=lambda x: names[x])
+        for sample in chunk.samples:
+            values = (chunk.metric_name, *sample[:-1], chunk.fabric)
+            labels = bytearray()
+            for index in order:
+                key = (names[index], values[index])
+                encoded = cache.get(key)
+                if encoded is None:
+                    encoded = cache[key] = encode_field(0x0A, encode_label(*key))
+                labels += encoded
+            samples = encode_field(
+                0x12, encode_sample(float(sample[-1]), chunk.timestamp_ms)
+            )
+            # WriteRequest: repeated TimeSeries timeseries = 1
+            timeseries.append(encode_field(0x0A, bytes(labels) + samples))
+    return b"".join(timeseries)
+
+
+class RemoteWriteSink(HttpSink):
+    """
+    Sends chunks to the Prometheus remote-write endpoint,
+    as snappy-compressed protobuf, with one request per batch.
+
+    Samples are timestamped with the time when the APIC query started,
+    so series of the same cycle are aligned regardless of the queueing delay.
+    Remote-write has no deletion, series of removed groups just end.
+    """
+
+    name = "remote_write"
+    keeps_timestamps = True
+
+    def build_request(self, chunks: List[Chunk]) -> HttpRequest:
+        """
+        Build the remote-write request of the chunks.
+
+        :param chunks: chunks
+        :return: request to send
+        """
+        return HttpRequest(
+            "POST",
+            self.url,
+            {
+                "Content-Encoding": "snappy",
+                "Content-Type": "application/x-protobuf",
+                "X-Prometheus-Remote-Write-Version": REMOTE_WRITE_VERSION,
+            },
+            snappy.compress(encode_chunks(chunks)),
+        )
+
+    def write(self, chunks: List[Chunk]) -> None:
+        self.send(self.build_request(chunks))
+
+    async def write_async(
+        self, chunks: List[Chunk], http: aiohttp.ClientSession
+    ) -> None:
+        await self.send_async(self.build_request(chunks), http)
@@ -0,0 +1,111 @@
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+
+from prometheus_client.utils import floatToGoString
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+def render_samples(
+    metric_name: str,
+    labelnames: Tuple[str, ...],
+    samples: List[tuple],
+    const_values: Tuple[str, ...] = (),
+    timestamp: Optional[float] = None,
+) -> bytes:
+    """
+    Render series in the Prometheus text exposition format.
+
+    :param metric_name: sanitized Prometheus metric name
+    :param labelnames: names of the labels, in the same order as in samples,
+        followed by names of the constant labels
+    :param samples: list of (*label values, value) tuples
+    :param const_values: values of labels, that are the same for all samples
+    :param timestamp: timestamp of all samples, appended as it is
+    :return: rendered lines, without the metric header
+    """
+    const_names = labelnames[len(labelnames) - len(const_values) :]
+    const_labels = "".join(
+        f',{label}="{_escape_label_value(value)}"'
+        for label, value in zip(const_names, const_values)
+    )
+    suffix = "\n" if timestamp is None else f" {timestamp}\n"
+    lines = []
+    for sample in samples:
+        labels = ",".join(
+            f'{label}="{_escape_label_value(value)}"'
+            for label, value in zip(labelnames, sample[:-1])
+        )
+        lines.append(
+            f"{metric_name}{{{labels}{const_labels}}} {floatToGoString(sample[-1])}"
+            + suffix
+        )
+    return "".join(lines).encode("utf-8")
+
+
+def render_header(metric_name: str) -> bytes:
+    """
+    Render HELP and TYPE lines of a gauge.
+
+    :param metric_name: sanitized Prometheus metric name
+    :return: rendered lines
+    """
+    return f"# HELP {metric_name} \n# TYPE {metric_name} gauge\n".encode("utf-8")
+
+
+class MetricsStore:
+    """
+    Keeps the latest series of every metric, already rendered
+    in the Prometheus text exposition format.
+
+    Each metric is replaced as a whole after the poll cycle,
+    so series of MOs that disappeared are dropped with it,
+    and rendering the endpoint is only joining the prepared blocks.
+    Metrics polled from multiple fabrics are stored separately,
+    and rendered together under a single header.
+    """
+
+    def __init__(self) -> None:
+        self._lock = Lock()
+        self._blocks: Dict[str, Tuple[str, bytes]] = {}
+
+    def set(self, name: str, metric_name: str, block: bytes) -> None:
+        """
+        Replace series of the metric.
+
+        :param name: metric name, including the fabric
+        :param metric_name: sanitized Prometheus metric name
+        :param block: rendered series, without the header
+        """
+        with self._lock:
+            self._blocks[name] = (metric_name, block)
+
+    def delete(self, name: str) -> None:
+        """
+        Remove all series of the metric.
+
+        :param name: metric name
+        """
+        with self._lock:
+            self._blocks.pop(name, None)
+
+    def render(self) -> bytes:
+        """
+        Render all stored series.
+
+        :return: Prometheus text exposition
+        """
+        with self._lock:
+            blocks = list(self._blocks.values())
+        families: Dict[str, List[bytes]] = {}
+        for metric_name, block in blocks:
+            families.setdefault(metric_name, []).append(block)
+        return b"".join(
+            render_header(metric_name) + b"".join(family)
+            for metric_name, family in families.items()
+        )
+
+
+store = MetricsStore()
@@ -0,0 +1,240 @@
+import json
+import logging
+import ssl
+import time
+from threading import Lock, Thread
+from typing import Dict, List, Optional, Tuple, Union
+from urllib.parse import quote
+
+import websocket  # type: ignore
+from .aci import aci_get
+from .session import ApicSession
+
+logger = logging.getLogger("gunicorn.error")
+
+
+class Subscription:
+    """
+    Local copy of MOs matching the class query,
+    kept up to date with events pushed by APIC.
+    """
+
+    def __init__(self, class_name: str, query_filter: str):
+        self.class_name = class_name
+        self.query_filter = query_filter
+        self.id: Optional[str] = None
+        self.active = False
+        self.refreshed_at = 0.0
+        self.used_at = time.time()
+        self._lock = Lock()
+        self._mos: Dict[str, dict] = {}
+
+    def load(self, items: List[dict]) -> None:
+        """
+        Replace MOs with the initial snapshot.
+
+        :param items: MOs from "imdata" of the APIC response
+        """
+        mos = {}
+        for item in items:
+            attributes = item[self.class_name]["attributes"]
+            mos[attributes["dn"]] = attributes
+        with self._lock:
+            self._mos = mos
+
+    def apply(self, item: dict) -> None:
+        """
+        Apply change of a single MO.
+
+        :param item: MO from "imdata" of the APIC event
+        """
+        attributes = item.get(self.class_name, {}).get("attributes")
+        if not attributes or "dn" not in attributes:
+            return
+        dn = attributes["dn"]
+        status = attributes.get("status")
+        with self._lock:
+            if status == "deleted":
+                self._mos.pop(dn, None)
+            elif dn in self._mos and status != "created":
+                self._mos[dn] = {**self._mos[dn], **attributes}
+            else:
+                self._mos[dn] = attributes
+
+    def items(self) -> List[dict]:
+        """
+        Get current MOs, in the same shape as the APIC query returns them.
+
+        :return: list of MOs
+        """
+        self.used_at = time.time()
+        with self._lock:
+            return [{self.class_name: {"attributes": x}} for x in self._mos.values()]
+
+
+class SubscriptionManager:
+    """
+    Manages APIC query subscriptions, sharing a single event WebSocket.
+
+    The WebSocket is opened before the first subscription, so no event is lost
+    between the snapshot and the subscription. Subscriptions are refreshed
+    periodically, and these not used for a while are left to expire.
+    When anything fails, the subscription is dropped, so the caller falls back
+    to polling, and it is opened again after the retry delay.
+    """
+
+    def __init__(
+        self,
+        session: ApicSession,
+        refresh_interval: float = 30,
+        retry_delay: float = 60,
+        unused_timeout: float = 300,
+    ):
+        self.session = session
+        self.refresh_interval = refresh_interval
+        self.retry_delay = retry_delay
+        self.unused_timeout = unused_timeout
+        self._lock = Lock()
+        self._ws: Optional[websocket.WebSocket] = None
+        self._thread: Optional[Thread] = None
+        self._subscriptions: Dict[Tuple[str, str], Subscription] = {}
+        self._by_id: Dict[str, Subscription] = {}
+        self._failed_at: Dict[Tuple[str, str], float] = {}
+
+    def _connect(self) -> None:
+        if self._ws is not None and self._ws.connected:
+            return
+        url = f"{self.session.api.replace('http', 'ws', 1)}/socket{self.session.token}"
+        self._ws = websocket.create_connection(
+            url,
+            timeout=min(1.0, self.refresh_interval),
+            sslopt={"cert_reqs": ssl.CERT_NONE},
+        )
+        self._thread = Thread(target=self._listen, args=(self._ws,), daemon=True)
+        self._thread.start()
+
+    def _disconnect(self, ws: websocket.WebSocket) -> None:
+        with self._lock:
+            if self._ws is ws:
+                self._ws = None
+                for subscription in self._subscriptions.values():
+                    subscription.active = False
+                self._subscriptions.clear()
+                self._by_id.clear()
+        try:
+            ws.close(timeout=0)
+        except Exception:
+            pass
+
+    def _subscribe(self, class_name: str, query_filter: str) -> Subscription:
+        query_target_part = (
+            f"query-target-filter={quote(query_filter)}&" if query_filter else ""
+        )
+        url = f"/api/node/class/{quote(class_name)}.json?{query_target_part}subscription=yes"  # noqa
+        response = aci_get(self.session, url)
+        if response.status_code != 200:
+            raise Exception(f'error subscribing "{class_name}": {response.text}')
+        data = response.json()
+        subscription = Subscription(class_name, query_filter)
+        subscription.load(data["imdata"])
+        subscription.id = str(data["subscriptionId"])
+        subscription.refreshed_at = time.time()
+        subscription.active = True
+        return subscription
+
+    def get(self, class_name: str, query_filter: str) -> Optional[Subscription]:
+        """
+        Get active subscription for the query, opening it when needed.
+
+        :param class_name: class name
+        :param query_filter: query filter
+        :return: subscription, or None when it's not available and caller should poll
+        """
+        key = (class_name, query_filter)
+        with self._lock:
+            subscription = self._subscriptions.get(key)
+            if subscription is not None and subscription.active:
+                return subscription
+            if time.time() - self._failed_at.get(key, 0) < self.retry_delay:
+                return None
+            try:
+                self._connect()
+                subscription = self._subscribe(class_name, query_filter)
+            except Exception as e:
+                logger.error(f"error subscribing {class_name}, falling back: {e}")
+                self._failed_at[key] = time.time()
+                return None
+            self._subscriptions[key] = subscription
+            self._by_id[subscription.id or ""] = subscription
+            return subscription
+
+    def _dispatch(self, message: Union[str, bytes]) -> None:
+        data = json.loads(message)
+        with self._lock:
+            subscriptions = [
+                self._by_id[x]
+                for x in data.get("subscriptionId", [])
+                if x in self._by_id
+            ]
+        for item in data.get("imdata", []):
+            for subscription in subscriptions:
+                subscription.apply(item)
+
+    def _refresh(self) -> None:
+        with self._lock:
+            subscriptions = list(self._subscriptions.items())
+        now = time.time()
+        for key, subscription in subscriptions:
+            if now - subscription.refreshed_at < self.refresh_interval:
+                continue
+            try:
+                if now - subscription.used_at > self.unused_timeout:
+                    raise Exception("subscription is not used anymore")
+                url = f"/api/subscriptionRefresh.json?id={subscription.id}"
+                response = aci_get(self.session, url)
+                if response.status_code != 200:
+                    raise Exception(response.text)
+                subscription.refreshed_at = now
+            except Exception as e:
+                logger.info(f"dropping subscription of {key[0]}: {e}")
+                with self._lock:
+                    subscription.active = False
+                    self._subscriptions.pop(key, None)
+                    self._by_id.pop(subscription.id or "", None)
+
+    def _listen(self, ws: websocket.WebSocket) -> None:
+        while True:
+            try:
+                opcode, message = ws.recv_data()
+                if opcode == websocket.ABNF.OPCODE_CLOSE:
+                    raise Exception("closed by APIC")
+                if opcode == websocket.ABNF.OPCODE_TEXT:
+                    self._dispatch(message)
+            except websocket.WebSocketTimeoutException:
+                pass
+            except Exception as e:
+                logger.error(f"APIC event WebSocket closed: {e}")
+                self._disconnect(ws)
+                return
+            self._refresh()
+
+    def close(self) -> None:
+        """
+        Close the WebSocket, and drop all subscriptions.
+        """
+        if self._ws is not None:
+            self._disconnect(self._ws)
+
+
+# Subscription managers by APIC session, each fabric has its own
+subscription_managers: Dict[ApicSession, SubscriptionManager] = {}
+subscription_managers_lock = Lock()
+
+
+def get_subscription_manager(session: ApicSession) -> SubscriptionManager:
+    with subscription_managers_lock:
+        manager = subscription_managers.get(session)
+        if manager is None:
+            manager = SubscriptionManager(session)
+            subscription_managers[session] = manager
+    return manager
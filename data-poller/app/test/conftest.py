@@ -1,7 +1,26 @@
+import os
+
 import pytest
 
 from .. import create_app
 
+# Configuration required to import the poller
+os.environ.setdefault("DB_REDIS_URL", "redis://test-redis-url")
+os.environ.setdefault("PROMETHEUS_PUSHGATEWAY_URL", "test-pushgateway:9091")
+os.environ.setdefault("POLLER_SINK_QUEUE_SIZE", "0")
+os.environ.setdefault("ACI_URL", "https://test-apic")
+os.environ.setdefault("ACI_USERNAME", "test-username")
+os.environ.setdefault("ACI_PASSWORD", "test-password")
+
+
+@pytest.fixture(autouse=True)
+def fingerprints():
+    from ..poller import fingerprints
+
+    fingerprints.clear()
+    yield fingerprints
+    fingerprints.clear()
+
 
 @pytest.fixture()
 def app():
@@ -11,3 +30,30 @@ def app():
     }
     app = create_app(config, lambda: None)
     return app
+
+
+@pytest.fixture()
+def metric():
+    return {
+        "name": "metric_1",
+        "className": "eqptIngrBytes5min",
+        "attributes": ["unicastRate", "floodRate"],
+        "queryFilter": "",
+        "interval": 1000,
+    }
+
+
+@pytest.fixture()
+def aci_items():
+    return [
+        {
+            "eqptIngrBytes5min": {
+                "attributes": {
+                    "dn": f"topology/pod-1/node-101/sys/phys-[eth1/{i}]/CDeqptIngrBytes5min",  # noqa
+                    "unicastRate": str(i * 10),
+                    "floodRate": str(i),
+                }
+            }
+        }
+        for i in range(1, 4)
+    ]
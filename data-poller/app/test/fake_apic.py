@@ -0,0 +1,178 @@
+import base64
+import hashlib
+import json
+import struct
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Event, Thread
+from typing import Dict, List
+from urllib.parse import urlparse, parse_qs
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+def encode_frame(payload: bytes) -> bytes:
+    """
+    Encode unmasked WebSocket text frame, as sent by the server.
+    """
+    length = len(payload)
+    if length < 126:
+        header = struct.pack("!BB", 0x81, length)
+    elif length < 65536:
+        header = struct.pack("!BBH", 0x81, 126, length)
+    else:
+        header = struct.pack("!BBQ", 0x81, 127, length)
+    return header + payload
+
+
+class FakeApic(ThreadingHTTPServer):
+    """
+    Local stand-in for APIC, serving class queries with subscriptions,
+    subscription refreshes, and the event WebSocket.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, mos: Dict[str, List[dict]], latency: float = 0):
+        super().__init__(("127.0.0.1", 0), FakeApicHandler)
+        self.mos = mos
+        self.latency = latency
+        self.encoded: Dict[str, List[bytes]] = {}
+        self.token = "fake-token"
+        self.logins = 0
+        self.requests: List[str] = []
+        self.subscriptions: Dict[str, str] = {}
+        self.refreshed: List[str] = []
+        self.sockets: list = []
+        self.stopped = Event()
+        self.thread = Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stopped.set()
+        self.shutdown()
+        self.server_close()
+
+    def send_event(self, subscription_id: str, items: List[dict]) -> None:
+        message = json.dumps({"subscriptionId": [subscription_id], "imdata": items})
+        for socket in self.sockets:
+            socket.sendall(encode_frame(message.encode("utf-8")))
+
+    def encode_mos(self, class_name: str) -> List[bytes]:
+        """
+        Get serialized MOs of the class, so large responses are cheap to build.
+        """
+        if class_name not in self.encoded:
+            mos = self.mos.get(class_name, [])
+            self.encoded[class_name] = [json.dumps(x).encode("utf-8") for x in mos]
+        return self.encoded[class_name]
+
+    def close_sockets(self) -> None:
+        for socket in self.sockets:
+            socket.sendall(b"\x88\x00")
+            socket.close()
+        self.sockets.clear()
+
+
+class FakeApicHandler(BaseHTTPRequestHandler):
+    server: FakeApic
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, data: dict, status: int = 200):
+        self.send_body(json.dumps(data).encode("utf-8"), status)
+
+    def send_body(self, body: bytes, status: int = 200):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_token(self):
+        self.server.token = f"fake-token-{self.server.logins}"
+        self.send_json(
+            {
+                "imdata": [
+                    {
+                        "aaaLogin": {
+                            "attributes": {
+                                "token": self.server.token,
+                                "refreshTimeoutSeconds": "600",
+                            }
+                        }
+                    }
+                ]
+            }
+        )
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if self.path == "/api/aaaLogin.json":
+            self.server.logins += 1
+            return self.send_token()
+        self.send_json({"imdata": []}, 404)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        self.server.requests.append(url.path)
+        if url.path.startswith("/api/") and self.headers.get("Cookie") != (
+            f"APIC-cookie={self.server.token}"
+        ):
+            self.send_json({"imdata": []}, 403)
+        elif url.path == "/api/aaaRefresh.json":
+            self.server.logins += 1
+            self.send_token()
+        elif url.path == f"/socket{self.server.token}":
+            accept = base64.b64encode(
+                hashlib.sha1(
+                    (self.headers["Sec-WebSocket-Key"] + WEBSOCKET_GUID).encode()
+                ).digest()
+            ).decode()
+            self.send_response(101)
+            self.send_header("Upgrade", "websocket")
+            self.send_header("Connection", "Upgrade")
+            self.send_header("Sec-WebSocket-Accept", accept)
+            self.end_headers()
+            self.wfile.flush()
+            self.server.sockets.append(self.connection)
+            self.server.stopped.wait()
+            self.close_connection = True
+        elif url.path == "/api/subscriptionRefresh.json":
+            subscription_id = query["id"][0]
+            if subscription_id not in self.server.subscriptions:
+                return self.send_json({"imdata": []}, 400)
+            self.server.refreshed.append(subscription_id)
+            self.send_json({"imdata": []})
+        elif url.path.startswith("/api/node/class/"):
+            class_name = url.path[len("/api/node/class/") : -len(".json")]
+            mos = self.server.encode_mos(class_name)
+            total_count = len(mos)
+            if "page-size" in query:
+                page_size = int(query["page-size"][0])
+                offset = int(query.get("page", ["0"])[0]) * page_size
+                mos = mos[offset : offset + page_size]
+            extra = b""
+            if query.get("subscription") == ["yes"]:
+                subscription_id = str(len(self.server.subscriptions) + 1000)
+                self.server.subscriptions[subscription_id] = class_name
+                extra = f', "subscriptionId": "{subscription_id}"'.encode()
+            time.sleep(self.server.latency)
+            self.send_body(
+                f'{{"totalCount": "{total_count}"'.encode()
+                + extra
+                + b', "imdata": ['
+                + b",".join(mos)
+                + b"]}"
+            )
+        else:
+            self.send_json({"imdata": []}, 404)
@@ -0,0 +1,64 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from typing import Dict, List, Optional, Tuple
+
+
+class FakePushGateway(ThreadingHTTPServer):
+    """
+    Local stand-in for the Prometheus Push Gateway,
+    storing the latest body of every group, and counting requests.
+    Pushes are rejected with the status, when it's set.
+    """
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), FakePushGatewayHandler)
+        self.groups: Dict[str, bytes] = {}
+        self.requests: List[Tuple[str, str]] = []
+        self.status: Optional[int] = None
+        self.lock = Lock()
+        self.thread = Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+
+
+class FakePushGatewayHandler(BaseHTTPRequestHandler):
+    server: FakePushGateway
+
+    def log_message(self, *args):
+        pass
+
+    def respond(self, status: int):
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_PUT(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        with self.server.lock:
+            self.server.requests.append(("PUT", self.path))
+            if self.server.status is not None:
+                self.respond(self.server.status)
+                return
+            self.server.groups[self.path] = body
+        self.respond(200)
+
+    def do_POST(self):
+        self.do_PUT()
+
+    def do_DELETE(self):
+        with self.server.lock:
+            self.server.requests.append(("DELETE", self.path))
+            self.server.groups.pop(self.path, None)
+        self.respond(202)
@@ -0,0 +1,197 @@
+from fnmatch import fnmatch
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+
+def _encode(value: Any) -> bytes:
+    return value if isinstance(value, bytes) else str(value).encode("utf-8")
+
+
+class FakeRedis:
+    """
+    In-memory subset of Redis commands used by the application.
+    Transactions are executed sequentially, so WATCH never fails.
+    """
+
+    def __init__(self):
+        self.data: Dict[bytes, Any] = {}
+        self.published: List[Tuple[str, Any]] = []
+
+    # Strings
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.data.get(_encode(key))
+
+    def set(self, key: str, value: Any) -> bool:
+        self.data[_encode(key)] = _encode(value)
+        return True
+
+    def mget(self, keys: List[str]) -> List[Optional[bytes]]:
+        return [self.get(key) for key in keys]
+
+    def scan_iter(self, match: str, count: int = 10) -> Iterator[bytes]:
+        return iter([x for x in list(self.data) if fnmatch(x.decode(), match)])
+
+    def incr(self, key: str) -> int:
+        value = int(self.data.get(_encode(key), 0)) + 1
+        self.data[_encode(key)] = _encode(value)
+        return value
+
+    def delete(self, *keys: str) -> int:
+        return len([self.data.pop(_encode(x)) for x in keys if _encode(x) in self.data])
+
+    def exists(self, *keys: str) -> int:
+        return len([x for x in keys if _encode(x) in self.data])
+
+    # Hashes
+
+    def _hash(self, key: str) -> Dict[bytes, bytes]:
+        return self.data.setdefault(_encode(key), {})
+
+    def hget(self, key: str, field: str) -> Optional[bytes]:
+        return self._hash(key).get(_encode(field))
+
+    def hgetall(self, key: str) -> Dict[bytes, bytes]:
+        return dict(self._hash(key))
+
+    def hexists(self, key: str, field: str) -> bool:
+        return _encode(field) in self._hash(key)
+
+    def hset(self, key: str, field: str, value: Any) -> int:
+        added = int(not self.hexists(key, field))
+        self._hash(key)[_encode(field)] = _encode(value)
+        return added
+
+    def hsetnx(self, key: str, field: str, value: Any) -> bool:
+        return bool(not self.hexists(key, field) and self.hset(key, field, value))
+
+    def hdel(self, key: str, *fields: str) -> int:
+        values = self._hash(key)
+        return len([values.pop(_encode(x)) for x in fields if _encode(x) in values])
+
+    # Sets
+
+    def _set(self, key: str) -> Set[bytes]:
+        return self.data.setdefault(_encode(key), set())
+
+    def sadd(self, key: str, *members: Any) -> int:
+        values = self._set(key)
+        added = set(_encode(x) for x in members) - values
+        values.update(added)
+        return len(added)
+
+    def srem(self, key: str, *members: Any) -> int:
+        values = self._set(key)
+        removed = set(_encode(x) for x in members) & values
+        values.difference_update(removed)
+        return len(removed)
+
+    def smembers(self, key: str) -> Set[bytes]:
+        return set(self.data.get(_encode(key), set()))
+
+    def sdiff(self, key: str, *keys: str) -> Set[bytes]:
+        values = self.smembers(key)
+        for other in keys:
+            values -= self.smembers(other)
+        return values
+
+    def rename(self, key: str, new_key: str) -> bool:
+        self.data[_encode(new_key)] = self.data.pop(_encode(key))
+        return True
+
+    # Sorted sets
+
+    def _zset(self, key: str) -> Dict[bytes, float]:
+        return self.data.setdefault(_encode(key), {})
+
+    def zadd(self, key: str, mapping: Dict[str, float], nx: bool = False) -> int:
+        values = self._zset(key)
+        added = 0
+        for member, score in mapping.items():
+            if _encode(member) not in values:
+                added += 1
+            elif nx:
+                continue
+            values[_encode(member)] = float(score)
+        return added
+
+    def zmscore(self, key: str, members: List[str]) -> List[Optional[float]]:
+        return [self._zset(key).get(_encode(x)) for x in members]
+
+    def zrem(self, key: str, *members: str) -> int:
+        values = self._zset(key)
+        return len([values.pop(_encode(x)) for x in members if _encode(x) in values])
+
+    def zremrangebyscore(self, key: str, low: Any, high: Any) -> int:
+        values = self._zset(key)
+        removed = [
+            x for x, score in values.items() if float(low) <= score <= float(high)
+        ]
+        for member in removed:
+            del values[member]
+        return len(removed)
+
+    def zcard(self, key: str) -> int:
+        return len(self._zset(key))
+
+    def zrange(self, key: str, start: int, end: int, withscores: bool = False) -> list:
+        items = sorted(self._zset(key).items(), key=lambda x: (x[1], x[0]))
+        items = items[start : (end + 1) or None]
+        return items if withscores else [member for member, _ in items]
+
+    # Other
+
+    def publish(self, channel: str, message: Any) -> int:
+        self.published.append((channel, message))
+        return 0
+
+    def ping(self) -> bool:
+        return True
+
+    def close(self) -> None:
+        pass
+
+    def pipeline(self, transaction: bool = True) -> "FakePipeline":
+        return FakePipeline(self)
+
+    def transaction(self, func: Callable, *watches: str, **kwargs) -> list:
+        pipe = self.pipeline()
+        pipe.watch(*watches)
+        value = func(pipe)
+        results = pipe.execute()
+        return value if kwargs.get("value_from_callable") else results
+
+
+class FakePipeline:
+    """
+    Pipeline executing commands immediately after WATCH,
+    and buffering them after MULTI or when not watching.
+    """
+
+    def __init__(self, db: FakeRedis):
+        self.db = db
+        self.immediate = False
+        self.commands: List[Tuple[str, tuple, dict]] = []
+
+    def watch(self, *keys: str) -> None:
+        self.immediate = True
+
+    def multi(self) -> None:
+        self.immediate = False
+
+    def execute(self) -> list:
+        commands, self.commands = self.commands, []
+        self.immediate = False
+        return [
+            getattr(self.db, name)(*args, **kwargs) for name, args, kwargs in commands
+        ]
+
+    def __getattr__(self, name: str) -> Callable:
+        command = getattr(self.db, name)
+
+        def call(*args, **kwargs):
+            if self.immediate:
+                return command(*args, **kwargs)
+            self.commands.append((name, args, kwargs))
+            return self
+
+        return call
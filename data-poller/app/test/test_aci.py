@@ -0,0 +1,106 @@
+import json
+from typing import List
+from unittest.mock import MagicMock
+
+import pytest
+
+from ..aci import aci_query, build_query_url, get_attributes, iter_imdata
+
+
+def split(data: bytes, size: int) -> List[bytes]:
+    return [data[i : i + size] for i in range(0, len(data), size)]
+
+
+def make_items(count: int, offset: int = 0) -> List[dict]:
+    return [
+        {"eqptFan": {"attributes": {"dn": f"fan-{i}", "descr": "wentylator ł"}}}
+        for i in range(offset, offset + count)
+    ]
+
+
+def make_response(items: List[dict], chunk_size: int = 7) -> MagicMock:
+    body = json.dumps({"totalCount": str(len(items)), "imdata": items}).encode()
+    response = MagicMock(status_code=200)
+    response.__enter__.return_value = response
+    response.iter_content.return_value = split(body, chunk_size)
+    return response
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 64, 100000])
+def test_iter_imdata(chunk_size: int):
+    items = make_items(20)
+    body = json.dumps({"totalCount": "20", "imdata": items}, indent=2).encode()
+    assert list(iter_imdata(split(body, chunk_size))) == items
+
+
+def test_iter_imdata_empty():
+    assert list(iter_imdata([b'{"totalCount":"0","imdata":[]}'])) == []
+
+
+@pytest.mark.parametrize(
+    "body", [b'{"totalCount":"0"}', b'{"imdata":[{"a":1},{"b"', b'{"imdata":[{}']
+)
+def test_iter_imdata_invalid(body: bytes):
+    with pytest.raises(ValueError):
+        list(iter_imdata([body]))
+
+
+def test_aci_query_pages():
+    session = MagicMock()
+    session.get.side_effect = [
+        make_response(make_items(2)),
+        make_response(make_items(2, 2)),
+        make_response(make_items(1, 4)),
+    ]
+    items = list(aci_query(session, "eqptFan", 'eq(eqptFan.id,"1")', 2))
+    assert [x["eqptFan"]["attributes"]["dn"] for x in items] == [
+        f"fan-{i}" for i in range(5)
+    ]
+    urls = [x.args[0] for x in session.get.call_args_list]
+    assert urls[0] == (
+        "/api/node/class/eqptFan.json"
+        "?query-target-filter=eq%28eqptFan.id%2C%221%22%29"
+        "&order-by=eqptFan.dn&page=0&page-size=2"
+    )
+    assert urls[2].endswith("&page=2&page-size=2")
+
+
+@pytest.mark.parametrize(
+    "query, page_size, include_health, url",
+    [
+        ("", 0, False, "/api/node/class/eqptFan.json"),
+        ("", 0, True, "/api/node/class/eqptFan.json?rsp-subtree-include=health"),
+        (
+            'eq(eqptFan.id,"1")',
+            2,
+            True,
+            "/api/node/class/eqptFan.json"
+            "?query-target-filter=eq%28eqptFan.id%2C%221%22%29"
+            "&rsp-subtree-include=health&order-by=eqptFan.dn&page=0&page-size=2",
+        ),
+    ],
+)
+def test_build_query_url(query: str, page_size: int, include_health: bool, url: str):
+    assert build_query_url("eqptFan", query, 0, page_size, include_health) == url
+
+
+def test_get_attributes_with_health():
+    mo = {
+        "attributes": {"dn": "fan-1"},
+        "children": [{"healthInst": {"attributes": {"cur": "95", "maxSev": "minor"}}}],
+    }
+    assert get_attributes(mo) == {
+        "dn": "fan-1",
+        "healthInst.cur": "95",
+        "healthInst.maxSev": "minor",
+    }
+    assert get_attributes({"attributes": {"dn": "fan-1"}}) == {"dn": "fan-1"}
+
+
+def test_aci_query_error():
+    session = MagicMock()
+    response = MagicMock(status_code=400, text="invalid class")
+    response.__enter__.return_value = response
+    session.get.return_value = response
+    with pytest.raises(Exception, match="invalid class"):
+        list(aci_query(session, "eqptFan", ""))
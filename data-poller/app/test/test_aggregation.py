@@ -0,0 +1,63 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from ..aggregation import Aggregator
+from ..poller import MetricBatch
+
+samples = [
+    ("node-101/phys-[eth1/1]", "unicastRate", "101", 1.0),
+    ("node-101/phys-[eth1/2]", "unicastRate", "101", 3.0),
+    ("node-102/phys-[eth1/1]", "unicastRate", "102", 5.0),
+    ("node-101/phys-[eth1/1]", "floodRate", "101", 2.0),
+]
+
+
+@pytest.mark.parametrize(
+    "function, expected",
+    [
+        ("sum", [4.0, 5.0, 2.0]),
+        ("avg", [2.0, 5.0, 2.0]),
+        ("min", [1.0, 5.0, 2.0]),
+        ("max", [3.0, 5.0, 2.0]),
+        ("count", [2.0, 1.0, 1.0]),
+    ],
+)
+def test_aggregator(function: str, expected: list):
+    aggregator = Aggregator(function)
+    aggregator.add(samples[:2])
+    aggregator.add(samples[2:])
+    assert aggregator.samples() == [
+        ("unicastRate", "101", expected[0]),
+        ("unicastRate", "102", expected[1]),
+        ("floodRate", "101", expected[2]),
+    ]
+    assert aggregator.samples() == []
+
+
+def test_aggregator_unknown_function():
+    with pytest.raises(ValueError):
+        Aggregator("median")
+
+
+@patch("app.sinks.pushgateway.push_to_gateway")
+def test_batch_pushes_aggregates(mock_push: MagicMock):
+    batch = MetricBatch(
+        "metric_1",
+        "eqptIngrBytes5min",
+        2,
+        aggregation={"function": "sum", "by": ["node"]},
+    )
+    for node in (101, 101, 102, 102, 102):
+        dn = f"topology/pod-1/node-{node}/sys/phys-[eth1/{node}]/CDeqptIngrBytes5min"
+        batch.add(dn, "unicastRate", "1.5")
+    batch.close()
+
+    # Aggregates are pushed once, at the end of the cycle
+    assert mock_push.call_count == 1
+    registry = mock_push.call_args.kwargs["registry"]
+    samples = list(registry.collect())[0].samples
+    assert [(x.labels, x.value) for x in samples] == [
+        ({"attribute_name": "unicastRate", "node": "101", "fabric": "default"}, 3.0),
+        ({"attribute_name": "unicastRate", "node": "102", "fabric": "default"}, 4.5),
+    ]
@@ -0,0 +1,168 @@
+import asyncio
+import time
+from typing import List
+from unittest.mock import patch, MagicMock
+
+import pytest
+
+from .fake_apic import FakeApic
+from .fake_pushgateway import FakePushGateway
+from .fake_redis import FakeRedis
+from ..instrumentation import metric_errors
+from ..poller import writer
+from ..poller.aio import (
+    AsyncApicSession,
+    AsyncScheduler,
+    aci_query_async,
+    create_http_session,
+    process_metrics_async,
+)
+from ..poller.scheduler import now_ms
+
+
+def port(index: int) -> dict:
+    return {
+        "eqptIngrBytes5min": {
+            "attributes": {
+                "dn": f"sys/phys-[eth1/{index}]/CDeqptIngrBytes5min",
+                "unicastRate": str(index),
+                "floodRate": str(index % 2),
+            }
+        }
+    }
+
+
+@pytest.fixture()
+def apic():
+    with FakeApic({"eqptIngrBytes5min": [port(i) for i in range(7)]}) as apic:
+        yield apic
+
+
+@pytest.fixture()
+def pushgateway():
+    with FakePushGateway() as pushgateway:
+        yield pushgateway
+
+
+def test_aci_query_async_pages(apic: FakeApic):
+    async def query():
+        async with create_http_session() as http:
+            session = AsyncApicSession(http, [apic.url], "user", "password")
+            return [
+                x async for x in aci_query_async(session, "eqptIngrBytes5min", "", 3)
+            ]
+
+    items = asyncio.run(query())
+    assert items == [port(i) for i in range(7)]
+    assert apic.logins == 1
+    assert apic.requests.count("/api/node/class/eqptIngrBytes5min.json") == 3
+
+
+def test_aci_query_async_relogin(apic: FakeApic):
+    async def query():
+        async with create_http_session() as http:
+            session = AsyncApicSession(http, [apic.url], "user", "password")
+            await session.login()
+            apic.token = "other-token"
+            return [x async for x in aci_query_async(session, "eqptIngrBytes5min", "")]
+
+    assert len(asyncio.run(query())) == 7
+    assert apic.logins == 2
+
+
+@patch("app.poller.aio.mark_as_processed")
+def test_process_metrics_async(
+    mock_mark: MagicMock,
+    apic: FakeApic,
+    pushgateway: FakePushGateway,
+    metric: dict,
+):
+    metrics = [
+        metric,
+        metric
+        | {
+            "name": "metric_2",
+            "queryFilter": 'eq(eqptIngrBytes5min.floodRate, "1")',
+        },
+    ]
+
+    db = FakeRedis()
+    db.sadd("related-metric_1", "metric_1-5")
+
+    async def process():
+        async with create_http_session() as http:
+            session = AsyncApicSession(http, [apic.url], "user", "password")
+            await process_metrics_async(db, session, metrics)
+
+    # Series are pushed from the event loop, not by the (synchronous) writer
+    with patch.object(writer.sink, "url", pushgateway.url), patch.object(
+        writer, "write", side_effect=AssertionError("writer used")
+    ), patch("app.poller.PROMETHEUS_PUSH_CHUNK_SIZE", 8):
+        asyncio.run(process())
+
+    assert apic.requests.count("/api/node/class/eqptIngrBytes5min.json") == 1
+    assert sorted(pushgateway.groups) == [
+        "/metrics/job/aci_monitoring/id/metric_1-0",
+        "/metrics/job/aci_monitoring/id/metric_1-1",
+        "/metrics/job/aci_monitoring/id/metric_2-0",
+    ]
+    assert (
+        pushgateway.groups["/metrics/job/aci_monitoring/id/metric_2-0"].count(
+            b'attribute_name="floodRate"'
+        )
+        == 3
+    )
+    assert ("DELETE", "/metrics/job/aci_monitoring/id/metric_1-5") in (
+        pushgateway.requests
+    )
+    assert db.smembers("related-metric_1") == {b"metric_1-0", b"metric_1-1"}
+    assert mock_mark.call_count == 2
+
+
+@patch("app.poller.aio.mark_as_processed")
+def test_process_metrics_async_push_error(
+    mock_mark: MagicMock,
+    apic: FakeApic,
+    pushgateway: FakePushGateway,
+    metric: dict,
+):
+    pushgateway.status = 500
+    errors = metric_errors.labels("metric_1")._value.get()
+
+    async def process():
+        async with create_http_session() as http:
+            session = AsyncApicSession(http, [apic.url], "user", "password")
+            await process_metrics_async(FakeRedis(), session, [metric])
+
+    with patch.object(writer.sink, "url", pushgateway.url), patch(
+        "app.poller.PROMETHEUS_PUSH_CHUNK_SIZE", 8
+    ):
+        asyncio.run(process())
+
+    assert pushgateway.groups == {}
+    assert metric_errors.labels("metric_1")._value.get() > errors
+    assert mock_mark.call_count == 1
+
+
+def test_async_scheduler_runs_concurrently():
+    finished: List[str] = []
+
+    async def func(metrics: List[dict]):
+        await asyncio.sleep(0.3)
+        finished.append(metrics[0]["name"])
+
+    async def run():
+        scheduler = AsyncScheduler(func, 10)
+        scheduler.update(
+            [{"name": f"m{i}", "interval": 60000} for i in range(5)],
+            {f"m{i}": int(now_ms()) - 60000 for i in range(5)},
+        )
+        assert scheduler.run_pending() == 5
+        while len(finished) < 5:
+            await asyncio.sleep(0.01)
+        return scheduler
+
+    started = time.time()
+    scheduler = asyncio.run(run())
+    assert time.time() - started < 1
+    assert scheduler.next_due() is not None
@@ -0,0 +1,86 @@
+import time
+from unittest.mock import MagicMock
+
+from ..cluster import REPLICAS_KEY, Cluster
+from ..metrics import MetricsCache
+from ..poller import get_query_key, update_schedule
+from ..poller.scheduler import Scheduler
+from .fake_redis import FakeRedis
+
+
+def test_cluster_heartbeat_registers_replicas():
+    db = FakeRedis()
+    first = Cluster(db, "poller-1")
+    second = Cluster(db, "poller-2")
+    first.heartbeat()
+    second.heartbeat()
+    first.heartbeat()
+    assert first.replicas == ("poller-1", "poller-2")
+    assert first.is_leader() and not second.is_leader()
+
+
+def test_cluster_drops_dead_replicas():
+    db = FakeRedis()
+    db.zadd(REPLICAS_KEY, {"poller-0": (time.time() - 60) * 1000})
+    cluster = Cluster(db, "poller-1", timeout=15)
+    cluster.heartbeat()
+    assert cluster.replicas == ("poller-1",)
+    assert db.zrange(REPLICAS_KEY, 0, -1) == [b"poller-1"]
+
+
+def test_cluster_stop_unregisters_replica():
+    db = FakeRedis()
+    cluster = Cluster(db, "poller-1")
+    cluster.heartbeat()
+    cluster.stop()
+    assert db.zrange(REPLICAS_KEY, 0, -1) == []
+
+
+def test_cluster_splits_keys_between_replicas():
+    db = FakeRedis()
+    replicas = [Cluster(db, f"poller-{i}") for i in range(3)]
+    for cluster in replicas + replicas:
+        cluster.heartbeat()
+    keys = [("poll", f"class{i}", None) for i in range(300)]
+
+    # Every key has exactly one owner, and all replicas get some
+    owners = [[x.replica_id for x in replicas if x.owns(key)] for key in keys]
+    assert all(len(x) == 1 for x in owners)
+    assert {x[0] for x in owners} == {"poller-0", "poller-1", "poller-2"}
+
+    # Only keys of the dead replica move
+    before = {key: replicas[0].owner(key) for key in keys}
+    db.zrem(REPLICAS_KEY, "poller-2")
+    replicas[0].heartbeat()
+    for key in keys:
+        if before[key] != "poller-2":
+            assert replicas[0].owner(key) == before[key]
+        else:
+            assert replicas[0].owner(key) != "poller-2"
+
+
+def test_update_schedule_takes_only_owned_metrics(metric: dict):
+    db = FakeRedis()
+    first = Cluster(db, "poller-1")
+    second = Cluster(db, "poller-2")
+    metrics = [
+        metric | {"name": f"metric_{i}", "className": f"class{i}"} for i in range(20)
+    ]
+    metrics_cache = MagicMock(spec=MetricsCache)
+    metrics_cache.get.return_value = metrics
+    scheduler = Scheduler(lambda metrics: None, 1, group_key=get_query_key)
+
+    # Single replica processes everything
+    first.heartbeat()
+    scheduled = update_schedule(db, metrics_cache, {"default": scheduler}, first)
+    assert [x["name"] for x in scheduled] == [x["name"] for x in metrics]
+    assert all(x["name"] in scheduler for x in metrics)
+
+    # Metrics of the replica that joined are released
+    second.heartbeat()
+    first.heartbeat()
+    update_schedule(db, metrics_cache, {"default": scheduler}, first)
+    scheduler.shutdown()
+    owned = [x["name"] for x in metrics if first.owns(("default", get_query_key(x)))]
+    assert 0 < len(owned) < len(metrics)
+    assert [x["name"] for x in metrics if x["name"] in scheduler] == owned
@@ -0,0 +1,50 @@
+from unittest.mock import patch, MagicMock
+
+import pytest
+
+from ..converters import get_converter
+from ..poller import MetricBatch, invalid_values
+
+
+@pytest.mark.parametrize(
+    "spec,value,expected",
+    [
+        (None, "1.5", 1.5),
+        ("float", "-2e3", -2000),
+        ("int", "42", 42),
+        ("int", "0x1f", 31),
+        ("bool", "yes", 1),
+        ("bool", "Disabled", 0),
+        ({"up": 1, "down": 0}, "down", 0),
+    ],
+)
+def test_converter(spec, value: str, expected: float):
+    assert get_converter(spec)(value) == expected
+
+
+@pytest.mark.parametrize(
+    "spec,value",
+    [("float", "up"), ("int", "1.5"), ("bool", "maybe"), ({"up": 1}, "down")],
+)
+def test_converter_invalid_value(spec, value: str):
+    with pytest.raises(ValueError):
+        get_converter(spec)(value)
+
+
+def test_converter_compiled_once():
+    assert get_converter({"a": 1, "b": 2}) is get_converter({"b": 2, "a": 1})
+
+
+@patch("app.sinks.pushgateway.push_to_gateway")
+def test_batch_counts_invalid_values(mock_push: MagicMock):
+    converter = get_converter({"up": 1, "down": 0})
+    batch = MetricBatch("metric_x", "ethpmPhysIf", 10, converter=converter)
+    batch.add("dn-1/ethpmPhysIf", "operSt", "up")
+    batch.add("dn-2/ethpmPhysIf", "operSt", "unknown")
+    batch.add("dn-3/ethpmPhysIf", "operSt", "down")
+    batch.close()
+
+    registry = mock_push.call_args.kwargs["registry"]
+    samples = list(registry.collect())[0].samples
+    assert [(x.labels["dn"], x.value) for x in samples] == [("dn-1/", 1), ("dn-3/", 0)]
+    assert invalid_values[("metric_x", "dn-2/", "operSt")] == 1
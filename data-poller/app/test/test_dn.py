@@ -0,0 +1,72 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from ..dn import get_dn_parser, parse_dn, split_dn
+from ..poller import MetricBatch
+
+
+def test_split_dn():
+    assert split_dn("topology/pod-1/node-101/sys/phys-[eth1/2]/CD") == [
+        "topology",
+        "pod-1",
+        "node-101",
+        "sys",
+        "phys-[eth1/2]",
+        "CD",
+    ]
+
+
+@pytest.mark.parametrize(
+    "dn, labels",
+    [
+        (
+            "topology/pod-1/node-101/sys/phys-[eth1/2]/CD",
+            {"pod": "1", "node": "101", "interface": "eth1/2"},
+        ),
+        (
+            "uni/tn-common/ap-web/epg-front",
+            {"tenant": "common", "ap": "web", "epg": "front"},
+        ),
+        (
+            "topology/pod-2/protpaths-101-102/pathep-[vpc-1]",
+            {"pod": "2", "node": "101-102", "interface": "vpc-1"},
+        ),
+        ("uni/tn-t1/out-wan/instP-ext", {"tenant": "t1", "l3out": "wan"}),
+        ("sys/ch/ftslot-1/ft/fan-1", {}),
+    ],
+)
+def test_parse_dn(dn: str, labels: dict):
+    assert parse_dn(dn) == labels
+
+
+def test_dn_parser_is_memoized():
+    parser = get_dn_parser("l1PhysIf", ("node", "interface"))
+    assert get_dn_parser("l1PhysIf", ("node", "interface")) is parser
+    dn = "topology/pod-1/node-101/sys/phys-[eth1/2]"
+    assert parser(dn) == ("101", "eth1/2")
+    assert parser(dn) is parser(dn)
+    assert parser("sys/ch") == ("", "")
+
+
+def test_batch_adds_dn_labels():
+    batch = MetricBatch("metric_1", "l1PhysIf", 10, dn_labels=("node", "interface"))
+    batch.add("topology/pod-1/node-101/sys/phys-[eth1/2]", "speed", "10")
+    assert batch.convert() == [
+        ("topology/pod-1/node-101/sys/phys-[eth1/2]", "speed", "101", "eth1/2", 10.0)
+    ]
+
+
+@patch("app.sinks.pushgateway.push_to_gateway")
+def test_batch_pushes_dn_labels(mock_push: MagicMock):
+    batch = MetricBatch("metric_1", "l1PhysIf", 10, dn_labels=("pod",))
+    batch.add("topology/pod-1/node-101/sys/phys-[eth1/2]", "speed", "10")
+    batch.close()
+    registry = mock_push.call_args.kwargs["registry"]
+    labels = {
+        "dn": "topology/pod-1/node-101/sys/phys-[eth1/2]",
+        "attribute_name": "speed",
+        "pod": "1",
+        "fabric": "default",
+    }
+    assert registry.get_sample_value("metric_1", labels) == 10
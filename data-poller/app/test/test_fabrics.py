@@ -0,0 +1,154 @@
+from threading import Event, Thread
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from ..aci import aci_login_failures, aci_sessions, get_aci_session
+from ..metrics import MetricsCache
+from ..poller import (
+    MetricBatch,
+    get_fabric_metrics,
+    get_query_key,
+    process_fabric_metrics,
+    update_schedule,
+)
+from ..poller.scheduler import Scheduler
+from ..store import store
+from .fake_redis import FakeRedis
+
+
+def test_get_fabric_metrics(metric: dict):
+    metrics = [metric, metric | {"name": "metric_2", "fabrics": ["dc2", "dc3"]}]
+    fabric_metrics = get_fabric_metrics(metrics, ["default", "dc2"])
+    assert [(x["name"], x["metricName"], x["fabric"]) for x in fabric_metrics] == [
+        ("metric_1", "metric_1", "default"),
+        ("metric_1@dc2", "metric_1", "dc2"),
+        ("metric_2@dc2", "metric_2", "dc2"),
+    ]
+    assert get_fabric_metrics(metrics, ["default", "dc2"]) is fabric_metrics
+
+
+def test_update_schedule_per_fabric(metric: dict):
+    metrics_cache = MagicMock(spec=MetricsCache)
+    metrics_cache.get.return_value = [metric]
+    schedulers = {
+        name: Scheduler(lambda metrics: None, 1, group_key=get_query_key)
+        for name in ("dc1", "dc2")
+    }
+    update_schedule(FakeRedis(), metrics_cache, schedulers)
+    for scheduler in schedulers.values():
+        scheduler.shutdown()
+    assert "metric_1@dc1" in schedulers["dc1"]
+    assert "metric_1@dc2" in schedulers["dc2"]
+    assert "metric_1@dc1" not in schedulers["dc2"]
+
+
+@patch("app.poller.PROMETHEUS_MODE", "pull")
+def test_update_schedule_forgets_series_of_removed_metrics(metric: dict):
+    metrics_cache = MagicMock(spec=MetricsCache)
+    metrics_cache.get.return_value = [metric, metric | {"name": "metric_2"}]
+    schedulers = {
+        name: Scheduler(lambda metrics: None, 1, group_key=get_query_key)
+        for name in ("dc1", "dc2")
+    }
+    update_schedule(FakeRedis(), metrics_cache, schedulers)
+    for name in ("metric_1@dc1", "metric_1@dc2", "metric_2@dc1", "metric_2@dc2"):
+        store.set(name, name.split("@")[0], b"")
+
+    # Every replica forgets series of deleted metrics and removed fabrics
+    metrics_cache.get.return_value = [metric | {"fabrics": ["dc2"]}]
+    update_schedule(FakeRedis(), metrics_cache, schedulers)
+    for scheduler in schedulers.values():
+        scheduler.shutdown()
+    assert set(store._blocks) == {"metric_1@dc2"}
+    store.delete("metric_1@dc2")
+
+
+@patch("app.sinks.pushgateway.push_to_gateway")
+def test_batch_pushes_fabric_label(mock_push: MagicMock):
+    batch = MetricBatch(
+        "metric_1@dc2", "eqptFan", 10, fabric="dc2", metric_name="metric_1"
+    )
+    batch.add("fan-1/eqptFan", "operSt", "1")
+    batch.close()
+    assert mock_push.call_args.kwargs["grouping_key"] == {"id": "metric_1@dc2-0"}
+    registry = mock_push.call_args.kwargs["registry"]
+    labels = {"dn": "fan-1/", "attribute_name": "operSt", "fabric": "dc2"}
+    assert registry.get_sample_value("metric_1", labels) == 1
+
+
+def test_pull_mode_renders_fabrics_together():
+    for fabric in ("dc1", "dc2"):
+        batch = MetricBatch(
+            f"metric_3@{fabric}",
+            "eqptFan",
+            10,
+            mode="pull",
+            fabric=fabric,
+            metric_name="metric_3",
+        )
+        batch.add("fan-1/eqptFan", "operSt", "1")
+        batch.close()
+
+    assert store.render().decode("utf-8").splitlines() == [
+        "# HELP metric_3 ",
+        "# TYPE metric_3 gauge",
+        'metric_3{dn="fan-1/",attribute_name="operSt",fabric="dc1"} 1.0',
+        'metric_3{dn="fan-1/",attribute_name="operSt",fabric="dc2"} 1.0',
+    ]
+    store.delete("metric_3@dc1")
+    store.delete("metric_3@dc2")
+
+
+@patch("app.sinks.pushgateway.delete_from_gateway")
+@patch("app.poller.get_aci_session")
+def test_unreachable_fabric_fails_its_metrics(
+    mock_session: MagicMock, mock_delete: MagicMock, metric: dict
+):
+    mock_session.side_effect = ConnectionError("no APIC member is available")
+    db = FakeRedis()
+    db.sadd("related-metric_1@dc2", "metric_1@dc2-0")
+    config = {"name": "dc2"}
+    process_fabric_metrics(db, config, [metric | {"name": "metric_1@dc2"}])
+    assert mock_delete.call_args.kwargs["grouping_key"] == {"id": "metric_1@dc2-0"}
+
+
+@patch("app.aci.ApicSession")
+def test_unreachable_fabric_does_not_block_others(mock_class: MagicMock):
+    entered, release = Event(), Event()
+
+    def login(timeout: float):
+        entered.set()
+        release.wait(5)
+        raise ConnectionError("no APIC member is available")
+
+    def create(urls, *args, **kwargs):
+        session = MagicMock()
+        if urls == ["https://down"]:
+            session.login.side_effect = login
+        return session
+
+    def get_down_session():
+        with pytest.raises(ConnectionError):
+            get_aci_session(config | {"name": "down", "urls": ["https://down"]})
+
+    mock_class.side_effect = create
+    config = {"name": "up", "urls": ["https://up"], "username": "", "password": ""}
+    thread = Thread(target=get_down_session)
+    thread.start()
+    entered.wait(5)
+    try:
+        # Healthy fabric logs in while the other one is still waiting
+        assert get_aci_session(config) is aci_sessions["up"]
+        assert not release.is_set()
+    finally:
+        release.set()
+        thread.join()
+
+    # Login is not retried until the backoff expires
+    with pytest.raises(ConnectionError, match="retrying"):
+        get_aci_session(config | {"name": "down", "urls": ["https://down"]})
+    assert mock_class.call_count == 2
+    assert aci_login_failures["down"][0] == 1
+    aci_sessions.clear()
+    aci_login_failures.clear()
@@ -0,0 +1,90 @@
+import pytest
+
+from ..filters import parse_filter, is_local_filter, compile_filter
+
+
+def test_parse_filter():
+    assert parse_filter("") is None
+    assert parse_filter(
+        'and(eq(fvTenant.name, "a\\"b"),or(ne(fvTenant.x,"1"),wcard(fvTenant.y,"2")))'
+    ) == (
+        "and",
+        [
+            ("eq", "fvTenant.name", 'a"b'),
+            ("or", [("ne", "fvTenant.x", "1"), ("wcard", "fvTenant.y", "2")]),
+        ],
+    )
+
+
+@pytest.mark.parametrize(
+    "query",
+    ["abc.def", 'eq("12", 12)', 'ew(a.b, "12")', 'and("10")', 'eq(a.b, "1"))'],
+)
+def test_parse_filter_invalid(query: str):
+    with pytest.raises(ValueError):
+        parse_filter(query)
+
+
+def deep_filter(depth: int) -> str:
+    operators = ["or", "and"] * (depth // 2)
+    return (
+        "".join(f"{x}(" for x in operators)
+        + 'eq(eqptFan.operSt,"up")'
+        + ")" * len(operators)
+    )
+
+
+def test_parse_filter_deep():
+    node = parse_filter(deep_filter(2000))
+    for _ in range(2000):
+        node = node[1][0]  # type: ignore
+    assert node == ("eq", "eqptFan.operSt", "up")
+
+
+@pytest.mark.parametrize(
+    "query,expected",
+    [
+        ("", True),
+        (deep_filter(32), True),
+        # Deep filters are evaluated by APIC
+        (deep_filter(2000), False),
+        ('eq(eqptFan.operSt, "up")', True),
+        ('or(eq(eqptFan.operSt, "up"),ne(eqptFan.id,"1"))', True),
+        ('gt(eqptFan.id, "1")', False),
+        ('wcard(eqptFan.dn, "node-1")', False),
+        ('eq(eqptPsu.operSt, "up")', False),
+        ('eq(eqptFan.a.b, "up")', False),
+        ("invalid", False),
+    ],
+)
+def test_is_local_filter(query: str, expected: bool):
+    assert is_local_filter("eqptFan", query) == expected
+
+
+def test_compile_filter():
+    predicate = compile_filter(
+        'and(eq(eqptFan.operSt, "up"),or(ne(eqptFan.id,"1"),eq(eqptFan.model,"x")))'
+    )
+    assert predicate({"operSt": "up", "id": "2", "model": "y"})
+    assert predicate({"operSt": "up", "id": "1", "model": "x"})
+    assert not predicate({"operSt": "up", "id": "1", "model": "y"})
+    assert not predicate({"operSt": "down", "id": "2", "model": "x"})
+    assert compile_filter("")({})
+
+
+def test_compile_filter_deep():
+    predicate = compile_filter(deep_filter(32))
+    assert predicate({"operSt": "up"})
+    assert not predicate({"operSt": "down"})
+
+
+def test_compile_filter_numbers():
+    # Numeric properties are compared by their values, as APIC does
+    predicate = compile_filter('eq(eqptIngrBytes5min.floodRate,"0")')
+    assert predicate({"floodRate": "0.000000"})
+    assert predicate({"floodRate": "0"})
+    assert not predicate({"floodRate": "0.100000"})
+    assert not predicate({})
+    predicate = compile_filter('ne(eqptIngrBytes5min.floodRate,"1.5")')
+    assert not predicate({"floodRate": "1.500000"})
+    assert predicate({"floodRate": "abc"})
@@ -0,0 +1,281 @@
+import time
+from typing import List
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from ..history import (
+    build_history_filter,
+    format_timestamp,
+    get_current_dn,
+    get_history_class,
+    get_interval_index,
+    parse_timestamp,
+)
+from ..instrumentation import registry
+from ..metrics import MetricsCache
+from ..poller import (
+    backfill_metrics,
+    get_backfill_start,
+    get_query_key,
+    last_processed,
+    process_metric,
+    update_schedule,
+    writer,
+)
+from ..poller.scheduler import Scheduler
+from ..sinks import Chunk, Sink
+from .fake_redis import FakeRedis
+
+# 2022-08-01T10:00:00.000+00:00
+BASE_MS = 1659348000000
+INTERVAL_MS = 5 * 60 * 1000
+
+
+class TimestampSink(Sink):
+    keeps_timestamps = True
+
+    def __init__(self):
+        self.chunks: List[Chunk] = []
+
+    def write(self, chunks: List[Chunk]) -> None:
+        self.chunks.extend(chunks)
+
+
+@pytest.fixture()
+def sink():
+    sink = TimestampSink()
+    with patch.object(writer, "sink", sink):
+        yield sink
+    last_processed.clear()
+
+
+def history_record(port: int, index: int, base_ms: int = BASE_MS) -> dict:
+    return {
+        "eqptIngrBytesHist5min": {
+            "attributes": {
+                "dn": f"topology/pod-1/node-101/sys/phys-[eth1/{port}]/"
+                f"HDeqptIngrBytes5min-{index}",
+                "repIntvEnd": format_timestamp(base_ms - index * INTERVAL_MS),
+                "unicastRate": str(index * 10 + port),
+                "floodRate": str(port),
+            }
+        }
+    }
+
+
+def test_get_history_class():
+    assert get_history_class("eqptIngrBytes5min") == "eqptIngrBytesHist5min"
+    assert get_history_class("eqptEgrTotal15min") == "eqptEgrTotalHist15min"
+    assert get_history_class("fvOverallHealth1qtr") == "fvOverallHealthHist1qtr"
+    assert get_history_class("eqptIngrBytesHist5min") is None
+    assert get_history_class("eqptFan") is None
+
+
+def test_get_interval_index():
+    # 2022-08-01 is Monday
+    assert get_interval_index("eqptIngrBytes5min", BASE_MS) == BASE_MS // INTERVAL_MS
+    assert get_interval_index("eqptIngrBytes1w", BASE_MS) == get_interval_index(
+        "eqptIngrBytes1w", BASE_MS - 10 * 3600 * 1000
+    )
+    assert get_interval_index("eqptIngrBytes1w", BASE_MS - 11 * 3600 * 1000) == (
+        get_interval_index("eqptIngrBytes1w", BASE_MS) - 1  # type: ignore
+    )
+    assert get_interval_index("eqptIngrBytes1mo", BASE_MS) == 2022 * 12 + 7
+    assert get_interval_index("eqptIngrBytes1qtr", BASE_MS) == (2022 * 12 + 7) // 3
+    assert get_interval_index("eqptIngrBytes1year", BASE_MS) == 2022
+    assert get_interval_index("eqptIngrBytesHist5min", BASE_MS) is None
+    assert get_interval_index("eqptFan", BASE_MS) is None
+
+
+def test_get_backfill_start(metric: dict):
+    metric = metric | {"interval": 60000}
+    started_ms = time.time() * 1000 // INTERVAL_MS * INTERVAL_MS + 1000
+
+    # Overrun of the poll interval doesn't skip a whole statistics interval
+    last_processed["metric_1"] = started_ms - 2 * 60000
+    assert get_backfill_start(metric, started_ms) is None
+    last_processed["metric_1"] = started_ms - INTERVAL_MS
+    assert get_backfill_start(metric, started_ms) is None
+
+    # Whole interval before the current one passed without any poll
+    last_processed["metric_1"] = started_ms - INTERVAL_MS - 2000
+    assert get_backfill_start(metric, started_ms) == started_ms - INTERVAL_MS - 2000
+    last_processed.clear()
+
+
+def test_history_timestamps():
+    assert format_timestamp(BASE_MS) == "2022-08-01T10:00:00.000+00:00"
+    assert parse_timestamp("2022-08-01T12:00:00.000+02:00") == BASE_MS
+    assert (
+        build_history_filter("eqptIngrBytesHist5min", BASE_MS)
+        == 'gt(eqptIngrBytesHist5min.repIntvEnd,"2022-08-01T10:00:00.000+00:00")'
+    )
+    assert (
+        get_current_dn("sys/phys-[eth1/2]/HDeqptIngrBytes5min-3", "eqptIngrBytes5min")
+        == "sys/phys-[eth1/2]/CDeqptIngrBytes5min"
+    )
+
+
+@patch("app.poller.aci_query")
+def test_backfill_metrics_in_order(mock_query: MagicMock, sink, metric: dict):
+    mock_query.return_value = [history_record(1, i) for i in range(4)] + [
+        history_record(2, i) for i in range(4)
+    ]
+    metrics = [
+        metric | {"interval": INTERVAL_MS},
+        metric | {"name": "metric_2", "interval": INTERVAL_MS},
+        metric
+        | {
+            "name": "metric_3",
+            "interval": INTERVAL_MS,
+            "queryFilter": 'eq(eqptIngrBytes5min.floodRate,"2")',
+        },
+    ]
+    last_processed["metric_1"] = BASE_MS - 3 * INTERVAL_MS
+    last_processed["metric_2"] = BASE_MS - INTERVAL_MS
+    last_processed["metric_3"] = BASE_MS - 3 * INTERVAL_MS
+    backfill_metrics(MagicMock(), metrics, BASE_MS + 1000)
+
+    assert mock_query.call_args.args[1:3] == (
+        "eqptIngrBytesHist5min",
+        'gt(eqptIngrBytesHist5min.repIntvEnd,"2022-08-01T09:45:00.000+00:00")',
+    )
+
+    # Intervals that ended after the last poll, the oldest first
+    assert [(x.name, x.timestamp_ms, len(x.samples)) for x in sink.chunks] == [
+        ("metric_1", BASE_MS - 2 * INTERVAL_MS, 4),
+        ("metric_3", BASE_MS - 2 * INTERVAL_MS, 2),
+        ("metric_1", BASE_MS - INTERVAL_MS, 4),
+        ("metric_3", BASE_MS - INTERVAL_MS, 2),
+        ("metric_1", BASE_MS, 4),
+        ("metric_3", BASE_MS, 2),
+    ]
+    assert sink.chunks[-1].samples[0] == (
+        "topology/pod-1/node-101/sys/phys-[eth1/2]/CD",
+        "unicastRate",
+        2.0,
+    )
+
+
+@patch("app.poller.aci_query")
+def test_backfill_metrics_dn_filter(mock_query: MagicMock, sink, metric: dict):
+    mock_query.return_value = [history_record(1, 0), history_record(2, 0)]
+    dn = "topology/pod-1/node-101/sys/phys-[eth1/2]/CDeqptIngrBytes5min"
+    metric = metric | {
+        "interval": INTERVAL_MS,
+        "queryFilter": f'eq(eqptIngrBytes5min.dn,"{dn}")',
+    }
+    last_processed["metric_1"] = BASE_MS - 2 * INTERVAL_MS
+    backfill_metrics(MagicMock(), [metric], BASE_MS + 1000)
+
+    # Filter is evaluated with the DN of the current statistics
+    assert [(x.timestamp_ms, x.samples) for x in sink.chunks] == [
+        (
+            BASE_MS,
+            [
+                ("topology/pod-1/node-101/sys/phys-[eth1/2]/CD", "unicastRate", 2.0),
+                ("topology/pod-1/node-101/sys/phys-[eth1/2]/CD", "floodRate", 2.0),
+            ],
+        )
+    ]
+
+
+@patch("app.poller.aci_query")
+def test_backfill_metrics_missing_attributes(
+    mock_query: MagicMock, sink, metric: dict, caplog
+):
+    mock_query.return_value = [history_record(1, 0)]
+    metrics = [
+        metric
+        | {"interval": INTERVAL_MS, "attributes": ["unicastRate", "unicastLast"]},
+        metric
+        | {
+            "name": "metric_2",
+            "interval": INTERVAL_MS,
+            "queryFilter": 'eq(eqptIngrBytes5min.floodLast,"1")',
+        },
+        metric
+        | {
+            "name": "metric_3",
+            "interval": INTERVAL_MS,
+            "queryFilter": 'wcard(eqptIngrBytes5min.dn,"eth1/1")',
+        },
+    ]
+    for name in ("metric_1", "metric_2", "metric_3"):
+        last_processed[name] = BASE_MS - 2 * INTERVAL_MS
+    skipped = registry.get_sample_value(
+        "aci_monitoring_poller_backfill_skipped_total", {"metric": "metric_1"}
+    )
+    backfill_metrics(MagicMock(), metrics, BASE_MS + 1000)
+
+    # Only attributes of the history records are filled, the others are reported
+    assert [(x.name, [y[1] for y in x.samples]) for x in sink.chunks] == [
+        ("metric_1", ["unicastRate"])
+    ]
+    assert "no unicastLast" in caplog.text
+    assert "uses floodLast" in caplog.text
+    assert "metric_3" in caplog.text
+    assert (
+        registry.get_sample_value(
+            "aci_monitoring_poller_backfill_skipped_total", {"metric": "metric_1"}
+        )
+        == (skipped or 0) + 1
+    )
+
+
+@patch("app.poller.mark_as_processed")
+@patch("app.poller.aci_query")
+def test_process_metric_fills_gap_first(
+    mock_query: MagicMock,
+    mock_mark: MagicMock,
+    sink,
+    metric: dict,
+    aci_items: List[dict],
+):
+    ended_ms = int(time.time() * 1000) - 60000
+    mock_query.side_effect = [[history_record(1, 0, ended_ms)], aci_items]
+    last_processed["metric_1"] = ended_ms - 3 * INTERVAL_MS
+    process_metric(FakeRedis(), MagicMock(), metric)
+
+    assert [x.args[1] for x in mock_query.call_args_list] == [
+        "eqptIngrBytesHist5min",
+        "eqptIngrBytes5min",
+    ]
+    assert [x.timestamp_ms for x in sink.chunks][0] == ended_ms
+    assert last_processed["metric_1"] == sink.chunks[-1].timestamp_ms > ended_ms
+
+    # No gap since the last poll
+    mock_query.side_effect = [aci_items]
+    process_metric(FakeRedis(), MagicMock(), metric)
+    assert mock_query.call_count == 3
+
+
+@patch("app.sinks.pushgateway.push_to_gateway")
+@patch("app.poller.mark_as_processed")
+@patch("app.poller.aci_query")
+def test_push_gateway_is_not_filled(
+    mock_query: MagicMock,
+    mock_mark: MagicMock,
+    mock_push: MagicMock,
+    metric: dict,
+    aci_items: List[dict],
+):
+    mock_query.return_value = aci_items
+    last_processed["metric_1"] = BASE_MS
+    process_metric(FakeRedis(), MagicMock(), metric)
+    last_processed.clear()
+    assert mock_query.call_count == 1
+
+
+def test_update_schedule_loads_last_processing_time(metric: dict):
+    db = FakeRedis()
+    db.zadd("metrics-processed", {"metric_1": BASE_MS})
+    metrics_cache = MagicMock(spec=MetricsCache)
+    metrics_cache.get.return_value = [metric, metric | {"name": "metric_2"}]
+    last_processed["metric_3"] = BASE_MS
+    scheduler = Scheduler(lambda metrics: None, 1, group_key=get_query_key)
+    update_schedule(db, metrics_cache, {"default": scheduler})
+    scheduler.shutdown()
+    assert last_processed == {"metric_1": BASE_MS}
+    last_processed.clear()
@@ -0,0 +1,134 @@
+from json import dumps
+from typing import List
+from unittest.mock import patch, MagicMock
+
+from ..metrics import (
+    METRICS_INDEX_KEY,
+    METRICS_KEY,
+    MetricsCache,
+    get_last_processing_time,
+    get_metric_related_ids,
+    get_metrics,
+    get_processed_metric_names,
+    mark_as_processed,
+    migrate_processed_metrics,
+    sync_metric_related_ids,
+)
+from ..poller import (
+    ObsoleteMetricsSweep,
+    delete_obsolete_groups,
+    delete_obsolete_metrics,
+)
+from .fake_redis import FakeRedis
+
+
+def store_metrics(db: FakeRedis, metrics: List[dict], version: int) -> None:
+    for index, metric in enumerate(metrics):
+        db.hset(METRICS_KEY, metric["name"], dumps(metric))
+        db.zadd(METRICS_INDEX_KEY, {metric["name"]: index})
+    db.set("metrics-version", version)
+
+
+def test_get_metrics_in_order(metric: dict):
+    db = FakeRedis()
+    metrics = [metric | {"name": "b"}, metric | {"name": "a"}]
+    store_metrics(db, metrics, 1)
+    assert get_metrics(db) == metrics
+
+
+def test_get_metrics_legacy_list(metric: dict):
+    db = FakeRedis()
+    db.set("metrics", dumps([metric]))
+    assert get_metrics(db) == [metric]
+
+
+def test_cache_reloads_only_on_change(metric: dict):
+    db = FakeRedis()
+    store_metrics(db, [metric], 1)
+    cache = MetricsCache(db, fallback_interval=3600)
+    assert cache.get() == [metric]
+    assert cache.version == 1
+
+    with patch.object(db, "get", wraps=db.get) as mock_get:
+        # No notification - configuration is not read again
+        assert cache.get() == [metric]
+        assert not mock_get.called
+
+        # Notification with the same version - only version is checked
+        cache._changed.set()
+        with patch.object(db, "hgetall") as mock_hgetall:
+            assert cache.get() == [metric]
+        assert [x.args[0] for x in mock_get.call_args_list] == ["metrics-version"]
+        assert not mock_hgetall.called
+
+
+def test_cache_reloads_after_fallback_interval(metric: dict):
+    db = FakeRedis()
+    cache = MetricsCache(db, fallback_interval=0)
+    assert cache.get() == []
+
+    store_metrics(db, [metric], 2)
+    assert cache.get() == [metric]
+    assert cache.version == 2
+
+
+def test_sync_related_ids():
+    db = FakeRedis()
+    assert sync_metric_related_ids(db, "m", {"m-0", "m-1"}) == set()
+    assert sync_metric_related_ids(db, "m", {"m-0"}) == {"m-1"}
+    assert get_metric_related_ids(db, "m") == {"m-0"}
+    assert sync_metric_related_ids(db, "m", set()) == {"m-0"}
+    assert get_metric_related_ids(db, "m") == set()
+
+
+def test_sync_related_ids_legacy_list():
+    db = FakeRedis()
+    db.set("mos-m", dumps(["m-0", "m-1"]))
+    assert get_metric_related_ids(db, "m") == {"m-0", "m-1"}
+    assert sync_metric_related_ids(db, "m", {"m-0"}) == {"m-1"}
+    assert db.get("mos-m") is None
+    assert get_metric_related_ids(db, "m") == {"m-0"}
+
+
+@patch("app.poller.delete_metric_by_id")
+def test_obsolete_groups_kept_until_deleted(mock_delete: MagicMock):
+    db = FakeRedis()
+    sync_metric_related_ids(db, "m", {"m-0", "m-1", "m-2"})
+    mock_delete.side_effect = lambda x: x == "m-2" and 1 / 0
+    delete_obsolete_groups(db, "m", {"m-0"})
+    assert mock_delete.call_count == 2
+    assert get_metric_related_ids(db, "m") == {"m-0", "m-2"}
+
+
+def test_processed_metrics_index():
+    db = FakeRedis()
+    db.set("processed-a", 1000)
+    db.set("processed-b", 2000)
+    migrate_processed_metrics(db)
+    mark_as_processed(db, "c")
+    assert db.get("processed-a") is None
+    assert get_processed_metric_names(db) == {"a", "b", "c"}
+    processed_at = get_last_processing_time(db, ["a", "b", "d"])
+    assert processed_at == {"a": 1000, "b": 2000, "d": 0}
+
+
+@patch("app.poller.delete_metric")
+def test_delete_obsolete_metrics(mock_delete: MagicMock, metric: dict):
+    db = FakeRedis()
+    for name in ("metric_1", "metric_2"):
+        mark_as_processed(db, name)
+        sync_metric_related_ids(db, name, {f"{name}-0"})
+    delete_obsolete_metrics(db, [metric])
+    assert mock_delete.call_args.args[1] == "metric_2"
+    assert get_processed_metric_names(db) == {"metric_1"}
+    assert get_metric_related_ids(db, "metric_2") == set()
+    assert get_metric_related_ids(db, "metric_1") == {"metric_1-0"}
+
+
+def test_obsolete_metrics_sweep_cadence():
+    sweep = ObsoleteMetricsSweep(3600)
+    assert sweep.is_due(1)
+    assert not sweep.is_due(1)
+    assert sweep.is_due(2)
+    sweep.swept_at = 0
+    assert sweep.is_due(2)
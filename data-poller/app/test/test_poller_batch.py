@@ -0,0 +1,209 @@
+from typing import List
+from unittest.mock import patch, MagicMock
+
+from ..poller import (
+    MetricBatch,
+    build_query_filter,
+    get_query_key,
+    process_metric,
+    process_metrics,
+)
+from .fake_redis import FakeRedis
+
+
+@patch("app.sinks.pushgateway.push_to_gateway")
+def test_batch_pushes_chunks(mock_push: MagicMock):
+    batch = MetricBatch("metric_1", "eqptIngrBytes5min", 2)
+    for i in range(5):
+        batch.add(f"dn-{i}/CDeqptIngrBytes5min", "unicastRate", str(i))
+    batch.flush()
+    assert mock_push.call_count == 3
+    assert batch.group_ids == {"metric_1-0", "metric_1-1", "metric_1-2"}
+    assert [x.kwargs["grouping_key"] for x in mock_push.call_args_list] == [
+        {"id": "metric_1-0"},
+        {"id": "metric_1-1"},
+        {"id": "metric_1-2"},
+    ]
+
+
+@patch("app.sinks.pushgateway.push_to_gateway")
+def test_batch_skips_empty_push(mock_push: MagicMock):
+    batch = MetricBatch("metric_1", "eqptIngrBytes5min", 2)
+    batch.flush()
+    assert not mock_push.called
+    assert batch.group_ids == set()
+
+
+@patch("app.sinks.pushgateway.delete_from_gateway")
+@patch("app.sinks.pushgateway.push_to_gateway")
+@patch("app.poller.aci_query")
+@patch("app.poller.mark_as_processed")
+def test_process_metric_single_push(
+    mock_mark: MagicMock,
+    mock_query: MagicMock,
+    mock_push: MagicMock,
+    mock_delete: MagicMock,
+    metric: dict,
+    aci_items: List[dict],
+):
+    mock_query.return_value = aci_items
+    db = FakeRedis()
+    db.sadd("related-metric_1", "metric_1-0", "metric_1-1")
+    process_metric(db, MagicMock(), metric)
+
+    assert mock_push.call_count == 1
+    registry = mock_push.call_args.kwargs["registry"]
+    assert (
+        registry.get_sample_value(
+            "metric_1",
+            {
+                "dn": "topology/pod-1/node-101/sys/phys-[eth1/2]/CD",
+                "attribute_name": "floodRate",
+                "fabric": "default",
+            },
+        )
+        == 2.0
+    )
+    assert mock_delete.call_count == 1
+    assert mock_delete.call_args.kwargs["grouping_key"] == {"id": "metric_1-1"}
+    assert db.smembers("related-metric_1") == {b"metric_1-0"}
+
+
+@patch("app.sinks.pushgateway.push_to_gateway")
+@patch("app.poller.aci_query")
+@patch("app.poller.mark_as_processed")
+def test_process_metrics_merged_query(
+    mock_mark: MagicMock,
+    mock_query: MagicMock,
+    mock_push: MagicMock,
+    metric: dict,
+    aci_items: List[dict],
+):
+    mock_query.return_value = aci_items
+    metrics = [
+        metric | {"queryFilter": 'eq(eqptIngrBytes5min.floodRate, "1")'},
+        metric | {"name": "metric_2", "attributes": ["floodRate"]},
+        metric | {"name": "metric_3", "queryFilter": 'gt(eqptIngrBytes5min.a, "1")'},
+    ]
+    assert len(set(get_query_key(x) for x in metrics)) == 2
+    process_metrics(FakeRedis(), MagicMock(), metrics[:2])
+
+    assert mock_query.call_count == 1
+    assert mock_query.call_args.args[2] == ""
+    assert mock_push.call_count == 2
+    pushed = {
+        x.kwargs["grouping_key"]["id"]: list(x.kwargs["registry"].collect())[0].samples
+        for x in mock_push.call_args_list
+    }
+    assert len(pushed["metric_1-0"]) == 2
+    assert len(pushed["metric_2-0"]) == 3
+    assert mock_mark.call_count == 2
+
+
+def test_build_query_filter(metric: dict):
+    assert build_query_filter([metric, metric]) == ""
+    assert (
+        build_query_filter(
+            [
+                metric | {"queryFilter": 'eq(a.b,"2")'},
+                metric | {"queryFilter": 'eq(a.b,"1")'},
+            ]
+        )
+        == 'or(eq(a.b,"1"),eq(a.b,"2"))'
+    )
+
+
+def test_query_key_uses_optimized_filter(metric: dict):
+    metrics = [
+        metric | {"queryFilter": 'gt(a.b, "1")'},
+        metric
+        | {
+            "queryFilter": 'and(and(gt(a.b, "1")))',
+            "optimizedQueryFilter": 'gt(a.b,"1")',
+        },
+        metric | {"queryFilter": 'gt(a.b, "1")', "optimizedQueryFilter": 'gt(a.b,"1")'},
+    ]
+    assert get_query_key(metrics[0]) != get_query_key(metrics[1])
+    assert get_query_key(metrics[1]) == get_query_key(metrics[2])
+    assert build_query_filter(metrics[1:]) == 'gt(a.b,"1")'
+
+
+@patch("app.sinks.pushgateway.push_to_gateway")
+def test_batch_skips_unchanged_groups(mock_push: MagicMock):
+    def run(values: List[str]) -> MetricBatch:
+        batch = MetricBatch("metric_1", "eqptIngrBytes5min", 2)
+        for i, value in enumerate(values):
+            batch.add(f"dn-{i}/CDeqptIngrBytes5min", "unicastRate", value)
+        batch.close()
+        return batch
+
+    run(["1", "2", "3"])
+    assert mock_push.call_count == 2
+
+    # Only the group with changed value is pushed, but all of them are kept
+    mock_push.reset_mock()
+    batch = run(["1", "2", "4"])
+    assert mock_push.call_count == 1
+    assert mock_push.call_args.kwargs["grouping_key"] == {"id": "metric_1-1"}
+    assert batch.group_ids == {"metric_1-0", "metric_1-1"}
+
+
+@patch("app.sinks.pushgateway.push_to_gateway")
+def test_batch_refreshes_stale_groups(mock_push: MagicMock, fingerprints):
+    batch = MetricBatch("metric_1", "eqptIngrBytes5min", 2)
+    batch.add("dn-1/CDeqptIngrBytes5min", "unicastRate", "1")
+    batch.close()
+    fingerprints.set(
+        "metric_1",
+        {k: (v[0], v[1] - 3600) for k, v in fingerprints.get("metric_1").items()},
+    )
+
+    batch = MetricBatch("metric_1", "eqptIngrBytes5min", 2)
+    batch.add("dn-1/CDeqptIngrBytes5min", "unicastRate", "1")
+    batch.close()
+    assert mock_push.call_count == 2
+
+
+@patch("app.sinks.pushgateway.delete_from_gateway")
+@patch("app.sinks.pushgateway.push_to_gateway")
+@patch("app.poller.aci_query")
+@patch("app.poller.mark_as_processed")
+def test_failed_metric_is_pushed_again(
+    mock_mark: MagicMock,
+    mock_query: MagicMock,
+    mock_push: MagicMock,
+    mock_delete: MagicMock,
+    metric: dict,
+    aci_items: List[dict],
+):
+    mock_query.return_value = aci_items
+    db = FakeRedis()
+    process_metric(db, MagicMock(), metric)
+    process_metric(db, MagicMock(), metric)
+    assert mock_push.call_count == 1
+
+    # Groups are deleted when the metric fails, so they can't be skipped then
+    mock_query.side_effect = Exception("APIC unavailable")
+    process_metric(db, MagicMock(), metric)
+    mock_query.side_effect = None
+    process_metric(db, MagicMock(), metric)
+    assert mock_push.call_count == 2
+
+
+@patch("app.sinks.pushgateway.push_to_gateway")
+def test_failed_group_is_pushed_again(mock_push: MagicMock, fingerprints):
+    def run() -> None:
+        batch = MetricBatch("metric_1", "eqptIngrBytes5min", 1)
+        for i in range(2):
+            batch.add(f"dn-{i}/CDeqptIngrBytes5min", "unicastRate", "1")
+        batch.close()
+
+    mock_push.side_effect = [None, IOError("unavailable")]
+    run()
+    assert set(fingerprints.get("metric_1")) == {"metric_1-0"}
+
+    # Only the group, that failed in the previous cycle, is pushed again
+    mock_push.side_effect = None
+    run()
+    assert mock_push.call_count == 3
+    assert mock_push.call_args.kwargs["grouping_key"] == {"id": "metric_1-1"}
@@ -0,0 +1,86 @@
+from unittest.mock import patch, MagicMock
+
+from flask.testing import FlaskClient
+
+from .. import create_app
+from ..poller import MetricBatch
+from ..store import store
+
+
+def test_metrics_disabled_in_push_mode(client: FlaskClient):
+    assert client.get("/metrics").status_code == 404
+
+
+def test_metrics_pull_mode():
+    config = {
+        "LOG_LEVEL": "INFO",
+        "DB_REDIS_URL": "redis://test-redis-url",
+        "PROMETHEUS_MODE": "pull",
+    }
+    client = create_app(config, lambda: None).test_client()
+
+    batch = MetricBatch("metric_1", "eqptFan", 2, mode="pull")
+    batch.add('sys/ch/ftslot-1/ft/fan-1/"eqptFan', "operSt", "1")
+    batch.add("sys/ch/ftslot-1/ft/fan-2/eqptFan", "operSt", "2")
+    batch.add("sys/ch/ftslot-1/ft/fan-3/eqptFan", "operSt", "3.5")
+    batch.close()
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.content_type.startswith("text/plain; version=0.0.4")
+    assert response.data.decode("utf-8") == (
+        "# HELP metric_1 \n"
+        "# TYPE metric_1 gauge\n"
+        'metric_1{dn="sys/ch/ftslot-1/ft/fan-1/\\"",attribute_name="operSt",'
+        'fabric="default"} 1.0\n'
+        'metric_1{dn="sys/ch/ftslot-1/ft/fan-2/",attribute_name="operSt",'
+        'fabric="default"} 2.0\n'
+        'metric_1{dn="sys/ch/ftslot-1/ft/fan-3/",attribute_name="operSt",'
+        'fabric="default"} 3.5\n'
+    )
+
+    store.delete("metric_1")
+    assert client.get("/metrics").data == b""
+
+
+@patch("app.sinks.pushgateway.push_to_gateway")
+def test_pull_mode_replaces_metric(mock_push: MagicMock):
+    for dns in (["a/eqptFan", "b/eqptFan"], ["b/eqptFan"]):
+        batch = MetricBatch("metric_2", "eqptFan", 10, mode="pull")
+        for dn in dns:
+            batch.add(dn, "operSt", "1")
+        batch.close()
+
+    assert not mock_push.called
+    assert store.render().decode("utf-8").splitlines()[2:] == [
+        'metric_2{dn="b/",attribute_name="operSt",fabric="default"} 1.0'
+    ]
+    store.delete("metric_2")
+
+
+@patch("app.sinks.pushgateway.push_to_gateway")
+def test_meta_metrics(mock_push: MagicMock, client: FlaskClient):
+    batch = MetricBatch("metric_meta", "eqptFan", 2)
+    for i in range(3):
+        batch.add(f"sys/ch/ftslot-1/ft/fan-{i}/eqptFan", "operSt", "1")
+    batch.close()
+
+    response = client.get("/meta/metrics")
+    assert response.status_code == 200
+    assert response.content_type.startswith("text/plain; version=0.0.4")
+    text = response.data.decode("utf-8")
+    assert 'aci_monitoring_poller_series_total{metric="metric_meta"} 3.0' in text
+    assert 'aci_monitoring_poller_push_seconds_count{metric="metric_meta"} 2.0' in text
+
+
+def test_pull_mode_dn_labels():
+    batch = MetricBatch(
+        "metric_4", "l1PhysIf", 10, mode="pull", dn_labels=("node", "interface")
+    )
+    batch.add("topology/pod-1/node-101/sys/phys-[eth1/2]", "speed", "10")
+    batch.close()
+    assert store.render().decode("utf-8").splitlines()[2:] == [
+        'metric_4{dn="topology/pod-1/node-101/sys/phys-[eth1/2]",'
+        'attribute_name="speed",node="101",interface="eth1/2",fabric="default"} 10.0'
+    ]
+    store.delete("metric_4")
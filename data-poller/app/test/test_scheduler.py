@@ -0,0 +1,161 @@
+import time
+from threading import Event
+from typing import List
+
+import pytest
+
+from ..instrumentation import registry
+from ..poller.scheduler import Scheduler, now_ms
+
+
+def test_scheduler_runs_due_metrics():
+    processed: List[str] = []
+    scheduler = Scheduler(lambda metrics: processed.append(metrics[0]["name"]), 2)
+    scheduler.update(
+        [{"name": "a", "interval": 1000}, {"name": "b", "interval": 1000}],
+        {"a": int(now_ms()) - 2000, "b": int(now_ms())},
+    )
+    assert "a" in scheduler and "c" not in scheduler
+    assert scheduler.run_pending() == 1
+    scheduler.shutdown()
+    assert processed == ["a"]
+    assert scheduler.lag["a"] > 0
+
+
+def test_scheduler_observes_lag_after_first_run():
+    def count():
+        return registry.get_sample_value(
+            "aci_monitoring_poller_scheduler_lag_seconds_count", {"metric": "lagged"}
+        )
+
+    scheduler = Scheduler(lambda metrics: None, 1)
+    scheduler.update([{"name": "lagged", "interval": 100}], {"lagged": 0})
+    scheduler.run_pending()
+    time.sleep(0.2)
+    assert count() is None
+    scheduler.run_pending()
+    scheduler.shutdown()
+    assert count() == 1
+    assert 0 < scheduler.lag["lagged"] < 1000
+
+
+def test_scheduler_does_not_wait_for_slow_metric():
+    release = Event()
+    processed: List[str] = []
+
+    def func(metrics: List[dict]):
+        if metrics[0]["name"] == "slow":
+            release.wait(5)
+        processed.append(metrics[0]["name"])
+
+    scheduler = Scheduler(func, 2)
+    scheduler.update(
+        [{"name": "slow", "interval": 60000}, {"name": "fast", "interval": 600}], {}
+    )
+    scheduler.run_pending()
+    time.sleep(0.7)
+    scheduler.run_pending()
+    time.sleep(0.1)
+    assert processed == ["fast", "fast"]
+    release.set()
+    scheduler.shutdown()
+    assert processed == ["fast", "fast", "slow"]
+
+
+def test_scheduler_reschedules_after_run():
+    processed_at = int(now_ms()) - 4000
+    scheduler = Scheduler(lambda metrics: None, 1)
+    scheduler.update(
+        [{"name": "a", "interval": 5000}, {"name": "b", "interval": 5000}],
+        {"a": processed_at, "b": processed_at - 6000},
+    )
+    # Overdue metric is due now
+    due_ms = scheduler.next_due()
+    assert processed_at < due_ms <= now_ms()
+    assert scheduler.run_pending() == 1
+    scheduler.shutdown()
+    assert scheduler._due == {"a": processed_at + 5000, "b": due_ms + 5000}
+
+
+def test_scheduler_forgets_deleted_metrics():
+    scheduler = Scheduler(lambda metrics: None, 1)
+    scheduler.update([{"name": "a", "interval": 5000}], {"a": 1000})
+    scheduler.update([], {})
+    assert "a" not in scheduler
+    assert scheduler.next_due() is None
+    assert scheduler.run_pending() == 0
+
+
+def test_scheduler_interval_change():
+    processed_at = int(now_ms()) - 1000
+    scheduler = Scheduler(lambda metrics: None, 1)
+    scheduler.update([{"name": "a", "interval": 5000}], {"a": processed_at})
+    scheduler.update([{"name": "a", "interval": 2000}], {})
+    assert scheduler.next_due() == processed_at + 2000
+
+
+@pytest.mark.parametrize("policy", ["skip", "queue"])
+def test_scheduler_new_metric_is_due_now(policy: str, caplog):
+    processed: List[str] = []
+    scheduler = Scheduler(lambda metrics: processed.append("a"), 1, policy)
+    started_ms = now_ms()
+    scheduler.update([{"name": "a", "interval": 5000}], {})
+    assert started_ms <= scheduler.next_due() <= now_ms()
+    assert scheduler.run_pending() == 1
+    scheduler.shutdown()
+
+    # First run is not an overlapping one, the next run waits for the interval
+    assert scheduler.run_pending() == 0
+    assert processed == ["a"]
+    assert scheduler.next_due() >= started_ms + 5000
+    assert "took longer than interval" not in caplog.text
+
+
+def test_scheduler_groups_metrics():
+    processed: List[List[str]] = []
+    scheduler = Scheduler(
+        lambda metrics: processed.append(sorted(x["name"] for x in metrics)),
+        2,
+        group_key=lambda metric: metric["className"],
+    )
+    current_ms = int(now_ms())
+    scheduler.update(
+        [
+            {"name": "a", "className": "x", "interval": 10000},
+            {"name": "b", "className": "x", "interval": 10000},
+            {"name": "c", "className": "y", "interval": 10000},
+            {"name": "d", "className": "x", "interval": 10000},
+            {"name": "e", "className": "x", "interval": 10000},
+        ],
+        {
+            "a": current_ms - 10000,
+            "b": current_ms - 10000,
+            "c": current_ms - 10000,
+            "d": current_ms - 9500,
+            "e": current_ms - 5000,
+        },
+    )
+    assert scheduler.run_pending() == 2
+    scheduler.shutdown()
+    assert sorted(processed) == [["a", "b", "d"], ["c"]]
+
+
+@pytest.mark.parametrize(
+    "policy,finished_ms,expected",
+    [
+        ("skip", 1500, 2000),
+        ("skip", 2500, 3000),
+        ("skip", 4200, 5000),
+        ("queue", 1500, 2000),
+        ("queue", 4200, 4200),
+    ],
+)
+def test_scheduler_overlap_policy(policy: str, finished_ms: int, expected: int):
+    scheduler = Scheduler(lambda metrics: None, 1, policy)
+    assert scheduler.next_slot(1000, 1000, finished_ms) == expected
+    scheduler.shutdown()
+
+
+def test_scheduler_invalid_policy():
+    with pytest.raises(ValueError):
+        Scheduler(lambda metrics: None, 1, "unknown")
@@ -0,0 +1,108 @@
+import time
+from threading import Thread
+from typing import List
+
+import pytest
+
+from .fake_apic import FakeApic
+from ..aci import aci_query
+from ..session import ApicSession
+
+
+def fan(index: int) -> dict:
+    return {"eqptFan": {"attributes": {"dn": f"fan-{index}"}}}
+
+
+@pytest.fixture()
+def apic():
+    with FakeApic({"eqptFan": [fan(1), fan(2)]}) as apic:
+        yield apic
+
+
+@pytest.fixture()
+def apic2():
+    with FakeApic({"eqptFan": [fan(1), fan(2)]}) as apic:
+        yield apic
+
+
+def test_session_login(apic: FakeApic):
+    session = ApicSession([apic.url], "user", "password")
+    assert len(list(aci_query(session, "eqptFan", ""))) == 2
+    assert apic.logins == 1
+    assert session.expires_at > time.time() + 500
+
+
+def test_session_refreshes_expiring_token(apic: FakeApic):
+    session = ApicSession([apic.url], "user", "password")
+    session.login()
+    session.expires_at = time.time() + 100
+    assert len(list(aci_query(session, "eqptFan", ""))) == 2
+    assert apic.requests == ["/api/aaaRefresh.json", "/api/node/class/eqptFan.json"]
+    assert session.token == apic.token == "fake-token-2"
+
+
+def test_session_logs_in_after_rejected_token(apic: FakeApic):
+    session = ApicSession([apic.url], "user", "password")
+    session.login()
+    apic.token = "other-token"
+    assert len(list(aci_query(session, "eqptFan", ""))) == 2
+    assert apic.logins == 2
+
+
+def test_session_logs_in_once_after_rejected_token(apic: FakeApic):
+    session = ApicSession([apic.url], "user", "password")
+    session.login()
+    apic.token = "other-token"
+    counts: List[int] = []
+    threads = [
+        Thread(
+            target=lambda: counts.append(len(list(aci_query(session, "eqptFan", ""))))
+        )
+        for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert counts == [2] * 8
+    assert apic.logins == 2
+
+
+def test_session_per_thread(apic: FakeApic):
+    session = ApicSession([apic.url], "user", "password")
+    sessions = [session.http]
+    thread = Thread(target=lambda: sessions.append(session.http))
+    thread.start()
+    thread.join()
+    assert session.http is sessions[0] and sessions[1] is not sessions[0]
+
+
+def test_session_failover(apic: FakeApic):
+    session = ApicSession(["http://127.0.0.1:1", apic.url], "user", "password")
+    for _ in range(3):
+        assert len(list(aci_query(session, "eqptFan", ""))) == 2
+    assert session.members[0].down_until > time.time()
+    assert session.api == apic.url
+
+
+def test_session_spreads_requests(apic: FakeApic, apic2: FakeApic):
+    session = ApicSession([apic.url, apic2.url], "user", "password")
+    session.login()
+    apic.token = apic2.token = session.token or ""
+    for _ in range(10):
+        assert len(list(aci_query(session, "eqptFan", ""))) == 2
+    assert apic.requests.count("/api/node/class/eqptFan.json") > 0
+    assert apic2.requests.count("/api/node/class/eqptFan.json") > 0
+
+
+def test_session_avoids_slow_member(apic: FakeApic, apic2: FakeApic):
+    session = ApicSession([apic.url, apic2.url], "user", "password")
+    session.members[0].latency = 2.0
+    session.members[1].latency = 0.01
+    assert session.api == apic2.url
+
+
+def test_session_no_members_available():
+    session = ApicSession(["http://127.0.0.1:1"], "user", "password")
+    with pytest.raises(ConnectionError):
+        session.login()
@@ -0,0 +1,225 @@
+import json
+import queue
+import struct
+from threading import Event, Thread
+from typing import List, Tuple
+from unittest.mock import MagicMock
+
+import pytest
+import snappy  # type: ignore
+
+from ..sinks import Chunk, Sink, SinkWriter
+from ..sinks.file import FileSink
+from ..sinks.remote_write import RemoteWriteSink
+
+
+def chunk(group_id: str, value: float = 1.0) -> Chunk:
+    return Chunk(
+        "metric_1",
+        "metric_1",
+        group_id,
+        ("dn", "attribute_name", "fabric"),
+        [("sys/fan-1/", "operSt", value), ("sys/fan-2/", "operSt", 2.0)],
+        "default",
+        1700000000000,
+    )
+
+
+class RecordingSink(Sink):
+    def __init__(self, keeps_groups: bool = False):
+        self.keeps_groups = keeps_groups
+        self.calls: List[Tuple[str, list]] = []
+
+    def write(self, chunks: List[Chunk]) -> None:
+        self.calls.append(("write", [(x.group_id, x.samples[0][-1]) for x in chunks]))
+
+    def delete(self, group_ids: List[str]) -> None:
+        self.calls.append(("delete", group_ids))
+
+
+def test_writer_coalesces_superseded_groups():
+    sink = RecordingSink(keeps_groups=True)
+    writer = SinkWriter(sink, queue_size=0)
+    operations = [
+        ("write", chunk("m-0", 1.0), MagicMock()),
+        ("write", chunk("m-1", 1.0), MagicMock()),
+        ("write", chunk("m-0", 2.0), MagicMock()),
+        ("delete", "m-1", MagicMock()),
+    ]
+    writer._process(operations)  # type: ignore
+    assert sink.calls == [("write", [("m-0", 2.0)]), ("delete", ["m-1"])]
+    assert all(x[2].set_result.called for x in operations)
+
+
+def test_writer_keeps_all_chunks_with_timestamps():
+    sink = RecordingSink()
+    writer = SinkWriter(sink, queue_size=0)
+    for value in (1.0, 2.0):
+        writer.write(chunk("m-0", value))
+    writer.delete("m-0")
+    assert sink.calls == [
+        ("write", [("m-0", 1.0)]),
+        ("write", [("m-0", 2.0)]),
+        ("delete", ["m-0"]),
+    ]
+
+
+def test_writer_batches_in_background():
+    sink = RecordingSink()
+    writer = SinkWriter(sink, queue_size=10, workers=1, batch_size=10)
+    started = Event()
+    release = Event()
+    write = sink.write
+
+    def slow_write(chunks: List[Chunk]) -> None:
+        started.set()
+        release.wait(5)
+        write(chunks)
+
+    sink.write = slow_write  # type: ignore
+    writer.write(chunk("m-0"))
+    started.wait(5)
+
+    # Chunks queued while the sink is busy are written at once
+    futures = [writer.write(chunk(f"m-{i}")) for i in range(1, 4)]
+    release.set()
+    for future in futures:
+        future.result(5)
+    writer.close()
+    assert sink.calls == [
+        ("write", [("m-0", 1.0)]),
+        ("write", [("m-1", 1.0), ("m-2", 1.0), ("m-3", 1.0)]),
+    ]
+
+
+def test_writer_applies_backpressure():
+    sink = RecordingSink()
+    release = Event()
+    sink.write = lambda chunks: release.wait(5)  # type: ignore
+    writer = SinkWriter(sink, queue_size=1, workers=1)
+    writer.write(chunk("m-0"))
+    writer.write(chunk("m-1"))
+    with pytest.raises(queue.Full):
+        for i in range(2, 4):
+            writer.write(chunk(f"m-{i}"), block=False)
+    release.set()
+    writer.close()
+
+
+def test_writer_reports_errors():
+    sink = RecordingSink()
+    sink.delete = MagicMock(side_effect=IOError("unavailable"))  # type: ignore
+    writer = SinkWriter(sink, queue_size=0)
+    with pytest.raises(IOError):
+        writer.delete("m-0").result()
+
+
+def read_varint(data: bytes, offset: int) -> Tuple[int, int]:
+    value = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        shift += 7
+        if byte < 0x80:
+            return value, offset
+
+
+def read_fields(data: bytes) -> List[Tuple[int, bytes]]:
+    fields = []
+    offset = 0
+    while offset < len(data):
+        tag, offset = read_varint(data, offset)
+        if tag & 7 == 2:
+            size, offset = read_varint(data, offset)
+            fields.append((tag >> 3, data[offset : offset + size]))
+            offset += size
+        elif tag & 7 == 1:
+            fields.append((tag >> 3, data[offset : offset + 8]))
+            offset += 8
+        else:
+            value, offset = read_varint(data, offset)
+            fields.append((tag >> 3, value.to_bytes(8, "little")))
+    return fields
+
+
+def test_remote_write_sink_encodes_samples():
+    sink = RemoteWriteSink("http://prometheus/api/v1/write")
+    sink._local.session = http = MagicMock()
+    http.request.return_value.status_code = 204
+    sink.write([chunk("m-0")])
+
+    request = http.request.call_args
+    assert request.kwargs["headers"]["Content-Encoding"] == "snappy"
+    timeseries = read_fields(snappy.decompress(request.kwargs["data"]))
+    assert len(timeseries) == 2
+    fields = read_fields(timeseries[0][1])
+    labels = [
+        tuple(value.decode() for _, value in read_fields(data))
+        for tag, data in fields
+        if tag == 1
+    ]
+    assert labels == [
+        ("__name__", "metric_1"),
+        ("attribute_name", "operSt"),
+        ("dn", "sys/fan-1/"),
+        ("fabric", "default"),
+    ]
+    sample = dict(read_fields(fields[-1][1]))
+    assert struct.unpack("<d", sample[1]) == (1.0,)
+    assert int.from_bytes(sample[2], "little") == 1700000000000
+
+
+def test_remote_write_sink_raises_on_error():
+    sink = RemoteWriteSink("http://prometheus/api/v1/write")
+    sink._local.session = http = MagicMock()
+    http.request.return_value.status_code = 400
+    with pytest.raises(IOError):
+        sink.write([chunk("m-0")])
+
+
+def test_http_sink_session_per_thread():
+    sink = RemoteWriteSink("http://prometheus/api/v1/write")
+    sessions = [sink.http]
+    thread = Thread(target=lambda: sessions.append(sink.http))
+    thread.start()
+    thread.join()
+    assert sink.http is sessions[0] and sessions[1] is not sessions[0]
+    sink.close()
+    assert sink._sessions == []
+
+
+def test_sink_requires_write():
+    with pytest.raises(TypeError):
+        Sink()  # type: ignore
+
+
+def test_file_sink_formats(tmp_path):
+    path = tmp_path / "metrics.json"
+    sink = FileSink(str(path))
+    sink.write([chunk("m-0")])
+    sink.close()
+    lines = [json.loads(x) for x in path.read_text().splitlines()]
+    assert lines[0] == {
+        "name": "metric_1",
+        "labels": {"dn": "sys/fan-1/", "attribute_name": "operSt", "fabric": "default"},
+        "value": 1.0,
+        "timestamp": 1700000000000,
+    }
+
+    path = tmp_path / "metrics.txt"
+    sink = FileSink(str(path), "openmetrics")
+    sink.write([chunk("m-0")])
+    sink.close()
+    assert path.read_text().splitlines() == [
+        'metric_1{dn="sys/fan-1/",attribute_name="operSt",fabric="default"} '
+        "1.0 1700000000.0",
+        'metric_1{dn="sys/fan-2/",attribute_name="operSt",fabric="default"} '
+        "2.0 1700000000.0",
+    ]
+
+    # Restarted poller appends to the file
+    sink = FileSink(str(path), "openmetrics")
+    sink.write([chunk("m-0", 3.0)])
+    sink.close()
+    assert len(path.read_text().splitlines()) == 4
@@ -0,0 +1,98 @@
+import time
+from typing import Callable
+
+import pytest
+
+from .fake_apic import FakeApic
+from ..session import ApicSession
+from ..subscription import SubscriptionManager
+
+
+def fan(index: int, **attributes) -> dict:
+    return {"eqptFan": {"attributes": {"dn": f"fan-{index}", **attributes}}}
+
+
+def wait_for(condition: Callable[[], bool]) -> None:
+    deadline = time.time() + 5
+    while not condition():
+        assert time.time() < deadline, "condition not met in time"
+        time.sleep(0.01)
+
+
+@pytest.fixture()
+def apic():
+    with FakeApic({"eqptFan": [fan(1, operSt="up"), fan(2, operSt="up")]}) as apic:
+        yield apic
+
+
+@pytest.fixture()
+def session(apic: FakeApic):
+    session = ApicSession([apic.url], "user", "password")
+    session.login()
+    return session
+
+
+def dns(items: list) -> dict:
+    return {
+        x["eqptFan"]["attributes"]["dn"]: x["eqptFan"]["attributes"]["operSt"]
+        for x in items
+    }
+
+
+def test_subscription_applies_events(apic: FakeApic, session: ApicSession):
+    manager = SubscriptionManager(session)
+    subscription = manager.get("eqptFan", "")
+    assert subscription is not None
+    assert dns(subscription.items()) == {"fan-1": "up", "fan-2": "up"}
+    assert manager.get("eqptFan", "") is subscription
+
+    apic.send_event(
+        subscription.id or "",
+        [
+            fan(1, operSt="down", status="modified"),
+            fan(2, status="deleted"),
+            fan(3, operSt="up", status="created"),
+        ],
+    )
+    wait_for(lambda: dns(subscription.items()) == {"fan-1": "down", "fan-3": "up"})
+    assert apic.subscriptions == {subscription.id: "eqptFan"}
+    manager.close()
+
+
+def test_subscription_ignores_other_ids(apic: FakeApic, session: ApicSession):
+    manager = SubscriptionManager(session)
+    subscription = manager.get("eqptFan", "")
+    assert subscription is not None
+    apic.send_event("unknown", [fan(4, operSt="up", status="created")])
+    apic.send_event(subscription.id or "", [fan(5, operSt="up", status="created")])
+    wait_for(lambda: "fan-5" in dns(subscription.items()))
+    assert "fan-4" not in dns(subscription.items())
+    manager.close()
+
+
+def test_subscription_refresh(apic: FakeApic, session: ApicSession):
+    manager = SubscriptionManager(session, refresh_interval=0.1)
+    subscription = manager.get("eqptFan", "")
+    assert subscription is not None
+    wait_for(lambda: len(apic.refreshed) >= 2)
+    assert set(apic.refreshed) == {subscription.id}
+    manager.close()
+
+
+def test_subscription_reopened_after_disconnect(apic: FakeApic, session: ApicSession):
+    manager = SubscriptionManager(session, retry_delay=0)
+    subscription = manager.get("eqptFan", "")
+    assert subscription is not None
+    apic.close_sockets()
+    wait_for(lambda: not subscription.active)
+    reopened = manager.get("eqptFan", "")
+    assert reopened is not None and reopened is not subscription
+    assert len(apic.subscriptions) == 2
+    manager.close()
+
+
+def test_subscription_fallback(apic: FakeApic, session: ApicSession):
+    session.token = "invalid-token"
+    manager = SubscriptionManager(session)
+    assert manager.get("eqptFan", "") is None
+    assert apic.subscriptions == {}
@@ -0,0 +1,156 @@
+"""
+End-to-end benchmark of the Data Poller, against local stand-ins
+of the APIC, the Push Gateway and Redis.
+
+Every case of the matrix runs in a fresh process, so the peak memory usage
+is measured separately for each of them. Run from the data-poller directory:
+
+    python -m benchmark --metrics 1,10 --mos 1000,10000 --output results.json
+"""
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from .cases import Case, run_case
+
+
+def parse_list(value: str, kind: type = int) -> list:
+    return [kind(x) for x in value.split(",") if x.strip()]
+
+
+def get_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def run_isolated(case: Case) -> dict:
+    """
+    Run benchmark case in a separate process.
+
+    :param case: benchmark case
+    :return: case results
+    """
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(1, maxtasksperchild=1) as pool:
+        return pool.apply(run_case, (case,))
+
+
+def compare(results: List[dict], baseline_path: str, tolerance: float) -> List[str]:
+    """
+    Compare throughput with results of the previous run.
+
+    :param results: current results
+    :param baseline_path: path to JSON results of the previous run
+    :param tolerance: allowed relative throughput drop
+    :return: descriptions of regressions
+    """
+    with open(baseline_path) as file:
+        baseline = {x["id"]: x for x in json.load(file)["results"]}
+    regressions = []
+    for result in results:
+        previous = baseline.get(result["id"])
+        if previous is None or not previous["series_per_second"]:
+            continue
+        ratio = result["series_per_second"] / previous["series_per_second"]
+        if ratio < 1 - tolerance:
+            regressions.append(f"{result['id']}: throughput {ratio:.0%} of baseline")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--metrics", default="1,10", help="numbers of metrics")
+    parser.add_argument("--mos", default="1000,10000", help="numbers of MOs per class")
+    parser.add_argument("--intervals", default="1000", help="metric intervals in ms")
+    parser.add_argument("--engines", default="threaded", help="threaded and asyncio")
+    parser.add_argument("--cycles", type=int, default=5, help="cycles of each case")
+    parser.add_argument("--latency", type=float, default=0.0, help="APIC latency (s)")
+    parser.add_argument("--payload", type=int, default=0, help="extra bytes per MO")
+    parser.add_argument("--page-size", type=int, default=5000, help="APIC page size")
+    parser.add_argument("--workers", type=int, default=16, help="POLLER_WORKERS")
+    parser.add_argument(
+        "--max-staleness",
+        type=float,
+        default=0,
+        help="POLLER_MAX_STALENESS, 0 pushes unchanged series in every cycle",
+    )
+    parser.add_argument("--redis-url", help="dedicated Redis database, or in-memory")
+    parser.add_argument("--output", default="benchmark-results.json")
+    parser.add_argument("--baseline", help="previous results to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    cases = [
+        Case(
+            engine=engine,
+            metrics=metrics,
+            mos=mos,
+            interval=interval,
+            cycles=args.cycles,
+            latency=args.latency,
+            payload=args.payload,
+            page_size=args.page_size,
+            workers=args.workers,
+            redis_url=args.redis_url,
+            max_staleness=args.max_staleness,
+        )
+        for engine, metrics, mos, interval in itertools.product(
+            parse_list(args.engines, str),
+            parse_list(args.metrics),
+            parse_list(args.mos),
+            parse_list(args.intervals),
+        )
+    ]
+
+    results = []
+    for case in cases:
+        result = run_isolated(case)
+        results.append(result)
+        print(
+            f"{result['id']:<48} {result['series_per_second']:>12.0f} series/s"
+            f" cycle p95 {result['cycle_seconds']['p95']:.3f}s"
+            f" lag p95 {result['lag_seconds']['p95']:.3f}s"
+            f" peak RSS {result['peak_rss_mb']:.0f} MB",
+            flush=True,
+        )
+
+    with open(args.output, "w") as file:
+        json.dump(
+            {
+                "commit": get_commit(),
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpus": os.cpu_count(),
+                "results": results,
+            },
+            file,
+            indent=2,
+        )
+
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    started_at = time.perf_counter()
+    code = main()
+    print(f"finished in {time.perf_counter() - started_at:.1f}s")
+    sys.exit(code)
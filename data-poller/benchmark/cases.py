@@ -0,0 +1,217 @@
+import asyncio
+import os
+import resource
+import statistics
+import time
+from dataclasses import asdict, dataclass
+from typing import Dict, List, Optional, Union
+
+import redis
+
+from app.test.fake_apic import FakeApic
+from app.test.fake_pushgateway import FakePushGateway
+from app.test.fake_redis import FakeRedis
+
+
+Database = Union[redis.Redis, FakeRedis]
+
+
+@dataclass
+class Case:
+    engine: str
+    metrics: int
+    mos: int
+    interval: int
+    cycles: int
+    latency: float
+    payload: int
+    page_size: int
+    workers: int
+    redis_url: Optional[str] = None
+    max_staleness: float = 0
+
+    @property
+    def id(self) -> str:
+        return f"{self.engine}-metrics{self.metrics}-mos{self.mos}-{self.interval}ms"
+
+
+def build_mos(class_name: str, count: int, payload: int) -> List[dict]:
+    """
+    Build synthetic MOs with two numeric attributes, and optional padding.
+
+    :param class_name: class name
+    :param count: number of MOs
+    :param payload: number of extra bytes in every MO
+    :return: MOs in the APIC response format
+    """
+    padding = "x" * payload
+    return [
+        {
+            class_name: {
+                "attributes": {
+                    "dn": f"topology/pod-1/node-{100 + i % 200}/sys/phys-[eth1/{i}]"
+                    f"/{class_name}",
+                    "unicastRate": str(i * 1.5),
+                    "floodRate": str(i % 7),
+                    "descr": padding,
+                }
+            }
+        }
+        for i in range(count)
+    ]
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {"p50": 0, "p95": 0, "max": 0}
+    ordered = sorted(values)
+    return {
+        "p50": statistics.median(ordered),
+        "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        "max": ordered[-1],
+    }
+
+
+def run_case(case: Case) -> dict:
+    """
+    Run the poller against local stand-ins for the time of configured cycles.
+    Should be called in a fresh process, as it configures the poller.
+
+    :param case: benchmark case
+    :return: case parameters and measurements
+    """
+    class_names = [f"benchClass{i}" for i in range(case.metrics)]
+    mos = {x: build_mos(x, case.mos, case.payload) for x in class_names}
+    with FakeApic(mos, case.latency) as apic, FakePushGateway() as pushgateway:
+        os.environ.update(
+            {
+                "DB_REDIS_URL": "redis://benchmark",
+                "PROMETHEUS_PUSHGATEWAY_URL": pushgateway.url,
+                "ACI_URL": apic.url,
+                "ACI_USERNAME": "benchmark",
+                "ACI_PASSWORD": "benchmark",
+                "ACI_PAGE_SIZE": str(case.page_size),
+                "POLLER_WORKERS": str(case.workers),
+                "POLLER_MAX_STALENESS": str(case.max_staleness),
+                "LOG_LEVEL": "WARNING",
+            }
+        )
+        # Poller reads the configuration on import
+        from app.instrumentation import registry
+
+        metrics: List[dict] = [
+            {
+                "name": f"bench_{i}",
+                "className": class_name,
+                "attributes": ["unicastRate", "floodRate"],
+                "queryFilter": "",
+                "interval": case.interval,
+            }
+            for i, class_name in enumerate(class_names)
+        ]
+        db = redis.Redis.from_url(case.redis_url) if case.redis_url else FakeRedis()
+        duration = case.cycles * case.interval / 1000
+        if case.engine == "asyncio":
+            cycles, lags, elapsed = asyncio.run(run_async(db, metrics, duration))
+        else:
+            cycles, lags, elapsed = run_threaded(db, metrics, duration)
+
+        # Wait for chunks still queued for the Push Gateway
+        from app.poller import writer
+
+        writer.close()
+
+        series = skipped = 0.0
+        for metric in metrics:
+            labels = {"metric": metric["name"]}
+            value = registry.get_sample_value(
+                "aci_monitoring_poller_series_total", labels
+            )
+            series += value or 0
+            value = registry.get_sample_value(
+                "aci_monitoring_poller_series_skipped_total", labels
+            )
+            skipped += value or 0
+        pushes = sum(1 for method, _ in pushgateway.requests if method == "PUT")
+
+    return asdict(case) | {
+        "id": case.id,
+        "series": series,
+        "skipped_series": skipped,
+        "pushes": pushes,
+        "apic_requests": len(apic.requests),
+        "elapsed_seconds": elapsed,
+        "series_per_second": series / elapsed if elapsed else 0,
+        "cycle_seconds": summarize(cycles),
+        "lag_seconds": summarize(lags),
+        # Linux reports kilobytes
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def get_processed_at(metrics: List[dict]) -> Dict[str, int]:
+    """
+    Mark metrics as processed an interval ago, so the first run is due now.
+    """
+    now = int(time.time() * 1000)
+    return {metric["name"]: now - metric["interval"] for metric in metrics}
+
+
+def run_threaded(db: Database, metrics: List[dict], duration: float):
+    from app.poller import get_query_key, get_sleep_time, process_metrics
+    from app.poller.scheduler import Scheduler
+    from app.config import ACI_URL, POLLER_WORKERS
+    from app.session import ApicSession
+
+    session = ApicSession(ACI_URL.split(","), "benchmark", "benchmark")
+    session.login()
+    cycles: List[float] = []
+    lags: List[float] = []
+
+    def func(group: List[dict]) -> None:
+        lags.extend(scheduler.lag[metric["name"]] / 1000 for metric in group)
+        started_at = time.perf_counter()
+        process_metrics(db, session, group)  # type: ignore
+        cycles.append(time.perf_counter() - started_at)
+
+    scheduler = Scheduler(func, POLLER_WORKERS, group_key=get_query_key)
+    scheduler.update(metrics, get_processed_at(metrics))
+    started_at = time.perf_counter()
+    while time.perf_counter() - started_at < duration:
+        scheduler.run_pending()
+        time.sleep(get_sleep_time(scheduler))
+    scheduler.shutdown()
+    return cycles, lags, time.perf_counter() - started_at
+
+
+async def run_async(db: Database, metrics: List[dict], duration: float):
+    from app.poller import get_query_key, get_sleep_time
+    from app.poller.aio import (
+        AsyncApicSession,
+        AsyncScheduler,
+        create_http_session,
+        process_metrics_async,
+    )
+    from app.config import ACI_URL, POLLER_ASYNC_TASKS
+
+    cycles: List[float] = []
+    lags: List[float] = []
+    async with create_http_session() as http:
+        session = AsyncApicSession(http, ACI_URL.split(","), "benchmark", "benchmark")
+        await session.login()
+
+        async def func(group: List[dict]) -> None:
+            lags.extend(scheduler.lag[metric["name"]] / 1000 for metric in group)
+            started_at = time.perf_counter()
+            await process_metrics_async(db, session, group)  # type: ignore
+            cycles.append(time.perf_counter() - started_at)
+
+        scheduler = AsyncScheduler(func, POLLER_ASYNC_TASKS, group_key=get_query_key)
+        scheduler.update(metrics, get_processed_at(metrics))
+        started_at = time.perf_counter()
+        while time.perf_counter() - started_at < duration:
+            scheduler.run_pending()
+            await asyncio.sleep(get_sleep_time(scheduler))
+        while scheduler._tasks:
+            await asyncio.sleep(0.01)
+    return cycles, lags, time.perf_counter() - started_at
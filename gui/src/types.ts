@@ -1,7 +1,28 @@
+export type DnLabel =
+  | 'pod'
+  | 'node'
+  | 'tenant'
+  | 'ap'
+  | 'epg'
+  | 'bd'
+  | 'vrf'
+  | 'l3out'
+  | 'interface';
+
 export interface Metric {
   name: string;
   className: string;
   attributes: string[];
   queryFilter: string;
+  optimizedQueryFilter?: string;
   interval: number;
+  mode?: 'poll' | 'subscribe';
+  includeHealth?: boolean;
+  fabrics?: string[];
+  dnLabels?: DnLabel[];
+  aggregation?: {
+    function: 'sum' | 'avg' | 'min' | 'max' | 'count';
+    by?: DnLabel[];
+  };
+  converter?: 'float' | 'int' | 'bool' | Record<string, number>;
 }